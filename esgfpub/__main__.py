@@ -5,6 +5,7 @@ import warnings
 warnings.simplefilter('ignore')
 from shutil import rmtree
 from esgfpub.util import parse_args
+from esgfpub.log import setup_logging
 import os
 from sys import exit as sysexit
 
@@ -12,6 +13,12 @@ from sys import exit as sysexit
 def main():
 
     ARGS = parse_args()
+    setup_logging(
+        level='DEBUG' if getattr(ARGS, 'debug', False) else ARGS.log_level,
+        fmt=ARGS.log_format,
+        path=ARGS.log_file,
+        asynchronous=ARGS.async_log,
+        levels=ARGS.log_levels)
     subcommand = ARGS.subparser_name
     if subcommand == 'check':
         
@@ -31,14 +38,26 @@ def main():
             loop=ARGS.loop,
             sproket=ARGS.sproket,
             logpath=ARGS.logs,
+            search_cache=ARGS.search_cache,
+            no_search_cache=ARGS.no_search_cache,
+            num_publishers=ARGS.max_publish,
+            num_checkers=ARGS.max_checks,
+            poll_interval=ARGS.poll_interval,
             debug=ARGS.debug)
     elif subcommand == 'custom':
         
         from esgfpub.custom_facets import update_custom
-        update_custom(
+        return update_custom(
             facets=ARGS.facets,
             datadir=ARGS.datadir,
             dataset_ids=ARGS.dataset_ids,
+            index_node=ARGS.index_node,
+            data_node=ARGS.data_node,
+            cert=ARGS.cert,
+            max_requests=ARGS.max_requests,
+            batch=not ARGS.no_batch,
+            walk_workers=ARGS.walk_workers,
+            stop_at_version=ARGS.stop_at_version,
             debug=ARGS.debug)
     else:
         raise ValueError("Unrecognized subcommand")
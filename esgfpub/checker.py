@@ -8,17 +8,28 @@ logger.setLevel(logging.ERROR)
 from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from esgfpub.util import print_message
-from esgfpub.verify import verify_dataset
-from tempfile import NamedTemporaryFile
-from subprocess import Popen, PIPE
+from esgfpub.log import get_logger, enable_debug
+from esgfpub.indexer import index_tree
+from esgfpub.filenames import parse_filename, parse_start_end
+from esgfpub.results import ResultWriter, read_results
+from esgfpub.journal import Journal, JOURNAL, run_key
+from esgfpub.ledger import Ledger, LEDGER, fingerprint
+from esgfpub.spec import load_spec, as_spec
+from esgfpub.manifest import Manifest, MANIFEST
+from esgfpub.search import SearchClient, SearchCache, SEARCH_API, SEARCH_CACHE
+from esgfpub.plots import PlotQueue, render_seasonal_decomp, render_report, save_series
 from tqdm import tqdm
-import numpy as np
-import matplotlib.pyplot as plt
-import re
-import json
-import yaml
 import os
 
+log = get_logger(__name__)
+
+# the check options that decide which datasets a run checks and how, runs with
+# different values keep separate entries in the checkpoint journal
+JOURNAL_SCOPE = [
+    'projects', 'experiments', 'variables', 'tables', 'ens', 'dataset_ids', 'model_versions',
+    'data_types', 'data_version', 'exclude', 'published', 'search_api', 'file_system', 'data_path',
+    'verify', 'spec_path']
+
 SEASONS = [{
     'name': 'ANN',
     'start': '01',
@@ -43,17 +54,11 @@ SEASONS = [{
 
 
 def get_cmip_start_end(filename):
-    if 'clim' in filename:
-        return int(filename[-21:-17]), int(filename[-14: -10])
-    else:
-        return int(filename[-16:-12]), int(filename[-9: -5])
+    return parse_start_end(filename)
 
 
 def get_e3sm_start_end(filename):
-    if 'climo' in filename:
-        return int(filename[-22:-18]), int(filename[-15: -11])
-    else:
-        return int(filename[-16:-12]), int(filename[-9: -5])
+    return parse_start_end(filename)
 
 
 def check_spans(files, start, end, dataset_id):
@@ -87,6 +92,7 @@ def check_spans(files, start, end, dataset_id):
     if file_end != end:
         missing.append(f"{dataset_id}-{file_start:04d}-{end:04d}")
 
+    files_found = set(files_found)
     extra_files = [x for x in files if x not in files_found]
     return missing, extra_files
 
@@ -101,17 +107,10 @@ def infer_start_end_cmip(files):
     pbo_Omon_E3SM-1-1-ECA_hist-bgc_r1i1p1f1_gr_185001-185412.nc' 
     """
     files = sorted(files)
-    first, last = files[0], files[-1]
-    p = r'\d{6}-\d{6}'
-    idx = re.search(pattern=p, string=first)
-    if not idx:
+    first, last = parse_filename(files[0]), parse_filename(files[-1])
+    if first is None or last is None or not first.start or not last.end:
         return None, None
-    start = int(first[idx.start(): idx.start() + 4])
-
-    idx = re.search(pattern=p, string=last)
-    end = int(last[idx.start() + 7: idx.start() + 11])
-
-    return start, end
+    return first.start_year, last.end_year
 
 
 def infer_start_end_e3sm(files):
@@ -121,113 +120,100 @@ def infer_start_end_e3sm(files):
     last file
     """
     f = sorted(files)
-    p = r'\.\d{4}-\d{2}'
-    idx = re.search(pattern=p, string=f[0])
-    if not idx:
+    first, last = parse_filename(f[0]), parse_filename(f[-1])
+    if first is None or last is None or first.kind != 'time-slice' or last.kind != 'time-slice':
         return None, None
-    start = int(f[0][idx.start() + 1: idx.start() + 5])
-
-    idx = re.search(pattern=p, string=f[-1])
-    end = int(f[-1][idx.start() + 1: idx.start() + 5])
-
-    return start, end
+    return first.start_year, last.start_year
 
 
 def infer_start_end_climo(files):
     f = sorted(files)
-    p = r'_\d{6}_\d{6}_'
-    idx = re.search(pattern=p, string=f[0])
-    start = int(f[0][idx.start() + 1: idx.start() + 5])
+    start, _ = parse_start_end(f[0])
+    _, end = parse_start_end(f[-1])
+    return start, end
 
-    idx = re.search(pattern=p, string=f[-1])
-    end = int(f[-1][idx.start() + 8: idx.start() + 12])
 
-    return start, end
+def check_expected(files, expected):
+    """
+    Compare a list of files against the list of expected file names
 
+    returns: missing (list, in the order of expected), extra (list, in the order of files)
+    """
+    present = set(files)
+    expected_set = set(expected)
+    missing = [name for name in expected if name not in present]
+    extra_files = [x for x in files if x not in expected_set]
+    return missing, extra_files
 
-def check_monthly(files, start=None, end=None):
 
-    missing = []
-    files_found = []
+def check_monthly(files, start=None, end=None):
 
-    pattern = r'\d{4}-\d{2}.*nc'
-    idx = re.search(pattern=pattern, string=files[0])
-    if not idx:
+    parsed = parse_filename(files[0])
+    if parsed is None or parsed.kind != 'time-slice':
         print_message(f'Unexpected file format: {files[0]}', 'error')
         return [], []
-    prefix = files[0][:idx.start()]
-    suffix = files[0][idx.start() + 7:]
+    # keep the directory or url the files were listed with
+    head, _ = os.path.split(files[0])
+    prefix, suffix = os.path.join(head, parsed.prefix), parsed.suffix
 
     if not start or not end:
         start, end = infer_start_end_e3sm(files)
 
-    for year in range(start, end + 1):
-        for month in range(1, 13):
-            name = f'{prefix}{year:04d}-{month:02d}{suffix}'
-            if name not in files:
-                missing.append(name)
-            else:
-                files_found.append(name)
-
-    extra_files = [x for x in files if x not in files_found]
-    return missing, extra_files
+    expected = [
+        f'{prefix}{year:04d}-{month:02d}{suffix}'
+        for year in range(start, end + 1)
+        for month in range(1, 13)]
+    return check_expected(files, expected)
 
 
 def check_climos(files, start, end):
-    missing = []
-    files_found = []
 
-    pattern = r'_\d{6}_\d{6}_climo.nc'
     files = sorted(files)
-    idx = re.search(pattern=pattern, string=files[0])
-    if not idx:
+    parsed = parse_filename(files[0])
+    if parsed is None or parsed.kind != 'climo':
         raise ValueError(f'Unexpected file format: {files[0]}')
-    prefix = files[0][:idx.start() - 2]
+    head, _ = os.path.split(files[0])
+    prefix = os.path.join(head, f'{parsed.case}_')
 
     if not start or not end:
         start, end = infer_start_end_climo(files)
 
     start, end = get_e3sm_start_end(files[0])
 
-    for month in range(1, 13):
-        name = f'{prefix}{month:02d}_{start:04d}{month:02d}_{end:04d}{month:02d}_climo.nc'
-        if name not in files:
-            missing.append(name)
-        else:
-            files_found.append(name)
-
-    for season in SEASONS:
-        name = f'{prefix}{season["name"]}_{start:04d}{season["start"]}_{end:04d}{season["end"]}_climo.nc'
-        if name not in files:
-            missing.append(name)
-        else:
-            files_found.append(name)
-    extra_files = [x for x in files if x not in files_found]
-    return missing, extra_files
+    expected = [
+        f'{prefix}{month:02d}_{start:04d}{month:02d}_{end:04d}{month:02d}_climo.nc'
+        for month in range(1, 13)]
+    expected.extend(
+        f'{prefix}{season["name"]}_{start:04d}{season["start"]}_{end:04d}{season["end"]}_climo.nc'
+        for season in SEASONS)
+    return check_expected(files, expected)
 
 
 def check_submonthly(files, start, end, debug=False):
 
     missing, extra = list(), list()
-    pattern = r'\d{4}-\d{2}.*nc'
-    first = files[0]
-    idx = re.search(pattern=pattern, string=first)
-    if not idx:
-        raise ValueError(f'Unexpected file format: {first}')
+    first = parse_filename(files[0])
+    if first is None or first.kind != 'time-slice':
+        raise ValueError(f'Unexpected file format: {files[0]}')
     if not start or not end:
         start, end = infer_start_end_e3sm(files)
 
-    prefix = first[:idx.start()]
+    head, _ = os.path.split(files[0])
+    prefix = os.path.join(head, first.prefix)
+    # the year and month of every file in the same stream, so each month is a single lookup
+    months = set()
+    for f in files:
+        parsed = parse_filename(f)
+        if parsed is not None and parsed.kind == 'time-slice' and parsed.prefix == first.prefix:
+            months.add(parsed.start[:7])
     for year in range(start, end):
         for month in range(1, 13):
             if month == 2:
                 # for some weird reason having to do with the frequency at which the mode
                 # outputs highfrequency files, feb gets left off _sometimes_
                 continue
-            name = f'{prefix}{year:04d}-{month:02d}'
-            res = [i for i in files if name in i]
-            if not res:
-                missing.append(name)
+            if f'{year:04d}-{month:02d}' not in months:
+                missing.append(f'{prefix}{year:04d}-{month:02d}')
 
     if not missing and debug:
         msg = f'Found {len(files)} files for submonthly dataset'
@@ -243,13 +229,7 @@ def check_fixed(files, dataset_id, spec):
 
 
 def get_ts_start_end(filename):
-    p = r'_\d{6}_\d{6}.nc'
-    idx = re.search(p, filename)
-    if not idx:
-        raise ValueError(f'Unexpected file format: {filename}')
-    start = int(filename[idx.start() + 1: idx.start() + 5])
-    end = int(filename[idx.start() + 8: idx.start() + 12])
-    return start, end
+    return parse_start_end(filename)
 
 
 def check_time_series(files, dataset_id, spec, start=None, end=None):
@@ -257,36 +237,39 @@ def check_time_series(files, dataset_id, spec, start=None, end=None):
     missing = []
     extra = []
     files = [x.split('/')[-1] for x in sorted(files)]
-    files_found = []
     if not start or not end:
         start, end = get_ts_start_end(files[0])
 
+    spec = as_spec(spec)
     case_info = dataset_id.split('.')
-    project = case_info[0]
     model_version = case_info[1]
     casename = case_info[2]
     realm = case_info[4]
-    if project == 'CMIP6':
-        ens = case_info[5]
-    else:
-        ens = case_info[6][1:]
 
-    case_spec = [x for x in spec['project']['E3SM'][model_version] if x['experiment'] == casename].pop()
+    expected_vars = spec.expected_variables('E3SM', model_version, casename, realm)
+    if expected_vars is None:
+        raise ValueError(f"No time-series specification found for {dataset_id}")
 
-    if case_spec.get('except'):
-        expected_vars = [x for x in spec['time-series'][realm]
-                         if x not in case_spec['except']]
-    else:
-        expected_vars = spec['time-series'][realm]
+    # group the files by variable name once, the time-series file names
+    # look like VAR_YYYYMM_YYYYMM.nc
+    var_files = dict()
+    for x in files:
+        parsed = parse_filename(x)
+        if parsed is not None and parsed.kind == 'time-series':
+            var_files.setdefault(parsed.variable, []).append(x)
 
+    files_found = set()
     for v in expected_vars:
-        v_files = [
-            x for x in files if v in x and '_' in x and x[:-17] == v]
+        v_files = var_files.get(v)
 
         if not v_files:
             missing.append(f'{dataset_id}-{v}-{start:04d}-{end:04d}')
             continue
         else:
+            # parse each file name once into a (start, end) -> file index
+            spans_found = dict()
+            for f in v_files:
+                spans_found.setdefault(get_ts_start_end(f), f)
 
             v_start, v_end = get_ts_start_end(v_files[0])
             if start != v_start:
@@ -294,8 +277,7 @@ def check_time_series(files, dataset_id, spec, start=None, end=None):
             if end != v_end:
                 missing.append(f'{dataset_id}-{v}-{start:04d}-{v_end:04d}')
 
-            f_start, f_end = get_ts_start_end(v_files[0])
-            freq = f_end - f_start + 1
+            freq = v_end - v_start + 1
             spans = list(range(start, end, freq))
 
             for idx, span_start in enumerate(spans):
@@ -304,15 +286,10 @@ def check_time_series(files, dataset_id, spec, start=None, end=None):
                 else:
                     span_end = end
 
-                found_span = False
-
-                for f in v_files:
-                    f_start, f_end = get_ts_start_end(f)
-                    if f_start == span_start and f_end == span_end:
-                        found_span = True
-                        files_found.append(f)
-                        break
-                if not found_span:
+                f = spans_found.get((span_start, span_end))
+                if f is not None:
+                    files_found.add(f)
+                else:
                     missing.append(f'{dataset_id}-{v}-{span_start:04d}-{span_end:04d}')
     e = [x for x in files if x not in files_found]
     extra.extend(e)
@@ -353,8 +330,7 @@ def check_files(files, spec, start, end, debug=False):
         dataset_id = filepath_to_datasetid(files[0])
     except:
         import ipdb; ipdb.set_trace()
-    if debug:
-        print_message(f"Found dataset: {dataset_id}", 'info')
+    log.debug('Found dataset: %s', dataset_id)
 
     if '.fx.' in dataset_id and files:
         return [], dataset_id, []
@@ -393,46 +369,14 @@ def check_files(files, spec, start, end, debug=False):
     return missing, dataset_id, extra
 
 
-def sproket_with_id(dataset_id, sproket, spec, start=False, end=False, debug=False, **kwargs):
-
-    if debug:
-        print_message(f"Searching for: {dataset_id}", 'info')
-
-    # create the path to the config, write it out
-    tempfile = NamedTemporaryFile(suffix='.json')
-    with open(tempfile.name, mode='w') as tmp:
-        config_string = json.dumps({
-            'search_api': "https://esgf-node.llnl.gov/esg-search/search/",
-            'data_node_priority': ["esgf-data2.llnl.gov", "aims3.llnl.gov", "esgf-data1.llnl.gov"],
-            'fields': {
-                'dataset_id': dataset_id + '*',
-                'latest': 'true'
-            }
-        })
-
-        tmp.write(config_string)
-        tmp.seek(0)
-
-        cmd = [sproket, '-config', tempfile.name, '-y', '-urls.only']
-
-        proc = Popen(cmd, shell=False, stdout=PIPE, stderr=PIPE)
-        out, err = proc.communicate()
-    if err:
-        print(err.decode('utf-8'))
-        return [], dataset_id, []
-
-    nothing_found = False
-    if not out:
-        nothing_found = True
+def check_search_results(dataset_id, files, spec, start=False, end=False, debug=False):
+    """
+    Check the file urls returned from an ESGF search for a single dataset_id
 
-    files = sorted([i.decode('utf-8') for i in out.split()])
+    returns: missing (list), dataset_id (str), extra (list)
+    """
     if not files:
-        nothing_found = True
-    
-    if nothing_found:
-        if debug:
-            msg = f'No dataset found: {dataset_id}'
-            print_message(msg, 'error')
+        log.debug('No dataset found: %s', dataset_id)
         return ['No dataset: ' + dataset_id], dataset_id, []
     else:
         return check_files(files, spec, start, end, debug)
@@ -443,7 +387,7 @@ def sproket_with_id(dataset_id, sproket, spec, start=False, end=False, debug=Fal
 # CMIP6.CMIP.E3SM-project.E3SM-1-0.piControl.r1i1p1f1.Amon.ts#20190719
 
 def collect_cmip_datasets(case_spec, **kwargs):
-    # case_spec = kwargs['case_spec']
+    case_spec = as_spec(case_spec)
     model_versions = kwargs.get('model_versions', 'all')
     experiments = kwargs.get('experiments', 'all')
     ensembles = kwargs.get('ens', 'all')
@@ -452,130 +396,175 @@ def collect_cmip_datasets(case_spec, **kwargs):
     data_version = kwargs.get('data_version', 'all')
     data_types = kwargs.get('data_types', 'all')
     exclude = kwargs.get('exclude')
-    debug = kwargs.get('debug')
 
-    for source in case_spec['project']['CMIP6']:
+    for source, experiment, case in case_spec.iter_cases('CMIP6'):
         if facet_filter(source, model_versions, exclude):
             continue
-        if debug:
-            print_message('checking model version: ' + source, 'info')
+        if facet_filter(experiment, experiments, exclude):
+            continue
+        log.debug('checking model version: %s, case: %s', source, experiment)
 
-        for case in case_spec['project']['CMIP6'][source]:
-            if facet_filter(case['experiment'], experiments, exclude):
-                continue
-            if debug:
-                print_message('  checking case: ' + case['experiment'], 'info')
+        if 'all' in ensembles:
+            ensembles_to_run = case['ens']
+        else:
+            if isinstance(ensembles, int):
+                ensembles_to_run = f'r{ensembles}i1f1p1'
+            elif isinstance(ensembles, list) and isinstance(ensembles[0], int):
+                ensembles_to_run = [f'r{e}i1f1p1' for e in ensembles]
 
-            if 'all' in ensembles:
-                ensembles_to_run = case['ens']
-            else:
-                if isinstance(ensembles, int):
-                    ensembles_to_run = f'r{ensembles}i1f1p1'
-                elif isinstance(ensembles, list) and isinstance(ensembles[0], int):
-                    ensembles_to_run = [f'r{e}i1f1p1' for e in ensembles]
+        for ensemble in ensembles_to_run:
+            if facet_filter(ensemble, ensembles_to_run, exclude):
+                continue
+            log.debug('\t\tchecking ensemble: %s', ensemble)
 
-            for ensemble in ensembles_to_run:
-                if facet_filter(ensemble, ensembles_to_run, exclude):
+            for table in case_spec['tables']:
+                if facet_filter(table, tables, [*exclude, *case.get('except', [])] ):
                     continue
-                if debug:
-                    print_message(f'\t\tchecking ensemble: {ensemble}', 'info')
+                log.debug('\t\t\tchecking table: %s', table)
 
-                for table in case_spec['tables']:
-                    if facet_filter(table, tables, [*exclude, *case.get('except', [])] ):
+                # the table variables minus the ones in the case except list
+                for variable in case_spec.expected_variables('CMIP6', source, experiment, table):
+                    if facet_filter(variable, variables, exclude):
                         continue
-                    if debug:
-                        print_message(f'\t\t\tchecking table: {table}', 'info')
 
-                    for variable in case_spec['tables'][table]:
-                        if facet_filter(variable, variables, [*exclude, *case.get('except', [])] ):
-                            continue
+                    data_version = kwargs.get('data_version')
+                    if data_version == 'latest':
+                        data_version = '*'
 
-                        data_version = kwargs.get('data_version')
-                        if data_version == 'latest':
-                            data_version = '*'
+                    dataset_id = f"CMIP6.*.E3SM-Project.{source}.{experiment}.{ensemble}.{table}.{variable}.{data_version}"
+                    yield dataset_id, case
 
-                        dataset_id = f"CMIP6.*.E3SM-Project.{source}.{case['experiment']}.{ensemble}.{table}.{variable}.{data_version}"
-                        yield dataset_id, case
-
-def check_cmip(**kwargs):
 
-    missing, extra, futures, dataset_ids = list(), list(), list(), list()
+def replay_settled(journal, checkname, dataset_ids, results):
+    """
+    Write the journaled results of the datasets that were settled by a previous run
+    to the results writer
 
-    sproket = kwargs.get('sproket')
-    case_spec = kwargs.get('case_spec')
-    debug = kwargs.get('debug')
-    client = kwargs.get('client')
+    returns: dict mapping each dataset_id that was settled to the dataset_id it resolved to
+    """
+    if journal is None:
+        return dict()
+    settled = journal.settled(checkname)
+    done = dict()
+    for dataset_id in dataset_ids:
+        entry = settled.get(dataset_id)
+        if entry is None:
+            continue
+        results.add('missing', entry['missing'])
+        results.add('extra', entry['extra'])
+        results.add('issues', entry['issues'], dataset_id)
+        done[dataset_id] = entry.get('dataset_id', dataset_id)
+    if done:
+        print_message(f'Resuming {checkname} check, {len(done)} datasets already settled', 'info')
+    return done
 
-    if not client:
-        pbar = tqdm(desc="Searching ESGF for datasets")
 
-    for dataset_id, case in collect_cmip_datasets(**kwargs):
-        if debug:
-            msg = f'Looking up dataset {dataset_id}'
-            print_message(msg, 'info')
-        if client:
-            futures.append(
-                client.submit(
-                    sproket_with_id,
-                    dataset_id,
-                    sproket,
-                    case_spec,
-                    case['start'],
-                    case['end'],
-                    debug))
-        else:
-            pbar.set_description(f'Looking up: {dataset_id}')
-            m, _, e = sproket_with_id(
-                dataset_id,
-                sproket,
-                case_spec,
-                case['start'],
-                case['end'],
-                debug=debug)
-            dataset_ids.append(dataset_id)
-            pbar.update(1)
-            if debug and not m and not e:
-                msg = f'All files found for: {dataset_id}'
-                print_message(msg, 'ok')
-            if debug and m:
-                msg = f'Missing dataset: {dataset_id}'
-                print_message(msg, 'error')
-            if debug and e:
-                msg = f'Extra files found in dataset: {dataset_id}'
-                print_message(msg, 'error')
-            if m:
-                missing.extend(m)
-            if e:
-                extra.extend(e)
+def search_and_check(search, client, datasets, spec, cache=None, refresh_stale_only=False, debug=False, desc='Searching ESGF for datasets', results=None, journal=None):
+    """
+    Look up all the given datasets with batched ESGF search requests, then
+    check the files returned for each of them
+
+    Parameters:
+        search (SearchClient): the ESGF search client
+        client (ProcessPoolExecutor): pool to run the file checks in, or None to run in serial
+        datasets (list): tuples of (dataset_id, start, end)
+        spec (dict): the dataset specification
+        cache (SearchCache): optional cache the search results are written to
+        refresh_stale_only (bool): use the unexpired cache entries, and only search for the rest
+        debug (bool): print debug messages
+        desc (str): description for the search progress bar
+        results (ResultWriter): if given, the missing and extra files are written to it
+            as each dataset is checked, and are not returned
+        journal (Journal): if given, each checked dataset is recorded in the journal, and
+            datasets already settled in it are not searched for again
+    returns: missing (list), extra (list), dataset_ids (list)
+    """
+    dataset_ids = list()
+    writer = results if results is not None else ResultWriter()
+
+    settled = replay_settled(journal, 'published', [d for d, _, _ in datasets], writer)
+    # the datasets found for the patterns searched for by the previous run
+    dataset_ids.extend(settled.values())
+    datasets = [x for x in datasets if x[0] not in settled]
+
+    to_search = [d for d, _, _ in datasets]
+    found_files = dict()
+    pbar = tqdm(total=len(datasets), desc=desc)
+    if cache is not None and refresh_stale_only:
+        found_files = cache.get(to_search)
+        to_search = [d for d in to_search if d not in found_files]
+        pbar.update(len(found_files))
+        log.debug('Using %d cached search results', len(found_files))
+    found = search.find_files(to_search, pbar=pbar)
+    if cache is not None:
+        cache.put(found)
+    found_files.update(found)
+    pbar.close()
 
+    # results are keyed by the dataset_id that was searched for, so the journal
+    # entries match the datasets collected from the spec on the next run
     if client:
-        pbar = tqdm(total=len(futures))
-        for f in as_completed(futures):
-            m, dataset_id, e = f.result()
-            dataset_ids.append(dataset_id)
-            if not m:
-                pbar.set_description(f'All files found for: {dataset_id}')
-            if debug and not m and not e:
-                msg = f'All files found for: {dataset_id}'
-                print_message(msg, 'ok')
-            if debug and m:
-                msg = f'Missing dataset: {dataset_id}'
-                print_message(msg, 'error')
-            if debug and e:
-                msg = f'Extra files found in dataset: {dataset_id}'
-                print_message(msg, 'error')
-            if m:
-                missing.extend(m)
-            if e:
-                extra.extend(e)
-            pbar.update(1)
+        futures = {
+            client.submit(
+                check_search_results,
+                dataset_id,
+                found_files[dataset_id],
+                spec,
+                start,
+                end,
+                debug): dataset_id
+            for dataset_id, start, end in datasets}
+        checked = ((futures[f], f.result()) for f in as_completed(futures))
+    else:
+        checked = (
+            (dataset_id, check_search_results(dataset_id, found_files[dataset_id], spec, start, end, debug))
+            for dataset_id, start, end in datasets)
+
+    pbar = tqdm(total=len(datasets), desc='Checking dataset files')
+    for key, (m, dataset_id, e) in checked:
+        dataset_ids.append(dataset_id)
+        if not m:
+            pbar.set_description(f'All files found for: {dataset_id}')
+        if not m and not e:
+            log.debug('All files found for: %s', dataset_id)
+        if m:
+            log.debug('Missing dataset: %s', dataset_id)
+        if e:
+            log.debug('Extra files found in dataset: %s', dataset_id)
+        writer.add('missing', m)
+        writer.add('extra', e, dataset_id)
+        if journal is not None:
+            journal.record('published', key, missing=m, extra=e, resolved=dataset_id)
+        pbar.update(1)
     pbar.close()
 
     dataset_ids = [{'id': ds} for ds in dataset_ids]
-    return missing, extra, dataset_ids
+    if results is not None:
+        return list(), list(), dataset_ids
+    return writer.get('missing'), writer.get('extra'), dataset_ids
+
+
+def check_cmip(**kwargs):
+
+    datasets = [
+        (dataset_id, case['start'], case['end'])
+        for dataset_id, case in collect_cmip_datasets(**kwargs)]
+
+    return search_and_check(
+        kwargs['search'],
+        kwargs.get('client'),
+        datasets,
+        kwargs.get('case_spec'),
+        cache=kwargs.get('cache'),
+        refresh_stale_only=kwargs.get('refresh_stale_only'),
+        debug=kwargs.get('debug'),
+        desc="Searching ESGF for CMIP6 datasets",
+        results=kwargs.get('results'),
+        journal=kwargs.get('journal'))
+
 
 def collect_e3sm_datasets(**kwargs):
-    case_spec = kwargs['case_spec']
+    case_spec = as_spec(kwargs['case_spec'])
     model_versions = kwargs.get('model_versions', 'all')
     experiments = kwargs.get('experiments', 'all')
     ensembles = kwargs.get('ens', 'all')
@@ -584,169 +573,106 @@ def collect_e3sm_datasets(**kwargs):
     data_version = kwargs.get('data_version', 'all')
     data_types = kwargs.get('data_types', 'all')
     exclude = kwargs.get('exclude')
-    debug = kwargs.get('debug')
 
-    for version in case_spec['project']['E3SM']:
-        if version not in model_versions and 'all' not in model_versions:
-            continue
+    for version, experiment, case in case_spec.iter_cases('E3SM'):
         if facet_filter(version, model_versions, exclude):
             continue
-        if debug:
-            print_message(f'checking version: {version}', 'info')
-        for case in case_spec['project']['E3SM'][version]:
-
-            # Check this case if its explicitly given by the user, or if default is set
-            if facet_filter(case['experiment'], experiments, exclude):
-                continue
-            if debug:
-                print_message(f"\tchecking case: {case['experiment']}", 'info')
-
-            if 'all' in ensembles:
-                ens = case['ens']
-            else:
-                if isinstance(ensembles, int):
-                    ens = f'ens{ensembles}'
-                elif isinstance(ensembles, list) and isinstance(ensembles[0], int):
-                    ens = [f'ens{e}' for e in ensembles]
-                else:
-                    ens = ensembles
-
-            for ensemble in ens:
-                if debug:
-                    print_message(f'\t\tchecking ensemble: {ensemble}', 'info')
-                for res in case['resolution']:
-                    for comp in case['resolution'][res]:
-                        if facet_filter(comp, tables, exclude):
-                            continue
-                        for item in case['resolution'][res][comp]:
-                            for data_type in item['data_types']:
-                                if item.get('except') and data_type in item['except']:
-                                    continue
-                                if facet_filter(data_type, data_types, exclude):
-                                    continue
-                                dataset_id = f"E3SM.{version}.{case['experiment']}.{res}.{comp}.{item['grid']}.{data_type}.{ensemble}.*"
-                                yield dataset_id, case['start'], case['end']
 
+        # Check this case if its explicitly given by the user, or if default is set
+        if facet_filter(experiment, experiments, exclude):
+            continue
+        log.debug('checking version: %s, case: %s', version, experiment)
 
-def check_e3sm(**kwargs):
-    dataset_ids, missing, extra, futures = list(), list(), list(), list()
-    case_spec = kwargs['case_spec']
-    sproket = kwargs.get('sproket', 'sproket')
-    client = kwargs.get('client')
-    debug = kwargs.get('debug')
-
-    if debug:
-        for d in dataset_ids:
-            print_message(d, 'info')
-    if not client:
-        pbar = tqdm(desc="Looking up datasets")
-
-    for dataset_id, start, end in collect_e3sm_datasets(**kwargs):
-        if client:
-            futures.append(
-                client.submit(
-                    sproket_with_id,
-                    dataset_id,
-                    sproket,
-                    case_spec,
-                    start,
-                    end))
+        if 'all' in ensembles:
+            ens = case['ens']
         else:
-            pbar.set_description(f'Checking: {dataset_id}')
-            m, dataset_id, e = sproket_with_id(
-                dataset_id,
-                sproket,
-                case_spec,
-                start=start,
-                end=end,
-                debug=debug)
-            missing.extend(m)
-            extra.extend(e)
-            if not m and debug:
-                print_message(f'All files found for: {dataset_id}', 'info')
-            pbar.update(1)
-
-    if client:
-        pbar = tqdm(
-            total=len(futures),
-            desc='Contacting ESGF database')
-        for f in as_completed(futures):
-            res = f.result()
-            m, dataset_id, e = res
-            missing.extend(m)
-            extra.extend(e)
-            if not m:
-                pbar.set_description(f'All files found for: {dataset_id}')
-            pbar.update(1)
-        pbar.close()
-
-    return missing, extra, dataset_ids
-
-
-def check_datasets_by_id(client, sproket, dataset_ids, spec, *args, **kwargs):
-    missing = list()
-    extra = list()
-
-    if client:
-
-        pbar = tqdm(
-            total=len(dataset_ids),
-            desc='Contacting ESGF database')
-        futures = [client.submit(
-            sproket_with_id,
-            d,
-            sproket,
-            spec,
-            **kwargs) for d in dataset_ids]
-        for f in as_completed(futures):
-            m, dataset_id, e = f.result()
-            if kwargs.get('debug'):
-                msg = f'Checking: {dataset_id}'
-                print_message(msg, 'info')
-            if m:
-                missing.extend(m)
+            if isinstance(ensembles, int):
+                ens = f'ens{ensembles}'
+            elif isinstance(ensembles, list) and isinstance(ensembles[0], int):
+                ens = [f'ens{e}' for e in ensembles]
             else:
-                pbar.set_description(f'All files found for: {dataset_id}')
-            pbar.update(1)
-        pbar.close()
+                ens = ensembles
 
-    else:
-        for d in dataset_ids:
-            if kwargs.get('debug'):
-                msg = f'Checking: {d}'
-                print_message(msg, 'info')
+        for ensemble in ens:
+            log.debug('\t\tchecking ensemble: %s', ensemble)
+            for res in case['resolution']:
+                for comp in case['resolution'][res]:
+                    if facet_filter(comp, tables, exclude):
+                        continue
+                    for item in case['resolution'][res][comp]:
+                        for data_type in item['data_types']:
+                            if item.get('except') and data_type in item['except']:
+                                continue
+                            if facet_filter(data_type, data_types, exclude):
+                                continue
+                            dataset_id = f"E3SM.{version}.{experiment}.{res}.{comp}.{item['grid']}.{data_type}.{ensemble}.*"
+                            yield dataset_id, case['start'], case['end']
 
-            m, dataset_id, e = sproket_with_id(d, sproket, spec, **kwargs)
-            missing.append(m)
 
-    return missing, extra
+def check_e3sm(**kwargs):
+
+    datasets = [x for x in collect_e3sm_datasets(**kwargs)]
+
+    return search_and_check(
+        kwargs['search'],
+        kwargs.get('client'),
+        datasets,
+        kwargs['case_spec'],
+        cache=kwargs.get('cache'),
+        refresh_stale_only=kwargs.get('refresh_stale_only'),
+        debug=kwargs.get('debug'),
+        desc="Searching ESGF for E3SM datasets",
+        results=kwargs.get('results'),
+        journal=kwargs.get('journal'))
+
+
+def check_datasets_by_id(client, search, dataset_ids, spec, *args, **kwargs):
+    datasets = [(d, False, False) for d in dataset_ids]
+    return search_and_check(
+        search,
+        client,
+        datasets,
+        spec,
+        cache=kwargs.get('cache'),
+        refresh_stale_only=kwargs.get('refresh_stale_only'),
+        debug=kwargs.get('debug'),
+        results=kwargs.get('results'),
+        journal=kwargs.get('journal'))
 
 
 def publication_check(**kwargs):
 
     dataset_ids = kwargs.get('dataset_ids')
     client = kwargs.get('client')
-    sproket = kwargs.get('sproket', 'sproket')
+    search = kwargs['search']
     case_spec = kwargs['case_spec']
 
     if dataset_ids:
         if isinstance(dataset_ids, str):
             dataset_ids = [dataset_ids]
-        missing, extra = check_datasets_by_id(
+        return check_datasets_by_id(
             client,
-            sproket,
+            search,
             dataset_ids, 
             spec=case_spec, 
-            debug=kwargs.get('debug'))
-        return missing, extra
+            cache=kwargs.get('cache'),
+            refresh_stale_only=kwargs.get('refresh_stale_only'),
+            debug=kwargs.get('debug'),
+            results=kwargs.get('results'),
+            journal=kwargs.get('journal'))
 
     projects = kwargs.get('projects')
+    results = kwargs.get('results')
     missing, extra, dataset_ids = list(), list(), list()
+
+    def num_missing():
+        return results.counts['missing'] if results is not None else len(missing)
+
     if not projects or ('cmip6' in projects or 'CMIP6' in projects):
         print_message("Checking for CMIP6 project data", 'ok')
         missing, extra, cmip_ids = check_cmip(**kwargs)
         dataset_ids.extend(cmip_ids)
-        if not missing:
+        if not num_missing():
             print_message('All CMIP6 files found', 'ok')
     else:
         print_message('Skipping CMIP6 datasets', 'ok')
@@ -758,7 +684,7 @@ def publication_check(**kwargs):
         extra.extend(e)
         dataset_ids.extend(e3sm_ids)
 
-        if not missing:
+        if not num_missing():
             print_message('All E3SM project files found', 'ok')
     else:
         print_message('Skipping E3SM project datasets', 'ok')
@@ -775,263 +701,223 @@ def facet_filter(facet, facets, exclude=None):
     return False
 
 
-def collect_paths(data_path=None, case_spec=None, projects=None, model_versions='all', experiments='all', tables='all', variables='all', ens='all', exclude=None, debug=False, **kwargs):
+def dataset_filter(case_spec=None, projects=None, model_versions='all', experiments='all', tables='all', variables='all', ens='all', exclude=None, extra=None):
+    """
+    Build the prune function used by the tree indexer to skip directories that
+    dont match the requested facets. E3SM directories that are missing from the
+    dataset spec are skipped, and a message for each is added to the extra list
+    """
+    if extra is None:
+        extra = list()
+    tuning_dirs = ['highres', 'lowres']
+
+    def prune_cmip(parts):
+        depth = len(parts)
+        name = parts[-1]
+        if depth == 3:
+            return name != 'E3SM-Project'
+        elif depth == 4:
+            return facet_filter(name, model_versions, exclude)
+        elif depth == 5:
+            return facet_filter(name, experiments, exclude)
+        elif depth == 6:
+            return facet_filter(name, ens, exclude)
+        elif depth == 7:
+            return facet_filter(name, tables, exclude)
+        elif depth == 8:
+            return facet_filter(name, variables, exclude)
+        return False
+
+    def prune_e3sm(parts):
+        depth = len(parts)
+        name = parts[-1]
+        project_info = case_spec['project']['E3SM']
+        if depth == 2:
+            if facet_filter(name, model_versions, exclude):
+                return True
+            if name not in project_info.keys():
+                extra.append(f'Project not found in data spec: E3SM:{name}')
+                return True
+            return False
+
+        model_version, casename = parts[1], parts[2]
+        if depth == 3:
+            if facet_filter(casename, experiments, exclude):
+                return True
+        case_info = case_spec.get('E3SM', model_version, casename)
+        if not case_info:
+            extra.append(f"Couldnt find case in dataset specifications: {casename}")
+            return True
+        if depth == 3:
+            return False
+
+        res = parts[3]
+        if depth == 4:
+            if res not in case_info.get('resolution').keys():
+                extra.append(f"Resolution {res} is present on filesystem but not in case specification: {casename}")
+                return True
+            return False
+
+        # the tuning directories add an extra level above the component
+        tuning = 1 if parts[4] in tuning_dirs else 0
+        if depth == 5 and tuning:
+            return False
+        comp = parts[4 + tuning]
+        if tuning:
+            comp_name = next(
+                (i for i in case_info['resolution'][res].keys() if comp in i), None)
+        else:
+            comp_name = comp
+        if depth == 5 + tuning:
+            if tuning:
+                return False
+            if facet_filter(comp, tables, exclude):
+                return True
+            if comp not in case_info['resolution'][res].keys():
+                extra.append(f"Component {comp} is present on filesystem but not in case specification: {casename}-{res}")
+                return True
+            return False
+
+        grid = parts[5 + tuning]
+        comp_info = next(
+            (i for i in case_info['resolution'][res].get(comp_name, []) if i['grid'] == grid), None)
+        if depth == 6 + tuning:
+            if not comp_info:
+                extra.append(f"Grid {grid} is present on filesystem but not in case specification: {casename}-{res}-{comp}")
+                return True
+            return False
+        if depth == 7 + tuning:
+            return False
+
+        if depth == 8 + tuning:
+            data_type, freq = parts[6 + tuning], parts[7 + tuning]
+            if facet_filter(freq, tables, exclude):
+                return True
+            if f"{data_type}.{freq}" not in comp_info['data_types']:
+                extra.append(f"Frequency {freq} is present on filesystem but not in case specification: {casename}-{res}-{comp}-{grid}")
+                return True
+            return False
+
+        if depth == 9 + tuning:
+            ensemble = parts[8 + tuning]
+            if facet_filter(ensemble, ens, exclude):
+                return True
+            if ensemble not in case_info['ens']:
+                extra.append(f"Ensemble {ensemble} is present on filesystem but not in case specification: {casename}-{res}-{comp}-{grid}-{parts[7 + tuning]}")
+                return True
+        return False
+
+    def prune(parts):
+        if len(parts) == 1:
+            return parts[0] not in ['CMIP6', 'E3SM'] or facet_filter(parts[0], projects, exclude)
+        if parts[0] == 'CMIP6':
+            return prune_cmip(parts)
+        return prune_e3sm(parts)
+
+    return prune
+
+
+def collect_datasets(data_path=None, case_spec=None, projects=None, model_versions='all', experiments='all', tables='all', variables='all', ens='all', exclude=None, debug=False, data_version='latest', num_workers=1, serial=False, manifest=None, **kwargs):
+    """
+    Index the dataset directories under the data_path that match the given facets,
+    reading the directory listings through the manifest if one is given
 
-    dataset_paths, dataset_ids, extra = list(), list(), list()
+    returns: records (list of DatasetRecord), dataset_ids (list), extra (list)
+    """
+    records, dataset_ids, extra = list(), list(), list()
+    if case_spec is not None:
+        case_spec = as_spec(case_spec)
+    prune = dataset_filter(
+        case_spec=case_spec,
+        projects=projects,
+        model_versions=model_versions,
+        experiments=experiments,
+        tables=tables,
+        variables=variables,
+        ens=ens,
+        exclude=exclude,
+        extra=extra)
+
+    records_iter = index_tree(
+        data_path,
+        prune=prune,
+        data_version=data_version,
+        num_workers=1 if serial else num_workers,
+        manifest=manifest)
+    for record in records_iter:
+        if record.dataset_id.startswith('CMIP6'):
+            dataset_id = f'{record.dataset_id}#{record.version}'
+        else:
+            # the tuning directory isnt part of the E3SM dataset_id
+            parts = [x for x in record.dataset_id.split('.') if x not in ['highres', 'lowres']]
+            dataset_id = '.'.join(parts + [record.version])
+        log.debug('checking dataset: %s', dataset_id)
+        records.append(record)
+        dataset_ids.append(dataset_id)
+    return records, dataset_ids, extra
+
+
+def collect_paths(**kwargs):
+    """
+    Find the dataset directories under the data_path that match the given facets
+
+    returns: dataset_paths (list), dataset_ids (list), extra (list)
+    """
+    records, dataset_ids, extra = collect_datasets(**kwargs)
+    return [r.path for r in records], dataset_ids, extra
 
-    for project in os.listdir(data_path):
-        if facet_filter(project, projects, exclude):
-            continue
-        if debug:
-            print_message(f'checking project: {project}', 'info')
-        project_path = os.path.join(data_path, project)
-
-        if project == 'CMIP6':
-            """
-            The CMIP6 paths go like
-            /base/CMIP6/cmip_project/model_name/case_id/realization_id/table/variable/gr/dataset_version
-            """
-            for cmip_project in os.listdir(project_path):
-                cmip_project_path = os.path.join(
-                    project_path, cmip_project, 'E3SM-Project')
-                if debug:
-                    print_message(f' checking cmip-project: {cmip_project}', 'info')
-                if not os.path.exists(cmip_project_path):
-                    continue
-                for model_version in os.listdir(cmip_project_path):
-                    if facet_filter(model_version, model_versions, exclude):
-                        continue
-                    model_version_path = os.path.join(
-                        cmip_project_path, model_version)
-                    if debug:
-                        print_message(f'  checking model_version: {model_version}', 'info')
-                    for case in os.listdir(model_version_path):
-                        if facet_filter(case, experiments, exclude):
-                            continue
-                        if debug:
-                            print_message(f'   checking experiment: {case}', 'info')
-                        case_path = os.path.join(model_version_path, case)
-
-                        for e in os.listdir(case_path):
-                            if facet_filter(e, ens, exclude):
-                                continue
-                            if debug:
-                                print_message(f'    checking ensemble: {e}', 'info')
-                            ensemble_path = os.path.join(case_path, e)
-
-                            for table in os.listdir(ensemble_path):
-                                if facet_filter(table, tables, exclude):
-                                    continue
-                                table_path = os.path.join(ensemble_path, table)
-                                if debug:
-                                    print_message(f'     checking table: {table}', 'info')
-                                for v in os.listdir(table_path):
-                                    if facet_filter(v, variables, exclude):
-                                        continue
-                                    variable_path = os.path.join(table_path, v)
-
-                                    # pick just the last version
-                                    try:
-                                        versions = os.listdir(
-                                            os.path.join(variable_path, 'gr'))
-                                    except:
-                                        import ipdb; ipdb.set_trace()
-
-                                    data_version = kwargs.get('data_version', 'latest')
-                                    if data_version == 'latest':
-                                        try:
-                                            version = sorted(versions)[-1]
-                                        except IndexError as e:
-                                            raise ValueError(f'Unable to find latest version for {v}') from e
-                                    else:
-                                        version = data_version
-                                    if debug:
-                                        print_message(f'      checking variable-{version}: {v}', 'info')
-
-                                    dataset_id = '.'.join(
-                                        [project, cmip_project, 'E3SM-Project', model_version, case, e, table, v, 'gr#'+version])
-                                    dataset_path = os.path.join(
-                                        variable_path, 'gr', version)
-                                    if not os.path.exists(dataset_path):
-                                        print(f"Cant find requested version, skipping {dataset_id}")
-                                        continue
-                                    dataset_paths.append(dataset_path)
-                                    dataset_ids.append(dataset_id)
-        elif project == 'E3SM':
-            project_info = case_spec['project'].get(project)
-            for model_version in os.listdir(project_path):
-                if facet_filter(model_version, model_versions, exclude):
-                    continue
-                if model_version not in project_info.keys():
-                    msg = f'Project not found in data spec: {project}:{model_version}'
-                    extra.append(msg)
-                    continue
-                model_info = project_info[model_version]
-                for casename in os.listdir(os.path.join(project_path, model_version)):
-                    if facet_filter(casename, cases, exclude):
-                        continue
-                    case_info = next(
-                        (i for i in model_info if i['experiment'] == casename), None)
-                    if not case_info:
-                        msg = f"Couldnt find case in dataset specifications: {casename}"
-                        extra.append(msg)
-                        continue
 
-                    case_path = os.path.join(
-                        project_path, model_version, casename)
-                    for res in os.listdir(case_path):
-                        tuning = None
-                        if res not in case_info.get('resolution').keys():
-                            msg = f"Resolution {res} is present on filesystem but not in case specification: {casename}"
-                            extra.append(msg)
-                            continue
-                        res_path = os.path.join(case_path, res)
-                        for comp in os.listdir(res_path):
-                            if comp in ['highres', 'lowres']:
-                                tuning = comp
-                                for comp in os.listdir(os.path.join(res_path, tuning)):
-                                    comp_path = os.path.join(
-                                        res_path, tuning, comp)
-                                    comp_name = next(
-                                        (i for i in case_info['resolution'][res].keys() if comp in i), None)
-                                    for grid in os.listdir(comp_path):
-                                        try:
-                                            comp_info = next(
-                                                (i for i in case_info['resolution'][res][comp_name] if i['grid'] == grid), None)
-                                        except:
-                                            import ipdb
-                                            ipdb.set_trace()
-                                        if not comp_info:
-                                            msg = f"Grid {grid} is present on filesystem but not in case specification: {casename}-{res}-{comp}"
-                                            extra.append(msg)
-                                            continue
-                                        for data_type in os.listdir(os.path.join(comp_path, grid)):
-                                            for freq in os.listdir(os.path.join(comp_path, grid, data_type)):
-                                                if facet_filter(freq, tables, exclude):
-                                                    continue
-                                                freq_type = f"{data_type}.{freq}"
-                                                if freq_type not in comp_info['data_types']:
-                                                    msg = f"Frequency {freq} is present on filesystem but not in case specification: {casename}-{res}-{comp}-{grid}"
-                                                    extra.append(msg)
-                                                    continue
-                                                for ensemble in os.listdir(os.path.join(comp_path, grid, data_type, freq)):
-                                                    if facet_filter(ensemble, ens, exclude):
-                                                        continue
-                                                    if ensemble not in case_info['ens']:
-                                                        msg = f"Ensemble {ensemble} is present on filesystem but not in case specification: {casename}-{res}-{comp}-{grid}-{freq}"
-                                                        extra.append(msg)
-                                                        continue
-
-                                                    version = sorted(os.listdir(os.path.join(
-                                                        comp_path, grid, data_type, freq, ensemble)))[-1]
-                                                    dataset_path = os.path.join(
-                                                        comp_path, grid, data_type, freq, ensemble, version)
-                                                    dataset_id = '.'.join(
-                                                        ['E3SM', model_version, casename, res, comp, grid, data_type, freq, ensemble, version])
-                                                    if debug:
-                                                        print_message(f'checking dataset: {dataset_id}', 'info')
-                                                    dataset_paths.append(
-                                                        dataset_path)
-                                                    dataset_ids.append(
-                                                        dataset_id)
-                                                    continue
-                            else:
-                                if facet_filter(comp, tables, exclude):
-                                    continue
-                                if comp not in case_info['resolution'][res].keys():
-                                    msg = f"Component {comp} is present on filesystem but not in case specification: {casename}-{res}"
-                                    extra.append(msg)
-                                    continue
-
-                                comp_path = os.path.join(res_path, comp)
-                                for grid in os.listdir(comp_path):
-                                    comp_info = next(
-                                        (i for i in case_info['resolution'][res][comp] if i['grid'] == grid), None)
-                                    if not comp_info:
-                                        msg = f"Grid {grid} is present on filesystem but not in case specification: {casename}-{res}-{comp}"
-                                        extra.append(msg)
-                                        continue
-                                    for data_type in os.listdir(os.path.join(comp_path, grid)):
-                                        for freq in os.listdir(os.path.join(comp_path, grid, data_type)):
-                                            if facet_filter(freq, tables, exclude):
-                                                continue
-                                            freq_type = f"{data_type}.{freq}"
-                                            if freq_type not in comp_info['data_types']:
-                                                import ipdb
-                                                ipdb.set_trace()
-                                                msg = f"Frequency freq is present on filesystem but not in case specification: {casename}-{res}-{comp}-{grid}"
-                                                extra.append(msg)
-                                                continue
-                                            for ensemble in os.listdir(os.path.join(comp_path, grid, data_type, freq)):
-                                                if facet_filter(ensemble, ens, exclude):
-                                                    continue
-                                                if ensemble not in case_info['ens']:
-                                                    msg = f"Ensemble {ensemble} is present on filesystem but not in case specification: {casename}-{res}-{comp}-{grid}-{freq}"
-                                                    extra.append(msg)
-                                                    continue
-
-                                                version = sorted(os.listdir(os.path.join(
-                                                    comp_path, grid, data_type, freq, ensemble)))[-1]
-
-                                                dataset_path = os.path.join(
-                                                    comp_path, grid, data_type, freq, ensemble, version)
-                                                dataset_id = '.'.join(
-                                                    ['E3SM', model_version, casename, res, comp, grid, data_type, freq, ensemble, version])
-                                                dataset_paths.append(
-                                                    dataset_path)
-                                                dataset_ids.append(dataset_id)
-                                                if debug:
-                                                    print_message(f'checking dataset: {dataset_id}', 'info')
-    return dataset_paths, dataset_ids, extra
-
-
-def filesystem_check(client, case_spec=None, debug=False, **kwargs):
+def filesystem_check(client, case_spec=None, debug=False, results=None, journal=None, **kwargs):
     """
     Walk down directories on the filesystem checking that every dataset that should be there is, and that there
     are no extra files. If verify is turned on, run a square variance check and plot suspicious time steps.
+
+    If a ResultWriter is given as results, the missing and extra files are written to it
+    as each dataset is checked, and are not returned. If a Journal is given each dataset is
+    recorded in it, and datasets already settled in it are skipped
     """
 
-    missing, futures = list(), list()
+    futures = dict()
+    writer = results if results is not None else ResultWriter()
     print_message("Starting file-system check", 'ok')
-    dataset_paths, dataset_ids, extra = collect_paths(**kwargs)
-    expected_datasets = [x for x in collect_cmip_datasets(case_spec, **kwargs)]
+    case_spec = as_spec(case_spec)
+    records, dataset_ids, extra = collect_datasets(case_spec=case_spec, **kwargs)
+    writer.add('extra', extra)
+    settled = replay_settled(journal, 'file-system', dataset_ids, writer)
 
     if not client:
-        pbar = tqdm(total=len(dataset_paths))
+        pbar = tqdm(total=len(records))
+
+    def record_result(dataset_id, m, e):
+        writer.add('missing', m)
+        writer.add('extra', e, dataset_id)
+        if journal is not None:
+            journal.record('file-system', dataset_id, missing=m, extra=e)
 
-    for idx, dataset_path in enumerate(dataset_paths):
+    for idx, record in enumerate(records):
         dataset_id = dataset_ids[idx]
-        files = [os.path.join(dataset_path, x) for x in sorted(os.listdir(dataset_path))]
+        if dataset_id in settled:
+            if not client:
+                pbar.update(1)
+            continue
+        files = [os.path.join(record.path, x) for x in record.files]
         if not files:
-            missing.append(dataset_id)
+            record_result(dataset_id, [dataset_id], [])
             continue
-        id_split = dataset_id.split('.')
-        project = id_split[0]
-        if project == 'E3SM':
-            model_version = id_split[1]
-            case = id_split[2]
-        else:
-            model_version = id_split[3]
-            case = id_split[4]
-        start = None
-        end = None
-
-        for experiment in case_spec['project'][project][model_version]:
-            if experiment['experiment'] == case:
-                start = experiment['start']
-                end = experiment['end']
-                break
+        case = case_spec.case_for_dataset(dataset_id) or dict()
+        start = case.get('start')
+        end = case.get('end')
         if not start or not end:
             raise ValueError(
                 f"No start and/or end found in the case_spec for {dataset_id}")
         if client:
-            futures.append(
-                client.submit(
-                    check_files,
-                    files, 
-                    case_spec, 
-                    start, 
-                    end))
+            future = client.submit(
+                check_files,
+                files, 
+                case_spec, 
+                start, 
+                end)
+            futures[future] = dataset_id
         else:
             m, d, e = check_files(files, case_spec, start, end)
             pbar.update(1)
@@ -1039,8 +925,7 @@ def filesystem_check(client, case_spec=None, debug=False, **kwargs):
                 e[idx] = f'{d}: {item}'
             for idx, item in enumerate(m):
                 m[idx] = f'{d}: {item}'
-            missing.extend(m)
-            extra.extend(e)
+            record_result(dataset_id, m, e)
 
     if client:
         pbar = tqdm(total=len(futures))
@@ -1051,41 +936,147 @@ def filesystem_check(client, case_spec=None, debug=False, **kwargs):
                 ex[idx] = f'{d}: {item}'
             for idx, item in enumerate(m):
                 m[idx] = f'{d}: {item}'
-            missing.extend(m)
-            extra.extend(ex)
+            record_result(futures[f], m, ex)
             pbar.update()
     pbar.close()
 
     print_message("File-system check complete", 'ok')
-    return missing, extra
+    if results is not None:
+        return list(), list()
+    return writer.get('missing'), writer.get('extra')
+
+
+def connect_cluster(address, num_workers):
+    """
+    Connect to the dask cluster at the given address, or a port on this machine,
+    or start a LocalCluster with num_workers worker processes if address is empty
+
+    Returns:
+        the dask Client, and the LocalCluster if one was started
+    """
+    from dask.distributed import Client, LocalCluster
+
+    if not address:
+        cluster = LocalCluster(n_workers=num_workers, threads_per_worker=1, processes=True)
+        return Client(cluster), cluster
+    if address.isdigit():
+        address = f'tcp://127.0.0.1:{address}'
+    return Client(address), None
 
 
-def verification(plot_path=None, debug=None, **kwargs):
-    issues, futures = list(), list()
+def verification(plot_path=None, debug=None, results=None, journal=None, ledger=None, force_verify=False, means_cache=None,
+                 mean_chunks=None, verify_memory=None, client=None, plot_workers=2, skip_plots=False, **kwargs):
+    """
+    Run the variance check on every dataset found under the data path. If a ResultWriter
+    is given as results, the issues are written to it as each dataset is verified. If a
+    Journal is given each dataset is recorded in it, and datasets already settled in it are skipped.
+    If a Ledger is given, datasets whose files havent changed since they were last verified
+    report the issues recorded for them instead of being verified again, unless force_verify is set.
+    The global means of each dataset are cached in means_cache, default is ~/.esgfpub/means, and are
+    computed reading mean_chunks points at a time, e.g. "time=120,lev=10", or as many timesteps
+    as fit in verify_memory MB
+
+    If an executor is given as client the datasets are verified on it, and the results are recorded as
+    each one finishes. The plots are then queued to be rendered on a separate pool of plot_workers processes,
+    with no more then twice that many waiting to be drawn at once. If skip_plots is set nothing is drawn,
+    the series each plot would be drawn from are written next to where it would have been instead
+    """
+    # the scientific stack is only loaded when verification is actually run
+    from esgfpub.verify import verify_task
+    from esgfpub.means import MEANS_CACHE, MEMORY_BUDGET
+
+    cache_settings = {
+        'root': means_cache or MEANS_CACHE,
+        'chunks': mean_chunks,
+        'memory_mb': verify_memory or MEMORY_BUDGET
+    }
+    if plot_path:
+        os.makedirs(plot_path, exist_ok=True)
+
+    issues = list()
     print_message("Starting dataset verification", 'ok')
-    dataset_paths, dataset_ids, _ = collect_paths(**kwargs)
+    dataset_paths, dataset_ids, _ = collect_paths(debug=debug, **kwargs)
+    settled = set()
+    if results is not None:
+        settled = replay_settled(journal, 'verify', dataset_ids, results)
 
     pbar = tqdm(total=len(dataset_paths))
+    fingerprints = dict()
+    # plots are drawn as each dataset is verified when running in serial
+    plot_queue = PlotQueue(
+        num_workers=plot_workers if client is not None else 0,
+        skip_render=skip_plots)
+
+    def record_result(dataset_id, found):
+        if results is not None:
+            results.add('issues', found, dataset_id)
+        else:
+            issues.extend(found)
+        if journal is not None:
+            journal.record('verify', dataset_id, issues=found)
+        pbar.update(1)
 
-    for idx, dataset_path in enumerate(dataset_paths):
-        dataset_id = dataset_ids[idx]
+    def verified(dataset_id, found, series):
+        output = None
+        if plot_path:
+            pngpath = os.path.join(plot_path, f"{dataset_id}.png")
+            variable = dataset_id.split('.')[7]
+            plot_queue.submit(render_seasonal_decomp, pngpath, series, title=dataset_id, variable=variable)
+            output = plot_queue.output_path(pngpath, series)
+        if ledger is not None:
+            ledger.record(dataset_id, fingerprints[dataset_id], found, output)
+        record_result(dataset_id, found)
+
+    futures = dict()
+    try:
+        for idx, dataset_path in enumerate(dataset_paths):
+            dataset_id = dataset_ids[idx]
+            if dataset_id in settled:
+                pbar.update(1)
+                continue
 
-        # sample id: CMIP6.CMIP.E3SM-Project.E3SM-1-1.historical.r1i1p1f1.Amon.clivi.gr#v20191211
-        id_split = dataset_id.split('.')
-        variable = id_split[7]
+            # sample id: CMIP6.CMIP.E3SM-Project.E3SM-1-1.historical.r1i1p1f1.Amon.clivi.gr#v20191211
+            id_split = dataset_id.split('.')
+            variable = id_split[7]
+
+            if ledger is not None:
+                fingerprints[dataset_id] = fingerprint(dataset_path)
+                if not force_verify:
+                    plot_paths = None
+                    if plot_path:
+                        plot_paths = plot_queue.output_paths(os.path.join(plot_path, f"{dataset_id}.png"))
+                    found = ledger.unchanged(dataset_id, fingerprints[dataset_id], plot_paths)
+                    if found is not None:
+                        record_result(dataset_id, found)
+                        continue
 
-        pbar.set_description(f"Validating {variable}")
-        issues.extend(
-            verify_dataset(
-                dataset_path,
-                dataset_id,
-                variable,
-                plot_path,
-                debug))
-        pbar.update(1)
-    
-    pbar.close()
+            if client is None:
+                pbar.set_description(f"Validating {variable}")
+                try:
+                    verified(*verify_task(dataset_path, dataset_id, variable, cache_settings))
+                except Exception as error:
+                    print_message(f"Error verifying {dataset_id}: {repr(error)}")
+                    pbar.update(1)
+            else:
+                future = client.submit(verify_task, dataset_path, dataset_id, variable, cache_settings)
+                futures[future] = dataset_id
+
+        if futures:
+            pbar.set_description("Validating datasets")
+        for future in as_completed(futures):
+            try:
+                verified(*future.result())
+            except Exception as error:
+                print_message(f"Error verifying {futures[future]}: {repr(error)}")
+                pbar.update(1)
+    finally:
+        for future in futures:
+            future.cancel()
+        plot_queue.close()
+        pbar.close()
 
+    if ledger is not None and ledger.hits:
+        print_message(f"{ledger.hits} datasets unchanged since they were last verified", 'info')
     print_message("Dataset verification complete", 'ok')
     return issues
 
@@ -1094,13 +1085,10 @@ def data_check(**kwargs):
 
     debug = kwargs.get('debug')
     if debug:
+        enable_debug()
         print_message("Running in debug mode", 'info')
 
     published = kwargs.get('published')
-    sproket = kwargs.get('sproket')
-    if published and not sproket:
-        raise ValueError(
-            "Publication checking is turned on, but no sproket utility path given")
 
     data_path = kwargs.get('data_path')
     if data_path and not os.path.exists(data_path):
@@ -1123,8 +1111,7 @@ def data_check(**kwargs):
             projects = [projects.upper()]
     kwargs['projects'] = projects
 
-    with open(spec_path, 'r') as ip:
-        case_spec = yaml.load(ip, Loader=yaml.SafeLoader)
+    case_spec = load_spec(spec_path)
 
     serial = kwargs.get('serial')
     cluster_address = kwargs.get('cluster_address')
@@ -1140,68 +1127,98 @@ def data_check(**kwargs):
     dataset_ids = kwargs.get('dataset_ids')
     if dataset_ids:
         published = True
-    missing, extra, issues = list(), list(), list()
+
+    # results are streamed out as each dataset is checked, so an
+    # interrupted run still leaves everything found up to that point
+    to_json = kwargs.get('to_json')
+    if to_json:
+        print_message(f'Results being written to {to_json}')
+    results = ResultWriter(path=to_json, digest=kwargs.get('digest'))
+    kwargs['results'] = results
+
+    # every dataset checked is recorded in the journal, so an interrupted
+    # run can be picked up again with --resume
+    resume = kwargs.get('resume')
+    run = run_key({k: kwargs.get(k) for k in JOURNAL_SCOPE})
+    journal = Journal(path=kwargs.get('journal_path') or JOURNAL, run=run, resume=resume)
+    kwargs['journal'] = journal
+
+    manifest = None
+    if kwargs.get('use_manifest'):
+        manifest = Manifest(kwargs.get('manifest_path') or MANIFEST)
+    interrupted = False
     try:
         if published:
-            m, e, dataset_ids = publication_check(
-                case_spec=case_spec,
-                client=pool,
-                **kwargs)
-            missing.extend(m)
-            extra.extend(e)
+            search = SearchClient(
+                search_api=kwargs.get('search_api', SEARCH_API),
+                batch_size=kwargs.get('search_batch_size', 50),
+                max_connections=num_workers)
+            cache = None
+            if not kwargs.get('no_search_cache'):
+                cache = SearchCache(
+                    path=kwargs.get('search_cache') or SEARCH_CACHE,
+                    ttl=kwargs.get('cache_ttl', 30))
+            try:
+                _, _, dataset_ids = publication_check(
+                    case_spec=case_spec,
+                    client=pool,
+                    search=search,
+                    cache=cache,
+                    **kwargs)
+            finally:
+                search.close()
+                if cache is not None:
+                    cache.close()
 
         file_system = kwargs.get('file_system')
         if file_system and data_path:
-            m, e = filesystem_check(
+            filesystem_check(
                 case_spec=case_spec,
                 client=pool,
+                manifest=manifest,
                 **kwargs)
-            missing.extend(m)
-            extra.extend(e)
 
         if verify and data_path:
-            from esgfpub.verify import verify_dataset
-            issues = verification(**kwargs)
+            # datasets are verified on the process pool, or on a dask cluster if one was asked for
+            dask_client, cluster = None, None
+            verify_pool = pool
+            local_cluster = kwargs.get('local_cluster')
+            if local_cluster is not None and not serial:
+                dask_client, cluster = connect_cluster(local_cluster, num_workers)
+                verify_pool = dask_client.get_executor()
+            try:
+                with Ledger(kwargs.get('ledger_path') or LEDGER) as ledger:
+                    verification(case_spec=case_spec, manifest=manifest, ledger=ledger, client=verify_pool, **kwargs)
+            finally:
+                if dask_client is not None:
+                    dask_client.close()
+                if cluster is not None:
+                    cluster.close()
+        results.complete = True
+    except KeyboardInterrupt:
+        interrupted = True
     finally:
         if pool:
-            pool.shutdown()
-    
-    digest = kwargs.get('digest')
-    if digest:
-        filtered_extra, filtered_missing = list(), list()
-
-        for m in missing:
-            try:
-                idx = m.index(':')
-            except:
-                print(m)
-                continue
-            if m[:idx] == 'No dataset':
-                filtered_missing.append(m)
-            else:
-                if m[:idx] not in filtered_missing:
-                    filtered_missing.append(m[:idx])
-        missing = filtered_missing
-
-        for e in extra:
-            idx = e.index(':')
-            if e[:idx] not in filtered_extra:
-                filtered_extra.append(e[:idx])
-        extra = filtered_extra
+            pool.shutdown(wait=not interrupted)
+        if manifest is not None:
+            if debug:
+                print_message(f'Manifest listings reused: {manifest.hits}, rescanned: {manifest.misses}', 'info')
+            manifest.close()
+        results.close()
+        journal.close()
+
+    if interrupted:
+        msg = 'Check interrupted'
+        if to_json:
+            msg += f', partial results written to {to_json}'
+        msg += ', run again with --resume to pick up where it left off'
+        print_message(msg, 'error')
+        return 1
+
+    missing = results.get('missing')
+    extra = results.get('extra')
+    issues = results.get('issues')
 
-    to_json = kwargs.get('to_json')
-    if to_json:
-        print_message(f'Missing datasets being written to {to_json}')
-        data = {
-            'missing': missing,
-            'extra': extra }
-        if verify:
-            data['issues'] = issues
-        if os.path.exists(to_json):
-            os.remove(to_json)
-        with open(to_json, 'w') as op:
-            json.dump(data, op, indent=4, sort_keys=True)
-        
     report_plot = kwargs.get('report_plot')
     if report_plot:
         if not to_json:
@@ -1209,7 +1226,8 @@ def data_check(**kwargs):
         dataset_report(
             json_path=to_json, 
             plot_path=report_plot,
-            dataset_ids=dataset_ids)
+            dataset_ids=dataset_ids,
+            skip_plots=kwargs.get('skip_plots'))
 
     else:
         if missing:
@@ -1239,17 +1257,17 @@ def data_check(**kwargs):
     return 0
 
 
-def dataset_report(json_path: str, plot_path: str, dataset_ids: list):
+def dataset_report(json_path: str, plot_path: str, dataset_ids: list, skip_plots: bool = False):
     """
     Create a nice plot reporting the status of the published datasets
     Params:
         json_path: the path to the json dataset info
         plot_path: the path to where the plot should be saved
         dataset_ids: list of strings of dataset IDs
+        skip_plots: dont draw the plot, write the number of published and missing datasets for each case as json instead
     Returns:
-        None
+        the path that was written
     """
-
     dataset_info = {}
     for dinfo in dataset_ids:
         dataset_id = dinfo['id']
@@ -1266,8 +1284,7 @@ def dataset_report(json_path: str, plot_path: str, dataset_ids: list):
         
         dataset_info[casename][dataset_id] = 'good'
 
-    with open(json_path, 'r') as ip:
-        raw_info = json.load(ip)
+    raw_info = read_results(json_path)
 
     no_dataset_str = 'No dataset: '
     for missing in raw_info['missing']:
@@ -1302,33 +1319,11 @@ def dataset_report(json_path: str, plot_path: str, dataset_ids: list):
         correct.append(num_good)
         error.append(num_bad)
 
-    width = 0.35
-    ind = np.arange(len(dataset_info.keys()))
-
-    fig, (barax, pieax) = plt.subplots(2, figsize=(20,10))
-
-    p1 = barax.bar(ind, correct, width)
-    p2 = barax.bar(ind, error, width, bottom=correct)
-    # set the bar chart xticks
-    barax.set_xticks(ind)
-    barax.set_xticklabels(tuple(x for x in dataset_info.keys()))
-    # set the barchar axis labels
-    barax.set_ylabel('datasets')
-    barax.set_xlabel('')
-    # rotate the xaxis ticks
-    plt.setp(barax.get_xticklabels(), rotation=30, horizontalalignment='right')
-    # add the legend
-    barax.legend((p1[0], p2[0]), ('published', 'missing'))
-    
-    pieax.pie([sum(correct), sum(error)], 
-                explode=(0.1, 0),
-                shadow=True,
-                labels=(f'{sum(correct)} published', f'{sum(error)} missing'),
-                autopct='%1.1f%%')
-    pieax.axis('equal')
-    
-
-    fig.suptitle(title)
-    plt.subplots_adjust(hspace=0.5)
-    plt.savefig(plot_path)
-
+    series = {
+        'cases': list(dataset_info.keys()),
+        'published': correct,
+        'missing': error
+    }
+    if skip_plots:
+        return save_series(plot_path, series, {'title': title})
+    return render_report(plot_path, series, title=title)
@@ -0,0 +1,132 @@
+"""
+Persistent store of file checksums, so unchanged files are never hashed twice
+"""
+import os
+from esgfpub.mapfile import CHECKSUM_TYPE, sha256sum
+from esgfpub.store import SqliteStore, ESGFPUB_DIR
+
+CHECKSUMS = os.path.join(ESGFPUB_DIR, 'checksums.sqlite')
+
+
+class ChecksumCache(SqliteStore):
+    """
+    A sqlite store of file checksums keyed by path, and validated against the
+    device, inode, size and mtime of the file. A stored checksum is only used
+    while all four are unchanged, so any rewrite of the file invalidates it
+
+    Files that have been renamed keep their inode and mtime, so when a path isnt
+    in the store it's looked up by (device, inode, size, mtime) and the entry is
+    moved over to the new path. This carries checksums along with datasets as
+    they move between the warehouse and publication directories, and across
+    version directory renames. Links to a file that's already in the store are
+    found the same way. Copies, and moves across filesystems, are carried over by transfered()
+
+    Parameters:
+        path (str): path to the sqlite database, created if it doesnt exist
+    """
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS checksums (
+            path TEXT PRIMARY KEY,
+            dev INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            mtime INTEGER NOT NULL,
+            checksum TEXT NOT NULL,
+            checksum_type TEXT NOT NULL)""",
+        "CREATE INDEX IF NOT EXISTS checksums_inode ON checksums (dev, inode, size, mtime)"]
+
+    def __init__(self, path=CHECKSUMS):
+        super().__init__(path)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(st):
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def get(self, path, st=None, checksum_type=CHECKSUM_TYPE):
+        """
+        Returns the stored checksum for a file, or None if the file isnt in the store
+        or has changed since it was hashed
+
+        Parameters:
+            path (str): path to the file
+            st (os.stat_result): the stat of the file if the caller already has it
+        """
+        path = os.path.abspath(path)
+        if st is None:
+            st = os.stat(path)
+        key = self._key(st)
+
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT dev, inode, size, mtime, checksum FROM checksums WHERE path = ? AND checksum_type = ?",
+                (path, checksum_type)).fetchone()
+            if row is not None and tuple(row[:4]) == key:
+                self.hits += 1
+                return row[4]
+
+            # the file may have been renamed since it was hashed, or this path is a link to it
+            row = self.conn.execute(
+                """SELECT path, checksum FROM checksums
+                   WHERE dev = ? AND inode = ? AND size = ? AND mtime = ? AND checksum_type = ?""",
+                key + (checksum_type,)).fetchone()
+            if row is not None:
+                if not os.path.exists(row[0]):
+                    self.conn.execute("DELETE FROM checksums WHERE path = ?", (row[0],))
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (path,) + key + (row[1], checksum_type))
+                self.conn.commit()
+                self.hits += 1
+                return row[1]
+
+        self.misses += 1
+        return None
+
+    def put(self, path, checksum, st=None, checksum_type=CHECKSUM_TYPE):
+        """
+        Store the checksum of a file, along with its current stat
+        """
+        path = os.path.abspath(path)
+        if st is None:
+            st = os.stat(path)
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (path,) + self._key(st) + (checksum, checksum_type))
+            self.conn.commit()
+
+    def checksum(self, path, st=None):
+        """
+        Returns the checksum of a file, only reading the file if the stored checksum isnt valid
+
+        Returns:
+            checksum (str), hashed (bool) True if the file had to be read
+        """
+        if st is None:
+            st = os.stat(path)
+        checksum = self.get(path, st)
+        if checksum is not None:
+            return checksum, False
+        checksum = sha256sum(path)
+        # if the file changed while it was read, the checksum cant be trusted later
+        if self._key(os.stat(path)) == self._key(st):
+            self.put(path, checksum, st)
+        return checksum, True
+
+    def transfered(self, src, dst, src_st):
+        """
+        Carry the checksum of a file over to where it was copied or moved to, so the copy isnt
+        hashed again. Pass the stat of the source taken before the transfer, since after a move it's gone
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT dev, inode, size, mtime, checksum, checksum_type FROM checksums WHERE path = ?",
+                (os.path.abspath(src),)).fetchone()
+        if row is None or tuple(row[:4]) != self._key(src_st):
+            return
+        dst_st = os.stat(dst)
+        if dst_st.st_size == src_st.st_size:
+            self.put(dst, row[4], dst_st, row[5])
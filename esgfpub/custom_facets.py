@@ -1,43 +1,55 @@
 import os
-import stat
 import requests
 from tqdm import tqdm
 from subprocess import Popen, PIPE
 from pathlib import Path
-from esgfpub.util import print_message, colors
+from threading import Lock
+from xml.etree import ElementTree
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from esgfpub.util import print_message
+from esgfpub.log import label
+from esgfpub.indexer import index_tree, parallel_walk, scandir
 
+INDEX_NODE = "https://esgf-node.llnl.gov/esg-search"
+DATA_NODE = "esgf-data2.llnl.gov"
+CERT_PATH = os.path.join(os.path.expanduser('~'), '.globus', 'certificate-file')
 
-def yield_leaf_dirs(path):
-    for dirpath, dirs, files in tqdm(os.walk(path), desc=f'{colors.OKGREEN}[+]{colors.ENDC} Walking directory tree'):
-        if dirs:
-            continue
-        if not files:
-            continue
-        yield dirpath
+
+def yield_leaf_dirs(path, num_workers=8):
+    """
+    Yield every directory under path that holds files but no subdirectories, as they're found
+    """
+    def visit(dirpath):
+        dirs, files = scandir(dirpath)
+        if not dirs:
+            return [dirpath] if files else [], []
+        return [], [os.path.join(dirpath, d) for d in dirs]
+
+    yield from tqdm(parallel_walk([path], visit, num_workers), desc=label('Walking directory tree'))
 
 
-def collect_dataset_ids(data_path):
-    dataset_ids = list()
+def collect_dataset_ids(data_path, num_workers=8, stop_at_version=False):
+    """
+    Yield the dataset_id of every dataset under the data path, as they're found
+
+    Parameters:
+        data_path (str): the directory to search, inside a CMIP6 or E3SM tree
+        num_workers (int): the number of directories to list at once
+        stop_at_version (bool): dont list the version directories. The walk stops as soon as it
+            finds the versions of a dataset, so datasets with an empty latest version are included
+    """
     if not os.path.exists(data_path):
         raise ValueError("Directory does not exist: {}".format(data_path))
-    dirs = [x for x in yield_leaf_dirs(data_path)]
-    for d in dirs:
-        tail, _ = os.path.split(d)
-        cmip = False
-        if "CMIP6" in tail:
-            cmip = True
-            idx = tail.index('CMIP6')
-        elif "E3SM" in tail:
-            idx = tail.index('E3SM')
-        else:
+    records = index_tree(data_path, num_workers=num_workers, list_files=not stop_at_version)
+    for record in tqdm(records, desc=label('Indexing datasets')):
+        if record.num_files == 0:
+            continue
+        if not record.dataset_id.startswith(('CMIP6', 'E3SM')):
             raise ValueError(
-                "This appears to be neither a CMIP6 or E3SM data directory: {}".format(tail))
-
-        dataset_id = tail[idx:]
-        dataset_id = dataset_id.replace(os.sep, '.')
-        dataset_ids.append(dataset_id)
-
-    return dataset_ids
+                "This appears to be neither a CMIP6 or E3SM data directory: {}".format(record.path))
+        yield record.dataset_id
 
 
 def run_cmd(command):
@@ -45,39 +57,216 @@ def run_cmd(command):
     return iter(popen.stdout.readline, b"")
 
 
-def update_custom(facets, datadir, dataset_ids=None, debug=False):
+def parse_facets(facets):
+    """
+    Parse a list of key=value strings into a dict of facet values
+
+    Returns:
+        dict mapping each facet key to its value
+    """
+    parsed = dict()
+    for facet in facets:
+        key, sep, val = facet.partition('=')
+        if not sep or not key:
+            raise ValueError(f"Facets must be given as key=value pairs, got {facet}")
+        parsed[key] = val
+    return parsed
+
+
+class FacetUpdater(object):
+    """
+    Set facets on datasets in the ESGF index over a pooled HTTP session, sending
+    the updates for many datasets at once
+
+    When batching is on, all the facet changes for a dataset are sent together in one
+    request to the ws/update endpoint. If the index node doesnt support it, the updater
+    falls back to sending one ws/updateById request per facet
+
+    Parameters:
+        index_node (str): url of the esg-search application on the index node
+        cert (str): path to the certificate used to authenticate with the index node
+        data_node (str): the data node the datasets were published from
+        max_requests (int): the number of requests to have in flight at once
+        batch (bool): send every facet change for a dataset in a single request
+        retries (int): times to retry a request that fails with a connection or server error
+        timeout (int): seconds to wait on each request
+    """
+
+    def __init__(self, index_node=INDEX_NODE, cert=None, data_node=DATA_NODE, max_requests=8, batch=True, retries=5, timeout=120):
+        self.index_node = index_node.rstrip('/')
+        self.cert = cert
+        self.data_node = data_node
+        self.max_requests = max_requests
+        self.batch = batch
+        self.timeout = timeout
+        self.lock = Lock()
+
+        # the updates set the facet to a fixed value, so any request can safely be retried
+        retry = Retry(
+            total=retries,
+            backoff_factor=1,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=None)
+        adapter = HTTPAdapter(
+            pool_connections=max_requests,
+            pool_maxsize=max_requests,
+            max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.verify = False
+        self.session.cert = cert
+
+    def close(self):
+        self.session.close()
 
-    print_message("Generating custom facet mapfile", 'ok')
-    if not dataset_ids:
-        dataset_ids = []
-        for path in datadir:
-            dataset_ids.extend(collect_dataset_ids(path))
+    def __enter__(self):
+        return self
 
-    print_message("Sending custom facets to the ESGF node", 'ok')
+    def __exit__(self, *args):
+        self.close()
 
-    cert_path = Path(os.environ['HOME'] + '/.globus/certificate-file')
+    def update_document(self, dataset_id, facets):
+        """
+        Returns the ws/update XML document setting all the facets on the dataset
+        """
+        updates = ElementTree.Element('updates', core='datasets', action='set')
+        update = ElementTree.SubElement(updates, 'update')
+        query = ElementTree.SubElement(update, 'query')
+        query.text = f'id={dataset_id}|{self.data_node}'
+        for key, val in facets.items():
+            field = ElementTree.SubElement(update, 'field', name=key)
+            value = ElementTree.SubElement(field, 'value')
+            value.text = val
+        return ElementTree.tostring(updates, encoding='unicode')
+
+    def update_batch(self, dataset_id, facets):
+        """
+        Send all the facet changes for a dataset in one request
+
+        Returns:
+            the response, or None if the index node doesnt support batch updates
+        """
+        res = self.session.post(
+            f'{self.index_node}/ws/update',
+            data=self.update_document(dataset_id, facets),
+            headers={'Content-Type': 'application/xml'},
+            timeout=self.timeout)
+        if res.status_code in [404, 405, 501]:
+            return None
+        return res
+
+    def update_by_id(self, dataset_id, key, val):
+        obj = {
+            "id": f'{dataset_id}|{self.data_node}',
+            "action": "set",
+            "field": key,
+            "value": val,
+            "core": "datasets"
+        }
+        return self.session.get(
+            f'{self.index_node}/ws/updateById', data=obj, timeout=self.timeout)
+
+    def update(self, dataset_id, facets):
+        """
+        Set the facets on one dataset
+
+        Returns:
+            list of error messages, empty if every facet was set
+        """
+        if self.batch:
+            res = self.update_batch(dataset_id, facets)
+            if res is not None:
+                if res.status_code != 200:
+                    return [f"Error updating {dataset_id}, got response {res.status_code}: {res.text[:200]}"]
+                return []
+            with self.lock:
+                if self.batch:
+                    print_message(f"{self.index_node} doesnt support batch updates, sending one request per facet", 'info')
+                    self.batch = False
+
+        errors = list()
+        for key, val in facets.items():
+            res = self.update_by_id(dataset_id, key, val)
+            if res.status_code != 200:
+                errors.append(f"Error setting {key}={val} on {dataset_id}, got response {res.status_code}: {res.text[:200]}")
+        return errors
+
+    def update_all(self, dataset_ids, facets, pbar=None):
+        """
+        Set the same facets on every dataset, with up to max_requests requests in flight.
+        The updates start as soon as the first dataset_ids arrive, so dataset_ids can be
+        a generator that's still finding datasets
+
+        Parameters:
+            dataset_ids (iterable): the datasets to update
+            facets (dict): facet keys mapped to the values to set
+            pbar (tqdm): optional progress bar, updated once per dataset
+        Returns:
+            the number of datasets, and a list of error messages, empty if every dataset was updated
+        """
+        errors = list()
+        with ThreadPoolExecutor(max_workers=self.max_requests) as pool:
+            futures = {pool.submit(self.update, dataset_id, facets): dataset_id
+                       for dataset_id in dataset_ids}
+            if pbar is not None and pbar.total is None:
+                pbar.total = len(futures)
+                pbar.refresh()
+            for future in as_completed(futures):
+                try:
+                    errors.extend(future.result())
+                except requests.RequestException as error:
+                    errors.append(f"Error updating {futures[future]}: {repr(error)}")
+                if pbar is not None:
+                    pbar.update(1)
+        return len(futures), errors
+
+
+def update_custom(facets, datadir, dataset_ids=None, index_node=INDEX_NODE, data_node=DATA_NODE,
+                  cert=None, max_requests=8, batch=True, walk_workers=8, stop_at_version=False, debug=False):
+    """
+    Set custom facets on every dataset under the data directories, or on the given datasets
+
+    Parameters:
+        facets (list): key=value strings for the facets to set
+        datadir (list): root data directories to find the datasets in
+        dataset_ids (list): update these datasets instead of the ones under datadir
+        index_node (str): url of the esg-search application on the index node
+        data_node (str): the data node the datasets were published from
+        cert (str): path to the certificate, default is ~/.globus/certificate-file
+        max_requests (int): the number of requests to have in flight at once
+        batch (bool): send every facet change for a dataset in a single request
+        walk_workers (int): the number of directories to list at once while finding the datasets
+        stop_at_version (bool): find the datasets without listing their version directories
+    Returns:
+        0 if every dataset was updated, 1 otherwise
+    """
+    facets = parse_facets(facets)
+
+    cert_path = Path(cert or CERT_PATH)
     if not cert_path.exists():
         raise ValueError(f"The globus certificate doesnt exist where its expected, {str(cert_path.resolve())}")
     cert_path = str(cert_path.resolve())
-    
-    import ipdb; ipdb.set_trace()
-    for dataset in tqdm(dataset_ids):
-        url = "https://esgf-node.llnl.gov/esg-search/ws/updateById"
-        for facet in facets:
-            idx = facet.index('=')
-            key = facet[:idx]
-            val = facet[idx + 1:]
-            obj = {
-                "id": dataset + '|esgf-data2.llnl.gov',
-                "action": "set",
-                "field": key,
-                "value": val,
-                "core": "datasets"
-            }
-            res = requests.get(
-                url, data=obj, verify=False, cert=cert_path)
-            if res.status_code != 200:
-                print(f"Error sending request {obj}, got response {res}")
-            
 
+    if dataset_ids:
+        print_message("Sending custom facets to the ESGF node", 'ok')
+        total = len(dataset_ids)
+    else:
+        # the datasets are updated as the walk finds them
+        print_message("Finding datasets and sending custom facets to the ESGF node", 'ok')
+        total = None
+        dataset_ids = (dataset_id
+                       for path in datadir
+                       for dataset_id in collect_dataset_ids(path, walk_workers, stop_at_version))
+
+    with FacetUpdater(index_node, cert_path, data_node, max_requests=max_requests, batch=batch) as updater:
+        with tqdm(total=total, desc=label('Updating datasets')) as pbar:
+            num_datasets, errors = updater.update_all(dataset_ids, facets, pbar=pbar)
+
+    for error in errors:
+        print_message(error)
+    if errors:
+        print_message(f"{len(errors)} updates failed")
+        return 1
+    print_message(f"Updated {num_datasets} datasets", 'ok')
     return 0
@@ -0,0 +1,125 @@
+"""
+Compiled grammar for the E3SM and CMIP6 file naming conventions
+"""
+import os
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+# E3SM component names as they appear in the model output file names
+COMPONENTS = ['cam', 'eam', 'clm2', 'elm', 'mosart', 'mpaso', 'mpassi', 'mpascice', 'cpl']
+
+# 20180215.DECKv1b_H1.ne30_oEC.edison_ANN_185001_201412_climo.nc
+CLIMO = re.compile(
+    r'^(?P<case>.+)_(?P<season>ANN|DJF|MAM|JJA|SON|\d{2})_(?P<start>\d{6})_(?P<end>\d{6})_climo\.nc$')
+# TREFHT_185001_201412.nc
+TIME_SERIES = re.compile(
+    r'^(?P<variable>.+)_(?P<start>\d{6})_(?P<end>\d{6})\.nc$')
+# pbo_Omon_E3SM-1-1-ECA_hist-bgc_r1i1p1f1_gr_185001-185412.nc, with an optional -clim
+# suffix for climatologies, and no date range at all for fixed fields. None of the facets
+# contain dots, so E3SM case names with several underscores arent mistaken for them
+CMIP = re.compile(
+    r'^(?P<variable>[^_.]+)_(?P<table>[^_.]+)_(?P<source>[^_.]+)_(?P<experiment>[^_.]+)_(?P<ensemble>[^_.]+)_(?P<grid>[^_.]+)'
+    r'(?:_(?P<start>\d{4,12})-(?P<end>\d{4,12})(?P<clim>-clim)?)?\.nc$')
+# 20180215.DECKv1b_H1.ne30_oEC.edison.cam.h0.1850-01.nc or mpaso.hist.am.timeSeriesStatsMonthly.0001-01-01.nc
+TIME_SLICE = re.compile(
+    r'^(?P<prefix>.+)\.(?P<date>\d{4}-\d{2}(?:-\d{2})?(?:-\d{5})?)\.nc$')
+
+# the monthly history stream for each raw data type in a stage config, as (components, stream).
+# The E3SM v1 and v2 component names are both accepted
+RAW_MONTHLY = {
+    'atmos': (('cam', 'eam'), 'h0'),
+    'land': (('clm2', 'elm'), 'h0'),
+    'river': (('mosart',), 'h0'),
+    'ocean': (('mpaso',), 'hist.am.timeSeriesStatsMonthly'),
+    'sea-ice': (('mpascice', 'mpassi'), 'hist.am.timeSeriesStatsMonthly'),
+}
+
+
+class FileName(namedtuple('FileName', ['kind', 'case', 'component', 'stream', 'variable', 'start', 'end', 'grid', 'season'])):
+    """
+    A parsed file name. The kind is one of 'climo', 'time-series', 'cmip', 'cmip-clim' or
+    'time-slice', and start and end hold the date stamps as they appear in the name.
+    For CMIP6 names the case is the experiment, the component is the source_id
+    and the stream is the table
+    """
+    __slots__ = ()
+
+    @property
+    def start_year(self):
+        return int(self.start[:4]) if self.start else None
+
+    @property
+    def end_year(self):
+        return int(self.end[:4]) if self.end else None
+
+    @property
+    def start_month(self):
+        return int(self.start.replace('-', '')[4:6]) if self.start else None
+
+    @property
+    def prefix(self):
+        """
+        For time-slice files, everything in front of the date stamp
+        """
+        return '.'.join(x for x in [self.case, self.component, self.stream] if x) + '.'
+
+    @property
+    def suffix(self):
+        """
+        For time-slice files, everything following the year and month
+        """
+        return self.start[7:] + '.nc'
+
+
+def split_prefix(prefix):
+    """
+    Split the part of a time-slice name in front of the date into the case,
+    component and stream, e.g. 20180215.DECKv1b_H1.ne30_oEC.edison.cam.h0
+    """
+    items = prefix.split('.')
+    for idx, item in enumerate(items):
+        if item in COMPONENTS:
+            return '.'.join(items[:idx]) or None, item, '.'.join(items[idx + 1:]) or None
+    return prefix, None, None
+
+
+@lru_cache(maxsize=2**17)
+def _parse(name):
+    match = CLIMO.match(name)
+    if match:
+        return FileName('climo', match['case'], None, None, None, match['start'], match['end'], None, match['season'])
+    match = TIME_SERIES.match(name)
+    if match:
+        return FileName('time-series', None, None, None, match['variable'], match['start'], match['end'], None, None)
+    match = TIME_SLICE.match(name)
+    if match:
+        case, component, stream = split_prefix(match['prefix'])
+        return FileName('time-slice', case, component, stream, None, match['date'], match['date'], None, None)
+    match = CMIP.match(name)
+    if match:
+        kind = 'cmip-clim' if match['clim'] else 'cmip'
+        return FileName(kind, match['experiment'], match['source'], match['table'], match['variable'], match['start'], match['end'], match['grid'], None)
+    return None
+
+
+def parse_filename(path):
+    """
+    Parse a file name, or the name at the end of a path or url, into a FileName.
+    Results are cached so every consumer of the same name shares a single parse
+
+    Returns:
+        FileName, or None if the name doesnt follow any of the known conventions
+    """
+    return _parse(os.path.basename(path))
+
+
+def parse_start_end(path):
+    """
+    Return the start and end year from a file name, raising a ValueError if
+    the name doesnt contain a date range
+    """
+    parsed = parse_filename(path)
+    if parsed is None or not parsed.start:
+        raise ValueError(f'Unexpected file format: {path}')
+    return parsed.start_year, parsed.end_year
@@ -0,0 +1,281 @@
+"""
+Single pass, scandir based indexer for the CMIP6 and E3SM publication trees
+"""
+import os
+import re
+from queue import SimpleQueue
+from collections import deque, namedtuple
+from threading import Thread, Condition, Event
+
+PROJECTS = ['CMIP6', 'E3SM']
+VERSION_PATTERN = re.compile(r'^v\d+$')
+
+# dataset_id is the dot separated path of the dataset directory starting at the
+# project directory, version is the name of the version directory under it
+DatasetRecord = namedtuple(
+    'DatasetRecord', ['dataset_id', 'version', 'path', 'num_files', 'size', 'files'])
+
+
+def version_key(version):
+    """
+    Sort key for version directory names, so that v10 comes after v9
+    """
+    return int(version[1:])
+
+
+def root_parts(path):
+    """
+    Return the components of the path starting at the project directory,
+    or an empty list if the path isnt inside a CMIP6 or E3SM tree
+    """
+    parts = os.path.normpath(path).split(os.sep)
+    for project in PROJECTS:
+        if project in parts:
+            return parts[parts.index(project):]
+    return []
+
+
+def scandir(path):
+    """
+    List a directory with a single scandir call
+
+    Returns:
+        dirs (list): the names of the subdirectories
+        files (list): tuples of (name, size) for the files
+    """
+    dirs, files = list(), list()
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir():
+                dirs.append(entry.name)
+            elif entry.is_file():
+                files.append((entry.name, entry.stat().st_size))
+    dirs.sort()
+    files.sort()
+    return dirs, files
+
+
+def select_versions(versions, data_version='latest'):
+    """
+    Returns the version directory names selected by data_version, in version order
+
+    Parameters:
+        versions (list): the names of the version directories
+        data_version (str): 'latest', 'all' or the name of a single version directory
+    """
+    versions = sorted(versions, key=version_key)
+    if data_version == 'latest':
+        return versions[-1:]
+    elif data_version != 'all':
+        return [v for v in versions if v == data_version]
+    return versions
+
+
+def version_record(vpath, parts, version, files):
+    """
+    Returns the DatasetRecord for a version directory from its (name, size) file listing,
+    or with no file information if files is None
+    """
+    if files is None:
+        return DatasetRecord('.'.join(parts), version, vpath, None, None, None)
+    size = sum(s for _, s in files)
+    files = [name for name, _ in files]
+    return DatasetRecord('.'.join(parts), version, vpath, len(files), size, files)
+
+
+def scan_versions(path, parts, versions, data_version='latest', listdir=scandir, list_files=True):
+    """
+    Yield a DatasetRecord for the selected version directories of a dataset
+
+    Parameters:
+        path (str): path to the dataset directory
+        parts (list): the path components of the dataset directory starting at the project
+        versions (list): the names of the version directories
+        data_version (str): 'latest', 'all' or the name of a single version directory
+        listdir (callable): the function used to list directories
+        list_files (bool): if False the version directories arent listed, and the
+            records have None for num_files, size and files
+    """
+    for version in select_versions(versions, data_version):
+        vpath = os.path.join(path, version)
+        files = listdir(vpath)[1] if list_files else None
+        yield version_record(vpath, parts, version, files)
+
+
+def walk(path, parts, prune=None, data_version='latest', listdir=scandir, list_files=True):
+    """
+    Walk down from path yielding a DatasetRecord for every dataset directory found,
+    a directory is a dataset directory if it holds version directories
+
+    Parameters:
+        path (str): the directory to start from
+        parts (list): the path components of the directory starting at the project
+        prune (callable): called with the path components of each subdirectory,
+            the directory is skipped if it returns True
+        data_version (str): 'latest', 'all' or the name of a single version directory
+        listdir (callable): the function used to list directories
+        list_files (bool): if False the walk stops at the version directories without listing them
+    """
+    try:
+        dirs, _ = listdir(path)
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        return
+
+    versions = [d for d in dirs if VERSION_PATTERN.match(d)]
+    if versions:
+        yield from scan_versions(path, parts, versions, data_version, listdir, list_files)
+        return
+
+    for name in dirs:
+        subparts = parts + [name]
+        if prune is not None and prune(subparts):
+            continue
+        yield from walk(os.path.join(path, name), subparts, prune, data_version, listdir, list_files)
+
+
+class _Failure(object):
+
+    def __init__(self, error):
+        self.error = error
+
+
+def parallel_walk(roots, visit, num_workers=8):
+    """
+    Walk directory trees on a pool of threads, yielding results as soon as they're found
+
+    Each worker keeps its own deque of directories, taking the most recently found from
+    its own end so it works depth first, and once it runs out it steals the oldest
+    directory from another worker. Stolen directories are the ones nearest the root, so
+    a worker that steals takes a large piece of work and the subtrees stay balanced
+    however uneven the tree is
+
+    Parameters:
+        roots (list): the work items to start from
+        visit (callable): called with a work item on one of the workers, returns a list
+            of results to yield and a list of new work items
+        num_workers (int): the number of threads
+    Returns:
+        generator of the results from every call to visit, in the order they're found.
+        An exception raised by visit is raised from the generator
+    """
+    num_workers = max(num_workers, 1)
+    deques = [deque() for _ in range(num_workers)]
+    for i, item in enumerate(roots):
+        deques[i % num_workers].append(item)
+    # the number of items queued or being visited, the walk is done when it reaches zero
+    pending = [len(roots)]
+    cond = Condition()
+    stop = Event()
+    results = SimpleQueue()
+    done = object()
+
+    def take(own):
+        try:
+            return deques[own].pop()
+        except IndexError:
+            pass
+        for i in range(1, num_workers):
+            try:
+                return deques[(own + i) % num_workers].popleft()
+            except IndexError:
+                continue
+        return None
+
+    def worker(own):
+        try:
+            while not stop.is_set():
+                item = take(own)
+                if item is None:
+                    with cond:
+                        item = take(own)
+                        if item is None:
+                            if pending[0] == 0 or stop.is_set():
+                                break
+                            cond.wait()
+                            continue
+                found, children = visit(item)
+                for result in found:
+                    results.put(result)
+                with cond:
+                    deques[own].extend(children)
+                    pending[0] += len(children) - 1
+                    if children or pending[0] == 0:
+                        cond.notify_all()
+        except BaseException as error:
+            results.put(_Failure(error))
+            stop.set()
+            with cond:
+                cond.notify_all()
+        finally:
+            results.put(done)
+
+    threads = [Thread(target=worker, args=(i,), daemon=True) for i in range(num_workers)]
+    for thread in threads:
+        thread.start()
+    try:
+        finished = 0
+        while finished < num_workers:
+            result = results.get()
+            if result is done:
+                finished += 1
+            elif isinstance(result, _Failure):
+                raise result.error
+            else:
+                yield result
+    finally:
+        stop.set()
+        with cond:
+            cond.notify_all()
+        for thread in threads:
+            thread.join()
+
+
+def index_tree(root, prune=None, data_version='latest', num_workers=1, manifest=None, list_files=True):
+    """
+    Index every dataset under the root directory in a single pass
+
+    Parameters:
+        root (str): the directory to index, either a publication root containing the
+            project directories, or any directory inside a CMIP6 or E3SM tree
+        prune (callable): called with the path components of each directory starting at
+            the project, the directory is skipped if it returns True
+        data_version (str): 'latest', 'all' or the name of a single version directory
+        num_workers (int): if more then one, the tree is walked in parallel with parallel_walk
+        manifest (Manifest): if given, directory listings are read through the manifest
+        list_files (bool): if False the walk stops once it reaches the version directories,
+            and the records have None for num_files, size and files
+    Returns:
+        generator of DatasetRecord, as each dataset is found
+    """
+    listdir = manifest.listdir if manifest is not None else scandir
+    parts = root_parts(root)
+    if num_workers <= 1:
+        yield from walk(root, parts, prune, data_version, listdir, list_files)
+        return
+
+    def visit(item):
+        path, parts, version = item
+        try:
+            dirs, files = listdir(path)
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            return [], []
+        if version is not None:
+            return [version_record(path, parts, version, files)], []
+
+        versions = [d for d in dirs if VERSION_PATTERN.match(d)]
+        if versions:
+            selected = select_versions(versions, data_version)
+            if not list_files:
+                return [version_record(os.path.join(path, v), parts, v, None) for v in selected], []
+            return [], [(os.path.join(path, v), parts, v) for v in selected]
+
+        children = list()
+        for name in dirs:
+            subparts = parts + [name]
+            if prune is not None and prune(subparts):
+                continue
+            children.append((os.path.join(path, name), subparts, None))
+        # reversed so the worker pops them in name order
+        return [], children[::-1]
+
+    yield from parallel_walk([(root, parts, None)], visit, num_workers)
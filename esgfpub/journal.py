@@ -0,0 +1,79 @@
+"""
+Checkpoint journal for resuming interrupted esgfpub check runs
+"""
+import os
+import json
+import hashlib
+from esgfpub.store import SqliteStore, ESGFPUB_DIR
+
+JOURNAL = os.path.join(ESGFPUB_DIR, 'check_journal.sqlite')
+
+
+def run_key(params):
+    """
+    Returns a key for a run made from the parameters that decide what it checks, so runs
+    checking different things can share the journal without touching each other's entries
+    """
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class Journal(SqliteStore):
+    """
+    A sqlite journal holding the result of every dataset checked during a run, keyed
+    by the run, the check that was run ('published', 'file-system' or 'verify') and the dataset_id.
+    Each entry is committed as soon as it's recorded, so it survives the run being killed
+
+    Parameters:
+        path (str): path to the sqlite database, created if it doesnt exist
+        run (str): the key of the run, see run_key. Only the entries for this run are read or cleared
+        resume (bool): keep the entries from the previous run with the same key, otherwise they're cleared
+    """
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS checkpoints (
+            run TEXT NOT NULL,
+            checkname TEXT NOT NULL,
+            dataset_id TEXT NOT NULL,
+            result TEXT NOT NULL,
+            PRIMARY KEY (run, checkname, dataset_id))"""]
+
+    def __init__(self, path=JOURNAL, run='', resume=False):
+        super().__init__(path)
+        self.run = run
+        if not resume:
+            with self.lock:
+                self.conn.execute("DELETE FROM checkpoints WHERE run = ?", (run,))
+                self.conn.commit()
+
+    def settled(self, checkname):
+        """
+        Return the results recorded for the given check
+
+        Returns:
+            dict mapping each dataset_id to a dict of its 'missing', 'extra' and 'issues' lists,
+            and the 'dataset_id' it resolved to
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT dataset_id, result FROM checkpoints WHERE run = ? AND checkname = ?",
+                (self.run, checkname)).fetchall()
+        return {dataset_id: json.loads(result) for dataset_id, result in rows}
+
+    def record(self, checkname, dataset_id, missing=None, extra=None, issues=None, resolved=None):
+        """
+        Record that a dataset has been checked, along with what was found
+
+        Parameters:
+            resolved (str): the dataset_id that was found, if the dataset_id checked was a search pattern
+        """
+        result = {
+            'dataset_id': resolved or dataset_id,
+            'missing': missing or list(),
+            'extra': extra or list(),
+            'issues': issues or list()
+        }
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?)",
+                (self.run, checkname, dataset_id, json.dumps(result)))
+            self.conn.commit()
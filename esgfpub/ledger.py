@@ -0,0 +1,81 @@
+"""
+Verification ledger, so datasets that havent changed since they were last verified are skipped
+"""
+import os
+import json
+import hashlib
+from time import time
+from esgfpub.store import SqliteStore, ESGFPUB_DIR
+
+LEDGER = os.path.join(ESGFPUB_DIR, 'verify_ledger.sqlite')
+
+
+def fingerprint(path):
+    """
+    Returns a fingerprint of the contents of a dataset directory, made from the name,
+    size and modification time of each of its files. Any file being added, removed
+    or rewritten changes the fingerprint, without any of the files being read
+    """
+    entries = list()
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_file():
+                st = entry.stat()
+                entries.append(f'{entry.name}\0{st.st_size}\0{st.st_mtime_ns}')
+    entries.sort()
+    return hashlib.sha256('\n'.join(entries).encode()).hexdigest()
+
+
+class Ledger(SqliteStore):
+    """
+    A sqlite ledger holding the fingerprint of every dataset that's been verified,
+    along with the issues that were found and the path to its plot. Unlike the
+    checkpoint journal, the ledger is kept across runs
+
+    Parameters:
+        path (str): path to the sqlite database, created if it doesnt exist
+    """
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS verified (
+            dataset_id TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            issues TEXT NOT NULL,
+            plot_path TEXT,
+            verified REAL NOT NULL)"""]
+
+    def __init__(self, path=LEDGER):
+        super().__init__(path)
+        self.hits = 0
+        self.misses = 0
+
+    def unchanged(self, dataset_id, fingerprint, plot_paths=None):
+        """
+        Returns the issues found the last time the dataset was verified if its fingerprint
+        hasnt changed since, and the plot this run wants is still there. Otherwise returns None
+
+        Parameters:
+            dataset_id (str): the dataset to look up
+            fingerprint (str): the current fingerprint of the dataset's files
+            plot_paths (list): the paths the plot for this run could be written to, or None if no plot is wanted
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT fingerprint, issues, plot_path FROM verified WHERE dataset_id = ?",
+                (dataset_id,)).fetchone()
+        if row is None or row[0] != fingerprint or (
+                plot_paths and (row[2] not in plot_paths or not os.path.exists(row[2]))):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[1])
+
+    def record(self, dataset_id, fingerprint, issues, plot_path=None):
+        """
+        Record the result of verifying a dataset
+        """
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO verified VALUES (?, ?, ?, ?, ?)",
+                (dataset_id, fingerprint, json.dumps(issues or list()), plot_path, time()))
+            self.conn.commit()
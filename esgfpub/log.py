@@ -0,0 +1,249 @@
+"""
+Structured logging for esgfpub, built on the standard logging module
+
+Every module logs to its own "esgfpub.<module>" logger so the level of each
+subsystem can be set separately. Records are formatted only once a handler
+accepts them, so a disabled debug call costs a single level check
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import queue
+import logging
+import logging.handlers
+
+ROOT = 'esgfpub'
+
+# the print_message status classes, and the icon and color each is shown with
+STATUS_LEVELS = {
+    'error': logging.ERROR,
+    'info': logging.INFO,
+    'ok': logging.INFO
+}
+ICONS = {
+    'error': ('[-]', '\033[91m'),
+    'info': ('[=]', '\033[94m'),
+    'ok': ('[+]', '\033[92m'),
+    'debug': ('[=]', '\033[94m')
+}
+ENDC = '\033[0m'
+
+_root = logging.getLogger(ROOT)
+_loggers = dict()
+_listener = None
+
+
+def get_logger(name=ROOT):
+    """
+    Returns the logger for an esgfpub subsystem, names outside the esgfpub package
+    (like __main__ for scripts) are logged under the top level esgfpub logger
+    """
+    logger = _loggers.get(name)
+    if logger is None:
+        logger = logging.getLogger(name if name.startswith(ROOT) else ROOT)
+        _loggers[name] = logger
+    return logger
+
+
+def record_status(record):
+    status = getattr(record, 'status', None)
+    if status in ICONS:
+        return status
+    if record.levelno >= logging.ERROR:
+        return 'error'
+    if record.levelno < logging.INFO:
+        return 'debug'
+    return 'ok'
+
+
+class ConsoleFormatter(logging.Formatter):
+    """
+    Formats records the way print_message always has, with the colored status icon and a
+    timestamp. The timestamp string is only rebuilt when the second changes
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._second = None
+        self._stamp = None
+
+    def format(self, record):
+        second = int(record.created)
+        if second != self._second:
+            now = time.localtime(second)
+            self._stamp = (f'{now.tm_year}/{now.tm_mon}/{now.tm_mday} - '
+                           f'{now.tm_hour:02d}:{now.tm_min:02d}:{now.tm_sec:02d}')
+            self._second = second
+        icon, color = ICONS[record_status(record)]
+        message = f'{color}{icon}{ENDC} {self._stamp}:  {record.getMessage()}'
+        if record.exc_info:
+            message = f'{message}\n{self.formatException(record.exc_info)}'
+        return message
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats each record as a single JSON object, with any structured fields passed
+    as extra={'fields': {...}} merged in
+    """
+
+    def format(self, record):
+        entry = {
+            'time': record.created,
+            'level': record.levelname,
+            'status': record_status(record),
+            'subsystem': record.name,
+            'message': record.getMessage()
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class BufferedStreamHandler(logging.StreamHandler):
+    """
+    A stream handler that only flushes once every capacity records, or straight away
+    for records at or above the flush_level. Interactive terminals are always flushed
+    """
+
+    def __init__(self, stream=None, capacity=64, flush_level=logging.WARNING, owns_stream=False):
+        super().__init__(stream)
+        self.owns_stream = owns_stream
+        self.capacity = capacity
+        self.flush_level = flush_level
+        self.pending = 0
+        isatty = getattr(self.stream, 'isatty', None)
+        self.interactive = bool(isatty and isatty())
+
+    def emit(self, record):
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+            self.pending += 1
+            if self.interactive or record.levelno >= self.flush_level or self.pending >= self.capacity:
+                self.flush()
+                self.pending = 0
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        self.flush()
+        if self.owns_stream:
+            self.stream.close()
+        super().close()
+
+
+def parse_levels(levels):
+    """
+    Parse per subsystem levels given as "checker=DEBUG,publisher=WARNING"
+
+    Returns:
+        dict mapping logger names to levels
+    """
+    parsed = dict()
+    for item in (levels or '').split(','):
+        if not item.strip():
+            continue
+        name, _, level = item.partition('=')
+        name = name.strip()
+        if not name.startswith(ROOT):
+            name = f'{ROOT}.{name}'
+        parsed[name] = level.strip().upper()
+    return parsed
+
+
+@atexit.register
+def stop_listener():
+    """
+    Write out any records still queued for the background thread, and stop it
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def setup_logging(level='INFO', fmt='console', path=None, asynchronous=False, levels=None):
+    """
+    Configure the esgfpub loggers, replacing any handlers set up before
+
+    Parameters:
+        level (str): the level for every subsystem without its own level
+        fmt (str): 'console' for the print_message style, or 'json' for one JSON object per line
+        path (str): write to this file instead of stdout
+        asynchronous (bool): format and write records on a background thread
+        levels (str or dict): per subsystem levels, e.g. "checker=DEBUG,publisher=WARNING"
+    """
+    global _listener
+    root = _root
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    stop_listener()
+
+    if path:
+        handler = BufferedStreamHandler(open(path, 'a'), owns_stream=True)
+    else:
+        handler = BufferedStreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if fmt == 'json' else ConsoleFormatter())
+
+    if asynchronous:
+        records = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(records, handler)
+        _listener.start()
+        handler = logging.handlers.QueueHandler(records)
+
+    root.addHandler(handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    root.propagate = False
+
+    if isinstance(levels, str):
+        levels = parse_levels(levels)
+    for name, sublevel in (levels or {}).items():
+        logging.getLogger(name).setLevel(sublevel)
+
+
+def enable_debug():
+    """
+    Turn on debug messages for every esgfpub subsystem, for callers passing debug=True
+    """
+    if not _root.handlers:
+        setup_logging()
+    _root.setLevel(logging.DEBUG)
+
+
+def _flush_each_record():
+    # buffered records arent written out when a forked worker exits
+    for handler in _root.handlers:
+        if isinstance(handler, BufferedStreamHandler):
+            handler.capacity = 1
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_flush_each_record)
+
+
+def label(message, status='ok'):
+    """
+    Returns the message prefixed with the colored print_message icon for the status, for progress bar descriptions
+    """
+    icon, color = ICONS.get(status, ICONS['ok'])
+    return f'{color}{icon}{ENDC} {message}'
+
+
+def log_message(name, message, status='error'):
+    """
+    Log a print_message style message to the logger for the given subsystem, setting
+    up the console handler with the default settings if logging hasnt been configured
+    """
+    if not _root.handlers:
+        setup_logging()
+    logger = get_logger(name)
+    level = STATUS_LEVELS.get(status, logging.INFO)
+    if not logger.isEnabledFor(level):
+        return
+    logger.log(level, message, extra={'status': status if status in ICONS else 'ok'})
@@ -0,0 +1,96 @@
+"""
+Persistent manifest of a directory tree, used to avoid re-reading directories
+that havent changed since the last scan
+"""
+import os
+import json
+from esgfpub.indexer import scandir
+from esgfpub.store import SqliteStore, ESGFPUB_DIR
+
+MANIFEST = os.path.join(ESGFPUB_DIR, 'manifest.sqlite')
+
+
+class Manifest(SqliteStore):
+    """
+    A sqlite manifest holding the mtime, subdirectory names and file listing
+    of every directory that has been read through it
+
+    Listing a directory costs a single stat while its mtime is unchanged, the
+    directory is only read again once an entry has been added, removed or renamed.
+    Note that the stored file sizes are not refreshed if a file is rewritten in place
+
+    Parameters:
+        path (str): path to the sqlite database, created if it doesnt exist
+    """
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS dirs (
+            path TEXT PRIMARY KEY,
+            mtime INTEGER NOT NULL,
+            dirs TEXT NOT NULL,
+            files TEXT NOT NULL)"""]
+
+    def __init__(self, path=MANIFEST):
+        super().__init__(path)
+        self.hits = 0
+        self.misses = 0
+
+    def listdir(self, path):
+        """
+        List a directory, reading it from the manifest if its mtime hasnt changed
+
+        Returns:
+            dirs (list): the names of the subdirectories
+            files (list): tuples of (name, size) for the files
+        """
+        path = os.path.normpath(path)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            self.forget(path)
+            raise
+
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT mtime, dirs, files FROM dirs WHERE path = ?", (path,)).fetchone()
+        if row is not None and row[0] == mtime:
+            self.hits += 1
+            return json.loads(row[1]), [tuple(f) for f in json.loads(row[2])]
+
+        self.misses += 1
+        dirs, files = scandir(path)
+        with self.lock:
+            if row is not None:
+                # drop the entries for any subdirectories that have been removed
+                for name in set(json.loads(row[1])) - set(dirs):
+                    self._forget(os.path.join(path, name))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)",
+                (path, mtime, json.dumps(dirs), json.dumps(files)))
+        return dirs, files
+
+    def forget(self, path):
+        """
+        Remove a directory and everything below it from the manifest
+        """
+        with self.lock:
+            self._forget(os.path.normpath(path))
+
+    def _forget(self, path):
+        self.conn.execute(
+            "DELETE FROM dirs WHERE path = ? OR substr(path, 1, ?) = ?",
+            (path, len(path) + 1, path + os.sep))
+
+    def walk(self, top):
+        """
+        A drop in replacement for os.walk that reads through the manifest. Like
+        os.walk the tree is walked top down, and the dirs list may be modified
+        in place to skip subdirectories
+        """
+        try:
+            dirs, files = self.listdir(top)
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            return
+        yield top, dirs, [name for name, _ in files]
+        for name in dirs:
+            yield from self.walk(os.path.join(top, name))
@@ -0,0 +1,230 @@
+"""
+Generate ESGF mapfiles in process, without shelling out to esgmapfile
+"""
+import os
+import sys
+import argparse
+import hashlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+CHECKSUM_TYPE = 'SHA256'
+# files are read in 16MB blocks, hashlib releases the GIL while hashing them
+BUFSIZE = 16 * 1024 * 1024
+
+MapEntry = namedtuple('MapEntry', ['dataset_id', 'version', 'path', 'size', 'mtime', 'checksum'])
+
+
+def sha256sum(path, bufsize=BUFSIZE):
+    """
+    Returns the hex SHA256 digest of a file
+    """
+    digest = hashlib.sha256()
+    buf = bytearray(bufsize)
+    view = memoryview(buf)
+    with open(path, 'rb', buffering=0) as ip:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(ip.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while True:
+            size = ip.readinto(buf)
+            if not size:
+                break
+            digest.update(view[:size])
+    return digest.hexdigest()
+
+
+def format_mtime(mtime):
+    return f'{mtime:.6f}'
+
+
+def format_line(entry):
+    """
+    Format a mapfile line the same way esgmapfile does
+    """
+    return (f'{entry.dataset_id}#{entry.version} | {entry.path} | {entry.size} | '
+            f'mod_time={format_mtime(entry.mtime)} | checksum={entry.checksum} | checksum_type={CHECKSUM_TYPE}')
+
+
+def parse_line(line):
+    """
+    Parse a mapfile line into a MapEntry, or return None if the line isnt a valid entry
+    """
+    fields = [x.strip() for x in line.split('|')]
+    if len(fields) < 3 or '#' not in fields[0]:
+        return None
+    dataset_id, version = fields[0].rsplit('#', 1)
+    options = dict(x.split('=', 1) for x in fields[3:] if '=' in x)
+    try:
+        return MapEntry(
+            dataset_id,
+            version,
+            fields[1],
+            int(fields[2]),
+            float(options.get('mod_time', 0)),
+            options.get('checksum'))
+    except ValueError:
+        return None
+
+
+def read_mapfile(path):
+    """
+    Returns a dict mapping each file path in the mapfile to its MapEntry
+    """
+    entries = dict()
+    with open(path, 'r') as ip:
+        for line in ip:
+            entry = parse_line(line)
+            if entry is not None:
+                entries[entry.path] = entry
+    return entries
+
+
+def dataset_id_from_path(path):
+    """
+    Find the dataset_id and version from the path to a dataset version directory, for
+    either the publication or the warehouse directory structure
+
+    Returns:
+        dataset_id (str), version (str) the version number without the leading 'v'
+    """
+    parts = os.path.normpath(path).split(os.sep)
+    version = parts[-1]
+    if not (version[:1] == 'v' and version[1:].isdigit()):
+        raise ValueError(f'{path} is not a dataset version directory')
+    for project in ['CMIP6', 'E3SM']:
+        if project in parts:
+            return '.'.join(parts[parts.index(project):-1]), version[1:]
+    raise ValueError(f'Unable to find the project in {path}')
+
+
+def hash_file(path, st, checksums=None):
+    """
+    Returns the checksum of a file and whether it had to be read, using the checksum store if one is given
+    """
+    if checksums is not None:
+        return checksums.checksum(path, st)
+    return sha256sum(path), True
+
+
+def mapfile_name(dataset_id, version):
+    return f'{dataset_id}.v{version}.map'
+
+
+def make_mapfile(datapath, outpath, dataset_id=None, version=None, previous=None,
+                 num_workers=8, pbar=None, event=None, checksums=None):
+    """
+    Write the mapfile for a dataset, hashing the files on a pool of worker threads
+
+    When a previous mapfile for the dataset is found, only files whose size or modification
+    time has changed since it was written are hashed again. Files that arent in the previous
+    mapfile are looked up in the checksum store if one is given
+
+    Parameters:
+        datapath (str): path to the dataset version directory holding the netCDF files
+        outpath (str): either the full path of the mapfile to write, ending in .map or .mapfile,
+            or a directory in which case the mapfile is written to <outpath>/<dataset_id>.v<version>.map
+        dataset_id (str): defaults to the dataset_id found from the datapath
+        version (str): the version number, defaults to the one found from the datapath
+        previous (str): a previous mapfile to reuse checksums from, defaults to the output mapfile if it exists
+        num_workers (int): the number of files to hash at once
+        pbar (tqdm): a progress bar updated once per file
+        event (threading.Event): set to stop hashing early
+        checksums (ChecksumCache): a persistent checksum store to consult before reading any file
+    Returns:
+        path to the mapfile, number of files hashed, number of checksums reused.
+        If the event is set the mapfile isnt written and the path is None
+    """
+    if dataset_id is None or version is None:
+        found_id, found_version = dataset_id_from_path(datapath)
+        dataset_id = dataset_id or found_id
+        version = version or found_version
+    if not outpath.endswith(('.map', '.mapfile')):
+        outpath = os.path.join(outpath, mapfile_name(dataset_id, version))
+    if previous is None and os.path.exists(outpath):
+        previous = outpath
+
+    reuse = read_mapfile(previous) if previous else dict()
+
+    entries, to_hash = list(), list()
+    with os.scandir(datapath) as it:
+        for item in it:
+            if not item.name.endswith('.nc') or not item.is_file():
+                continue
+            st = item.stat()
+            path = os.path.abspath(item.path)
+            old = reuse.get(path)
+            if old is not None and old.checksum and old.size == st.st_size \
+                    and format_mtime(old.mtime) == format_mtime(st.st_mtime):
+                entries.append(old._replace(dataset_id=dataset_id, version=version))
+                if pbar is not None:
+                    pbar.update(1)
+            else:
+                to_hash.append((path, st))
+
+    num_hashed = 0
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        futures = {pool.submit(hash_file, path, st, checksums): (path, st)
+                   for path, st in to_hash}
+        for future in as_completed(futures):
+            if event is not None and event.is_set():
+                for f in futures:
+                    f.cancel()
+                return None, num_hashed, len(entries)
+            path, st = futures[future]
+            checksum, hashed = future.result()
+            num_hashed += hashed
+            entries.append(MapEntry(dataset_id, version, path, st.st_size, st.st_mtime, checksum))
+            if pbar is not None:
+                pbar.update(1)
+
+    head, _ = os.path.split(outpath)
+    if head:
+        os.makedirs(head, exist_ok=True)
+    tmp_path = f'{outpath}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as op:
+        for entry in sorted(entries, key=lambda x: x.path):
+            op.write(format_line(entry) + '\n')
+    os.replace(tmp_path, outpath)
+    return outpath, num_hashed, len(entries) - num_hashed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='esgfpub.mapfile',
+        description='Generate the ESGF mapfile for one or more dataset version directories')
+    parser.add_argument(
+        'datapaths',
+        nargs='+',
+        help="paths to dataset version directories")
+    parser.add_argument(
+        '--outdir',
+        required=True,
+        help="directory to write the mapfiles to")
+    parser.add_argument(
+        '--max-processes',
+        type=int,
+        default=os.cpu_count() or 8,
+        help="the number of files to hash at once, defaults to the number of cpus")
+    parser.add_argument(
+        '--checksum-db',
+        help="Path to the checksum store, default is ~/.esgfpub/checksums.sqlite")
+    args = parser.parse_args()
+
+    from esgfpub.checksums import ChecksumCache, CHECKSUMS
+
+    retcode = 0
+    with ChecksumCache(args.checksum_db or CHECKSUMS) as checksums:
+        for datapath in args.datapaths:
+            try:
+                path, hashed, reused = make_mapfile(
+                    datapath, args.outdir, num_workers=args.max_processes, checksums=checksums)
+            except (OSError, ValueError) as error:
+                print(f'FAILURE: {datapath}: {repr(error)}')
+                retcode = 1
+            else:
+                print(f'SUCCESS: {path} ({hashed} files hashed, {reused} checksums reused)')
+    return retcode
+
+
+if __name__ == "__main__":
+    sys.exit(main())
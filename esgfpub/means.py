@@ -0,0 +1,322 @@
+"""
+Global mean reduction of datasets, cached in small NetCDF sidecar files so the
+source data is only read once for every check, plot and comparison
+"""
+import os
+import threading
+from glob import glob
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import xarray as xr
+from esgfpub.ledger import fingerprint
+from esgfpub.mapfile import dataset_id_from_path
+
+MEANS_CACHE = os.path.join(os.path.expanduser('~'), '.esgfpub', 'means')
+# the dimensions averaged over to get the global mean
+MEAN_DIMS = ['depth', 'lat', 'lon', 'plev', 'tau', 'lev', 'sector', 'ncol']
+# the most memory each worker uses for the block of a variable it's reducing, in MB
+MEMORY_BUDGET = 256
+# cell area variables, in order of preference, used to weight the mean when they're in the files
+AREA_VARIABLES = ['areacella', 'areacello', 'area']
+# bumped whenever the reduction changes, so sidecars written by an older version are recomputed
+REDUCTION = 'area-weighted-1'
+
+
+def mean_dims(ds):
+    """
+    Returns the dimensions of the dataset to average over, sector is stored as basin
+    """
+    return tuple(x if x != 'sector' else 'basin' for x in ds.dims if x in MEAN_DIMS)
+
+
+def find_variable(ds):
+    """
+    Returns the name of the first data variable that isnt a bounds variable
+    """
+    return next(x for x in ds.data_vars if 'bnds' not in x and 'bounds' not in x)
+
+
+def parse_chunks(chunks):
+    """
+    Parse chunk sizes given as "time=120,lev=10"
+
+    Returns:
+        dict mapping each dimension to its chunk size
+    """
+    if not chunks:
+        return dict()
+    if isinstance(chunks, dict):
+        return dict(chunks)
+    parsed = dict()
+    for item in chunks.split(','):
+        if not item.strip():
+            continue
+        dim, sep, size = item.partition('=')
+        if not sep:
+            raise ValueError(f"Chunks must be given as dim=size, got {item}")
+        parsed[dim.strip()] = int(size)
+    return parsed
+
+
+def area_weights(ds, da, dims):
+    """
+    Find the weights for the horizontal mean of a variable. The cell areas are used if
+    the variable names them in its cell_measures, or one of the AREA_VARIABLES is in the
+    files, otherwise the cosine of the latitude. Vertical levels are weighted equally
+
+    Returns:
+        xarray.DataArray of the weights, or None for an unweighted mean, and a description of the weights used
+    """
+    names = list()
+    measures = da.attrs.get('cell_measures', '')
+    if 'area:' in measures:
+        names.append(measures.split('area:')[1].split()[0])
+    for name in names + AREA_VARIABLES:
+        if name in ds.variables and name != da.name:
+            area = ds[name]
+            if area.dims and set(area.dims) <= set(dims) and 'time' not in area.dims:
+                return area.load().fillna(0), name
+    if 'lat' in ds.variables:
+        lat = ds['lat']
+        if lat.dims and set(lat.dims) <= set(dims):
+            return np.cos(np.deg2rad(lat.load())), 'cos(lat)'
+    return None, 'none'
+
+
+def time_chunk_for(da, chunks, memory_mb=MEMORY_BUDGET):
+    """
+    Returns the number of timesteps to read at once, either the time chunk given in chunks,
+    or as many as fit in the memory budget along with the other chunk sizes
+    """
+    if 'time' in chunks:
+        return max(chunks['time'], 1)
+    step = da.dtype.itemsize
+    for dim, size in da.sizes.items():
+        if dim != 'time':
+            step *= min(chunks.get(dim, size), size)
+    # the block is read, weighted and masked, so allow for a few copies of it
+    return max(int(memory_mb * 1024 * 1024 // (step * 4)), 1)
+
+
+def blocks(da, dims, chunks, time_chunk):
+    """
+    Yield the slices of the variable to read, one block of timesteps at a time, split along
+    any other dimensions to reduce that were given chunk sizes
+    """
+    split = [d for d in dims if d in chunks]
+    for begin in range(0, da.sizes['time'], time_chunk):
+        time_slice = {'time': slice(begin, begin + time_chunk)}
+        selections = [time_slice]
+        for dim in split:
+            selections = [dict(sel, **{dim: slice(i, i + chunks[dim])})
+                          for sel in selections
+                          for i in range(0, da.sizes[dim], chunks[dim])]
+        yield selections
+
+
+def partial_sums(da, dims, weights=None, chunks=None, memory_mb=MEMORY_BUDGET, pbar=None):
+    """
+    Make a single streaming pass over a variable, summing the weighted values and the weights
+    of the valid points at each timestep. Only one block of the variable is in memory at once
+
+    Parameters:
+        da (xarray.DataArray): the variable, backed by the file rather then loaded
+        dims (tuple): the dimensions to reduce over
+        weights (xarray.DataArray): weights along some of the dims, or None for equal weights
+        chunks (dict): the number of points along each dimension to read at once
+        memory_mb (int): the memory budget for a block, used when chunks has no time size
+        pbar (tqdm): optional progress bar, updated once per block of timesteps
+    Returns:
+        sums, counts (xarray.DataArray) along the time axis and any dimensions that werent reduced
+    """
+    chunks = chunks or dict()
+    time_chunk = time_chunk_for(da, chunks, memory_mb)
+    sums, counts = list(), list()
+    for selections in blocks(da, dims, chunks, time_chunk):
+        block_sum, block_count = None, None
+        for selection in selections:
+            block = da.isel(selection).load()
+            valid = block.notnull()
+            if weights is not None:
+                w = weights.isel({k: v for k, v in selection.items() if k in weights.dims})
+                total = (block * w).sum(dims, skipna=True)
+                count = w.where(valid, 0).sum(dims)
+            else:
+                total = block.sum(dims, skipna=True)
+                count = valid.sum(dims)
+            block_sum = total if block_sum is None else block_sum + total
+            block_count = count if block_count is None else block_count + count
+        sums.append(block_sum)
+        counts.append(block_count)
+        if pbar is not None:
+            pbar.update(1)
+    return xr.concat(sums, 'time'), xr.concat(counts, 'time')
+
+
+def combine_partials(partials):
+    """
+    Combine the partial sums from each file into the global means. Files that split the
+    dataset by time are joined end to end, and sums for the same timestep are added together
+    """
+    sums = xr.concat([s for s, _ in partials], 'time')
+    counts = xr.concat([c for _, c in partials], 'time')
+    if sums.indexes['time'].has_duplicates:
+        sums = sums.groupby('time').sum()
+        counts = counts.groupby('time').sum()
+    sums = sums.sortby('time')
+    counts = counts.sortby('time')
+    return (sums / counts.where(counts > 0)).astype(np.float64)
+
+
+def reduce_file(path, variable, chunks=None, memory_mb=MEMORY_BUDGET, pbar=None):
+    """
+    Returns the partial sums of one file, and the weights that were used. The file is
+    opened without dask, and each block is read straight from it
+    """
+    with xr.open_dataset(path) as ds:
+        da = ds[variable]
+        dims = tuple(x for x in mean_dims(ds) if x in da.dims)
+        weights, method = area_weights(ds, da, dims)
+        sums, counts = partial_sums(da, dims, weights, chunks, memory_mb, pbar)
+        return (sums, counts), method, da.attrs
+
+
+def reduce_dataset(dataset_path, variable=None, chunks=None, memory_mb=MEMORY_BUDGET, num_workers=1, pbar=None):
+    """
+    Reduce the variable of a dataset to its area weighted global mean at each timestep. Each file
+    is read in a single streaming pass on one of the workers, and the partial sums are combined
+
+    Parameters:
+        dataset_path (str): path to the directory holding the dataset's netCDF files
+        variable (str): the variable to reduce, defaults to the first non bounds variable
+        chunks (dict or str): the number of points along each dimension to read at once, e.g. "time=120,lev=10"
+        memory_mb (int): the memory budget per worker, used when no time chunk is given
+        num_workers (int): the number of files to read at once
+        pbar (tqdm): optional progress bar, updated once per block of timesteps
+    Returns:
+        xarray.DataArray of the global means along the time axis, or None if the variable has no time axis
+    """
+    paths = sorted(os.path.join(dataset_path, x) for x in os.listdir(dataset_path) if x.endswith('.nc'))
+    if not paths:
+        raise ValueError(f"Empty dataset directory {dataset_path}")
+    chunks = parse_chunks(chunks)
+
+    with xr.open_dataset(paths[0]) as ds:
+        variable = variable or find_variable(ds)
+        if 'time' not in ds[variable].dims:
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(num_workers, 1)) as pool:
+        results = list(pool.map(
+            lambda path: reduce_file(path, variable, chunks, memory_mb, pbar), paths))
+
+    means = combine_partials([partial for partial, _, _ in results])
+    _, method, attrs = results[0]
+    means.name = variable
+    means.attrs = {k: v for k, v in attrs.items() if k in ['units', 'long_name', 'standard_name']}
+    means.attrs['weights'] = method
+    return means
+
+
+class MeanCache(object):
+    """
+    A directory of NetCDF sidecar files holding the global means of each dataset, keyed by
+    its dataset_id, version and variable. Each sidecar records a fingerprint of the dataset's
+    files, and is only used while the files are unchanged
+
+    Parameters:
+        root (str): the directory to keep the sidecars in, created if it doesnt exist
+        chunks (dict or str): the default chunk sizes to reduce datasets with, see reduce_dataset
+        memory_mb (int): the default memory budget per worker
+        num_workers (int): the default number of files to read at once
+    """
+
+    def __init__(self, root=MEANS_CACHE, chunks=None, memory_mb=MEMORY_BUDGET, num_workers=1):
+        self.root = root
+        self.chunks = parse_chunks(chunks)
+        self.memory_mb = memory_mb
+        self.num_workers = num_workers
+        os.makedirs(root, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def sidecar_path(self, dataset_id, version, variable):
+        return os.path.join(self.root, f'{dataset_id}.v{version}.{variable}.nc')
+
+    def get(self, dataset_id, version, variable, current):
+        """
+        Returns the cached global means, or None if they arent cached or the dataset has changed
+
+        Parameters:
+            current (str): the fingerprint of the dataset's files
+        """
+        path = self.sidecar_path(dataset_id, version, variable)
+        if not os.path.exists(path):
+            return None
+        try:
+            with xr.open_dataset(path) as ds:
+                if ds.attrs.get('fingerprint') != current or ds.attrs.get('reduction') != REDUCTION:
+                    return None
+                return ds[variable].load()
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def put(self, dataset_id, version, means, current):
+        """
+        Write the global means of a dataset to its sidecar
+        """
+        path = self.sidecar_path(dataset_id, version, means.name)
+        ds = means.to_dataset()
+        ds.attrs.update({'dataset_id': dataset_id, 'version': version, 'fingerprint': current, 'reduction': REDUCTION})
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        ds.to_netcdf(tmp_path)
+        os.replace(tmp_path, path)
+        return path
+
+    def global_mean(self, dataset_path, variable=None, dataset_id=None, version=None, chunks=None,
+                    memory_mb=None, num_workers=None, pbar=None):
+        """
+        Returns the global means of a dataset, reading them from its sidecar if the
+        dataset hasnt changed since they were computed, otherwise computing and caching them
+
+        Parameters:
+            dataset_path (str): path to the dataset version directory
+            variable (str): the variable to reduce, defaults to the first non bounds variable
+            dataset_id (str): defaults to the dataset_id found from the dataset_path
+            version (str): defaults to the version found from the dataset_path
+            chunks (dict or str): the number of points along each dimension to read at once
+            memory_mb (int): the memory budget per worker, used when no time chunk is given
+            num_workers (int): the number of files to read at once
+            pbar (tqdm): optional progress bar, updated once per block of timesteps
+            The reduction settings default to the ones the cache was made with
+        Returns:
+            xarray.DataArray of the global means along the time axis, or None if the variable has no time axis
+        """
+        if dataset_id is None or version is None:
+            found_id, found_version = dataset_id_from_path(dataset_path)
+            dataset_id = dataset_id or found_id
+            version = version or found_version
+        current = fingerprint(dataset_path)
+        if variable is not None:
+            variables = [variable]
+        else:
+            # the sidecar_path prefix, up to where the variable name starts
+            prefix = os.path.join(self.root, f'{dataset_id}.v{version}.')
+            variables = [x[len(prefix):-len('.nc')] for x in glob(prefix + '*.nc')]
+        for name in variables:
+            means = self.get(dataset_id, version, name, current)
+            if means is not None:
+                self.hits += 1
+                return means
+
+        self.misses += 1
+        means = reduce_dataset(
+            dataset_path,
+            variable,
+            chunks if chunks is not None else self.chunks,
+            memory_mb or self.memory_mb,
+            num_workers or self.num_workers,
+            pbar)
+        if means is not None:
+            self.put(dataset_id, version, means, current)
+        return means
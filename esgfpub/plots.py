@@ -0,0 +1,313 @@
+"""
+Deferred plot rendering for the verification and report plots
+
+The checks only compute the small series that get plotted, and hand them to a PlotQueue
+which draws them on a pool of background processes. Each process keeps one figure per kind
+of plot and clears it after every save, so memory doesnt grow however many plots are drawn
+"""
+import os
+import json
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from esgfpub.util import print_message
+
+# the figures kept for reuse in this process, keyed by the kind of plot
+_figures = dict()
+
+
+def init_renderer():
+    """
+    Initializer for plot rendering processes, which never show a window
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def figure(key, nrows=1, size=(15, 10)):
+    """
+    Returns a cleared figure for the given kind of plot along with its axes, reusing the figure
+    from the last plot of the same kind. The figures arent registered with pyplot, so nothing
+    holds on to them once they're released
+    """
+    from matplotlib.figure import Figure
+
+    fig = _figures.get(key)
+    if fig is None:
+        fig = Figure()
+        _figures[key] = fig
+    else:
+        fig.clear()
+    fig.set_size_inches(*size)
+    return fig, fig.subplots(nrows)
+
+
+def save(fig, pngpath, dpi=100):
+    """
+    Save the figure and clear it, so the data it was drawn from can be freed straight away
+    """
+    fig.savefig(pngpath, dpi=dpi)
+    fig.clear()
+    return pngpath
+
+
+def release():
+    """
+    Drop all the figures kept for reuse in this process
+    """
+    for fig in _figures.values():
+        fig.clear()
+    _figures.clear()
+
+
+def year_ticks(times, every=120):
+    """
+    Returns the positions and year labels for a tick every so many timesteps
+    """
+    positions = list(range(0, len(times), every))
+    return positions, [str(times[i])[:4] for i in positions]
+
+
+def render_minmaxmean(pngpath, series, title=''):
+    """
+    Draw the global means of a dataset with the squared variance of each timestep on a second axis
+
+    Parameters:
+        series (dict): 'means' and 'vmax' DataArrays along the time axis
+    """
+    fig, ax1 = figure('minmaxmean', size=(18.5, 10.5))
+    ax1.set_title(title)
+    means = series['means']
+    positions, labels = year_ticks(means['time'].values)
+    ax1.set_xticks(positions)
+    ax1.set_xticklabels(labels)
+    ax1.set_xlabel('year')
+    if means.attrs.get('units'):
+        ax1.set_ylabel(means.attrs['units'])
+    ax1.plot(means.values, color='tab:blue')
+
+    ax2 = ax1.twinx()
+    ax2.plot(series['vmax'].values, color='tab:red')
+    return save(fig, pngpath)
+
+
+def render_global(pngpath, series, title=''):
+    """
+    Draw a variable without a time axis on a map
+
+    Parameters:
+        series (dict): 'field' the 2D DataArray to draw
+    """
+    import numpy as np
+    from mpl_toolkits.basemap import Basemap
+
+    fig, ax = figure('global', size=(15, 10))
+    field = series['field']
+    m = Basemap(projection="eck4", lon_0=0, resolution='c', ax=ax)
+    m.drawcoastlines()
+    m.fillcontinents(color='coral', lake_color='aqua')
+    m.drawparallels(np.arange(-90., 120., 30.))
+    m.drawmeridians(np.arange(0., 360., 60.))
+    m.drawmapboundary(fill_color='aqua')
+    ny, nx = field.shape[0], field.shape[1]
+    lons, lats = m.makegrid(nx, ny)
+    x, y = m(lons, lats)
+    m.contourf(x, y, field.values)
+    ax.set_title(title or field.name)
+    return save(fig, pngpath)
+
+
+def render_seasonal_decomp(pngpath, series, title='', variable=''):
+    """
+    Draw the global mean, trend and residual of a dataset, or a map if the variable has no time axis
+
+    Parameters:
+        series (dict): 'means', 'trend' and 'resid' DataArrays along the time axis, or 'field'
+    """
+    if 'field' in series:
+        return render_global(pngpath, series, variable)
+
+    means = series['means']
+    fig, axes = figure('seasonal_decomp', nrows=3, size=(15, 10))
+    fig.suptitle(title)
+    fig.tight_layout(pad=5.0)
+
+    positions, labels = year_ticks(means['time'].values)
+    for ax in axes:
+        ax.set_xticks(positions)
+        ax.set_xticklabels(labels)
+    axes[-1].set_xlabel('year')
+
+    # top plot is global mean
+    axes[0].set_title(f'global {variable} mean')
+    axes[0].plot(means.values)
+
+    # second plot is seasonality - mean
+    axes[1].set_title('trend')
+    axes[1].plot(series['trend'].values)
+
+    # thrid plot is the residual
+    axes[2].set_title('residual')
+    axes[2].plot(series['resid'].values, 'o')
+    return save(fig, pngpath)
+
+
+def render_report(pngpath, series, title=''):
+    """
+    Draw the publication status of each case as a stacked bar chart, and the totals as a pie chart
+
+    Parameters:
+        series (dict): 'cases' the case names, with the number of 'published' and 'missing' datasets for each
+    """
+    import numpy as np
+
+    fig, (barax, pieax) = figure('report', nrows=2, size=(20, 10))
+    correct, error = series['published'], series['missing']
+    width = 0.35
+    ind = np.arange(len(series['cases']))
+
+    p1 = barax.bar(ind, correct, width)
+    p2 = barax.bar(ind, error, width, bottom=correct)
+    # set the bar chart xticks
+    barax.set_xticks(ind)
+    barax.set_xticklabels(series['cases'], rotation=30, horizontalalignment='right')
+    # set the barchar axis labels
+    barax.set_ylabel('datasets')
+    barax.set_xlabel('')
+    # add the legend
+    barax.legend((p1[0], p2[0]), ('published', 'missing'))
+
+    pieax.pie([sum(correct), sum(error)],
+              explode=(0.1, 0),
+              shadow=True,
+              labels=(f'{sum(correct)} published', f'{sum(error)} missing'),
+              autopct='%1.1f%%')
+    pieax.axis('equal')
+
+    fig.suptitle(title)
+    fig.subplots_adjust(hspace=0.5)
+    fig.savefig(pngpath)
+    fig.clear()
+    return pngpath
+
+
+def series_path(pngpath, series):
+    """
+    Returns where the numeric series for a plot are written when rendering is skipped,
+    a NetCDF file for xarray series and a JSON file for everything else
+    """
+    base, _ = os.path.splitext(pngpath)
+    if series and all(hasattr(x, 'dims') for x in series.values()):
+        return base + '.nc'
+    return base + '.json'
+
+
+def save_series(pngpath, series, labels=None):
+    """
+    Write the numeric series for a plot instead of drawing it
+
+    Returns:
+        the path the series were written to
+    """
+    path = series_path(pngpath, series)
+    if path.endswith('.nc'):
+        import xarray as xr
+        ds = xr.Dataset({k: v.rename(k) for k, v in series.items()})
+        ds.attrs.update({k: str(v) for k, v in (labels or {}).items()})
+        ds.to_netcdf(path)
+    else:
+        with open(path, 'w') as op:
+            json.dump(dict(series, **(labels or {})), op, default=str)
+    return path
+
+
+class PlotQueue(object):
+    """
+    Render plots on a pool of background processes, so the checks producing them never
+    wait on matplotlib. No more then max_pending plots are queued at once, submit waits
+    for one to finish before queueing another, so the series waiting to be drawn stay bounded
+
+    Parameters:
+        num_workers (int): the number of rendering processes, if 0 plots are drawn as they're submitted
+        max_pending (int): the most plots queued at once, defaults to twice the number of workers
+        skip_render (bool): dont draw anything, write the numeric series for each plot instead
+    """
+
+    def __init__(self, num_workers=2, max_pending=None, skip_render=False):
+        self.skip_render = skip_render
+        self.max_pending = max_pending or 2 * max(num_workers, 1)
+        self.pending = dict()
+        self.num_rendered = 0
+        self.errors = list()
+        self.pool = None
+        if num_workers > 0 and not skip_render:
+            self.pool = ProcessPoolExecutor(max_workers=num_workers, initializer=init_renderer)
+
+    def output_path(self, pngpath, series):
+        """
+        Returns the path that will be written for the plot, the series file if rendering is skipped
+        """
+        return series_path(pngpath, series) if self.skip_render else pngpath
+
+    def output_paths(self, pngpath):
+        """
+        Returns every path output_path could give for the plot, for when its series arent known yet
+        """
+        if not self.skip_render:
+            return [pngpath]
+        base, _ = os.path.splitext(pngpath)
+        return [base + '.nc', base + '.json']
+
+    def submit(self, renderer, pngpath, series, **labels):
+        """
+        Queue a plot to be drawn
+
+        Parameters:
+            renderer (callable): one of the render functions in this module
+            pngpath (str): where to save the plot
+            series (dict): the data to plot
+            labels: any other keyword arguments to the renderer, like the title
+        """
+        if self.skip_render:
+            return save_series(pngpath, series, labels)
+        if self.pool is None:
+            try:
+                renderer(pngpath, series, **labels)
+                self.num_rendered += 1
+            except Exception as error:
+                self._failed(pngpath, error)
+            return pngpath
+
+        while len(self.pending) >= self.max_pending:
+            done, _ = wait(self.pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                self._finish(future)
+        self.pending[self.pool.submit(renderer, pngpath, series, **labels)] = pngpath
+        return pngpath
+
+    def _failed(self, pngpath, error):
+        self.errors.append(pngpath)
+        print_message(f"Error rendering {pngpath}: {repr(error)}")
+
+    def _finish(self, future):
+        pngpath = self.pending.pop(future)
+        try:
+            future.result()
+            self.num_rendered += 1
+        except Exception as error:
+            self._failed(pngpath, error)
+
+    def close(self):
+        """
+        Wait for every queued plot to be drawn, and shut down the rendering processes
+        """
+        for future in list(self.pending):
+            self._finish(future)
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+        release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
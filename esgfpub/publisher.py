@@ -1,12 +1,15 @@
 import os
 import stat
 import json
-import yaml
 from os import remove
-from time import sleep
+from time import monotonic
 from subprocess import Popen, PIPE
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from esgfpub.util import print_message, check_ds_exists
-from esgfpub import resources
+from esgfpub.log import enable_debug
+from esgfpub.search import SearchCache, SEARCH_CACHE
+from esgfpub.watcher import DirectoryWatcher
+from esgfpub.spec import load_spec
 from datetime import datetime
 from tempfile import TemporaryDirectory
 
@@ -18,20 +21,14 @@ def get_facet_info(datasetID):
         print(f"Only able to load facet info from E3SM project datasets")
         return 0
 
-    resource_path, _ = os.path.split(resources.__file__)
-    spec_path = os.path.join(resource_path, 'dataset_spec.yaml')
-    with open(spec_path, 'r') as ip:
-        spec = yaml.safe_load(ip)
-    
+    spec = load_spec()
+
     model_version = ds_split[1]
     casename = ds_split[2]
-    res = ds_split[3]
 
-    try:
-        casespec = spec['project'][project][model_version][casename]
-    except IndexError as e:
-        print(f"Does this experiment {casename} have the correct entry in the dataset spec?")
-        raise e
+    casespec = spec.get(project, model_version, casename)
+    if casespec is None:
+        raise ValueError(f"Does this experiment {casename} have the correct entry in the dataset spec?")
 
     campaign = casespec.get('campaign')
     if not campaign:
@@ -48,90 +45,258 @@ def print_while_running(process):
     raise StopIteration
 
 
-def publish_maps(mapfiles, mapsin, mapsout, mapserr, logpath, sproket='spoket', debug=False):
-    os.makedirs(logpath, exist_ok=True)
-    with TemporaryDirectory() as tmpdir:
-        
+class PublishMetrics(object):
+    """
+    Throughput counters for the publisher
+    """
+
+    def __init__(self):
+        self.start = monotonic()
+        self.counts = {
+            'published': 0,
+            'failed': 0,
+            'existing': 0,
+            'rejected': 0
+        }
+        self.publish_time = 0.0
+
+    def add(self, outcome, duration=None):
+        self.counts[outcome] += 1
+        if duration is not None:
+            self.publish_time += duration
+
+    def report(self):
+        elapsed = monotonic() - self.start
+        finished = self.counts['published'] + self.counts['failed']
+        rate = self.counts['published'] / elapsed * 3600 if elapsed else 0
+        mean = self.publish_time / finished if finished else 0
+        msg = (f"Publisher: {self.counts['published']} published, {self.counts['failed']} failed, "
+               f"{self.counts['existing']} already published, {self.counts['rejected']} rejected "
+               f"in {elapsed:.0f}s, {rate:.1f} datasets/hour, mean esgpublish time {mean:.0f}s")
+        print_message(msg, 'ok')
+
+
+def run_esgpublish(cmd, log):
+    """
+    Run a single esgpublish command, writing its output to the log
+
+    returns: returncode (int), duration in seconds (float)
+    """
+    start = monotonic()
+    with open(log, 'w') as outstream:
+        proc = Popen(cmd, stdout=outstream, stderr=outstream, universal_newlines=True)
+        proc.wait()
+    return proc.returncode, monotonic() - start
+
+
+class Publisher(object):
+    """
+    Publish mapfiles concurrently. Existence checks run in their own thread pool,
+    and each mapfile for a dataset that isnt already published is handed to a second
+    pool that runs up to num_publishers esgpublish processes at once
+
+    Parameters:
+        mapsin (str): the directory holding the mapfiles to publish
+        mapsout (str): where mapfiles are moved after a successful publication
+        mapserr (str): where mapfiles are moved after a failure
+        logpath (str): where the esgpublish logs are written
+        sproket (str): path to the sproket binary used for the existence checks
+        cache (SearchCache): optional cache the existence checks are written to, it is never read from
+        num_publishers (int): the number of esgpublish processes to run at once
+        num_checkers (int): the number of existence checks to run at once
+        debug (bool): print debug messages
+    """
+
+    def __init__(self, mapsin, mapsout, mapserr, logpath, sproket='sproket', cache=None, num_publishers=4, num_checkers=8, debug=False):
+        self.mapsin = mapsin
+        self.mapsout = mapsout
+        self.mapserr = mapserr
+        self.logpath = logpath
+        self.sproket = sproket
+        self.cache = cache
+        self.debug = debug
+        self.metrics = PublishMetrics()
+        # mapfile name -> future for every mapfile that is being checked or published
+        self.pending = dict()
+        self.futures = dict()
+
+        os.makedirs(logpath, exist_ok=True)
+        self.tmpdir = TemporaryDirectory()
+        self.check_pool = ThreadPoolExecutor(max_workers=num_checkers)
+        self.publish_pool = ThreadPoolExecutor(max_workers=num_publishers)
+
+    def close(self):
+        self.check_pool.shutdown()
+        self.publish_pool.shutdown()
+        self.tmpdir.cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def move(self, mapfile, dst):
+        os.rename(
+            os.path.join(self.mapsin, mapfile),
+            os.path.join(dst, mapfile))
+
+    def submit(self, mapfiles):
+        """
+        Queue the existence checks for any of the mapfiles that arent already in flight
+        """
         for m in mapfiles:
+            if m in self.pending:
+                continue
             if m[-4:] != '.map':
                 msg = "Unrecognized file type, this doesnt appear to be an ESGF mapfile. Moving to the err directory {}".format(m)
                 print_message(msg)
-                os.rename(
-                    os.path.join(mapsin, m),
-                    os.path.join(mapserr, m))
+                self.move(m, self.mapserr)
+                self.metrics.add('rejected')
                 continue
 
-            print_message(f"Starting publication for {m}", 'ok')
-
             datasetID = m[:-4]
-            project = datasetID.split('.')[0]
-            if check_ds_exists(datasetID, debug=debug, sproket=sproket):
-                msg = f"Dataset {datasetID} already exists"
-                print_message(msg, 'err')
-                os.rename(
-                    os.path.join(mapsin, m),
-                    os.path.join(mapserr, m))
-                continue
-            if project == 'CMIP6':
-                project = 'cmip6'
-                project_metadata = None
-            elif project == 'E3SM':
-                campaign, driver, period = get_facet_info(datasetID)
-                if campaign and driver and period:
-                    project_metadata_path = os.path.join(tmpdir, f'{datasetID}.json')
-                    project_metadata = {
-                        'campaign': campaign,
-                        'science_driver': driver,
-                        'period': period
-                    }
-                    with open(project_metadata_path, 'w') as op:
-                        json.dump(project_metadata, op)
-            else:
-                raise ValueError(
-                    "Unrecognized project name for mapfile: {}".format(m))
-            
-            map_path = os.path.join(mapsin, m)
-            cmd = f"esgpublish --project {project} --map {map_path}".split()
-            if project_metadata:
-                cmd.extend(['--json', project_metadata_path])
-            
-            print_message(f"Running: {' '.join(cmd)}", 'ok')
-            log = os.path.join(logpath, f"{datasetID}.log")
-            print_message(f"Writing publication log to {log}", 'ok')
-            
-            with open(log, 'w') as outstream:
-                proc = Popen(cmd, stdout=outstream, stderr=outstream, universal_newlines=True)
-                proc.wait()
-
-            if proc.returncode != 0:
-                if proc.stderr:
-                    print(proc.stderr.readlines(), flush=True)
-                print_message(
-                    f"Error in publication, moving {m} to {mapserr}\n", "error")
-                os.rename(
-                    os.path.join(mapsin, m),
-                    os.path.join(mapserr, m))
+            future = self.check_pool.submit(
+                check_ds_exists, datasetID, debug=self.debug, sproket=self.sproket, cache=self.cache)
+            self.pending[m] = future
+            self.futures[future] = ('check', m)
+
+    def poll(self, timeout=None):
+        """
+        Wait for at least one existence check or publication to finish and handle
+        everything that has, returns the number of jobs handled
+        """
+        if not self.futures:
+            return 0
+        done, _ = wait(list(self.futures), timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            stage, m = self.futures.pop(future)
+            if stage == 'check':
+                self._start_publication(m, future.result())
             else:
-                print_message(
-                    f"Publication success, moving {m} to {mapsout}\n", "info")
-                os.rename(
-                    os.path.join(mapsin, m),
-                    os.path.join(mapsout, m))
+                self._finish_publication(m, *future.result())
+        return len(done)
+
+    def drain(self):
+        """
+        Block until every queued mapfile has been handled
+        """
+        while self.futures:
+            self.poll()
+
+    def _start_publication(self, m, exists):
+        datasetID = m[:-4]
+        if exists:
+            msg = f"Dataset {datasetID} already exists"
+            print_message(msg, 'err')
+            self.move(m, self.mapserr)
+            self.metrics.add('existing')
+            del self.pending[m]
+            return
+
+        print_message(f"Starting publication for {m}", 'ok')
+        project = datasetID.split('.')[0]
+        project_metadata = None
+        if project == 'CMIP6':
+            project = 'cmip6'
+        elif project == 'E3SM':
+            campaign, driver, period = get_facet_info(datasetID)
+            if campaign and driver and period:
+                project_metadata_path = os.path.join(self.tmpdir.name, f'{datasetID}.json')
+                project_metadata = {
+                    'campaign': campaign,
+                    'science_driver': driver,
+                    'period': period
+                }
+                with open(project_metadata_path, 'w') as op:
+                    json.dump(project_metadata, op)
+        else:
+            raise ValueError(
+                "Unrecognized project name for mapfile: {}".format(m))
+
+        map_path = os.path.join(self.mapsin, m)
+        cmd = f"esgpublish --project {project} --map {map_path}".split()
+        if project_metadata:
+            cmd.extend(['--json', project_metadata_path])
+
+        print_message(f"Running: {' '.join(cmd)}", 'ok')
+        log = os.path.join(self.logpath, f"{datasetID}.log")
+        print_message(f"Writing publication log to {log}", 'ok')
 
+        future = self.publish_pool.submit(run_esgpublish, cmd, log)
+        self.pending[m] = future
+        self.futures[future] = ('publish', m)
 
-def publish(mapsin, mapsout, mapserr, loop, logpath, sproket='sproket', debug=False):
+    def _finish_publication(self, m, returncode, duration):
+        datasetID = m[:-4]
+        del self.pending[m]
+        if returncode != 0:
+            print_message(
+                f"Error in publication, moving {m} to {self.mapserr}\n", "error")
+            self.move(m, self.mapserr)
+            self.metrics.add('failed', duration)
+        else:
+            print_message(
+                f"Publication success, moving {m} to {self.mapsout}\n", "info")
+            if self.cache is not None:
+                self.cache.invalidate(datasetID)
+            self.move(m, self.mapsout)
+            self.metrics.add('published', duration)
 
+
+def publish_maps(mapfiles, mapsin, mapsout, mapserr, logpath, sproket='spoket', cache=None, num_publishers=4, num_checkers=8, debug=False):
+    """
+    Publish a list of mapfiles, returning once all of them have been handled
+    """
+    with Publisher(mapsin, mapsout, mapserr, logpath, sproket=sproket, cache=cache,
+                   num_publishers=num_publishers, num_checkers=num_checkers, debug=debug) as publisher:
+        publisher.submit(mapfiles)
+        publisher.drain()
+        publisher.metrics.report()
+    return publisher.metrics
+
+
+def publish(mapsin, mapsout, mapserr, loop, logpath, sproket='sproket', search_cache=None, no_search_cache=False, num_publishers=4, num_checkers=8, poll_interval=30, debug=False):
+
+    if debug:
+        enable_debug()
     if loop:
         print_message("Starting publisher loop", 'ok')
     else:
         print_message("Starting one-off publisher", 'ok')
-    while True:
-        mapfiles = [x for x in os.listdir(mapsin) if x.endswith('.map')]
-        if mapfiles:
-            publish_maps(mapfiles, mapsin, mapsout,
-                        mapserr, logpath, debug=debug, sproket=sproket)
-        if not loop:
-            break
-        sleep(30)
+
+    cache = None
+    if not no_search_cache:
+        cache = SearchCache(path=search_cache or SEARCH_CACHE)
+
+    publisher = Publisher(
+        mapsin, mapsout, mapserr, logpath, sproket=sproket, cache=cache,
+        num_publishers=num_publishers, num_checkers=num_checkers, debug=debug)
+    watcher = DirectoryWatcher(mapsin, interval=poll_interval) if loop else None
+    if watcher is not None and debug:
+        print_message(f"Watching {mapsin} for new mapfiles using {watcher.mode}", 'info')
+    try:
+        while True:
+            publisher.submit(
+                [x for x in os.listdir(mapsin) if x.endswith('.map')])
+            if not loop:
+                publisher.drain()
+                break
+
+            if publisher.futures:
+                # keep handling finished jobs, picking up new mapfiles as they show up
+                publisher.poll(timeout=1)
+                watcher.wait(timeout=0)
+                if not publisher.futures:
+                    publisher.metrics.report()
+            else:
+                watcher.wait(timeout=poll_interval)
+    finally:
+        publisher.close()
+        if watcher is not None:
+            watcher.close()
+        if cache is not None:
+            cache.close()
+    publisher.metrics.report()
 
     return 0
@@ -0,0 +1,146 @@
+"""
+Streaming output for the results of esgfpub check
+"""
+import json
+
+KINDS = ['missing', 'extra', 'issues']
+
+
+def digest_key(kind, item):
+    """
+    Reduce a result line to the dataset it belongs to. Missing datasets are
+    kept as the whole 'No dataset: ...' line, everything else is cut down to
+    the dataset_id in front of the first ':'
+    """
+    idx = item.find(':')
+    if idx == -1 or kind == 'issues':
+        return item
+    if kind == 'missing' and item[:idx] == 'No dataset':
+        return item
+    return item[:idx]
+
+
+class ResultWriter(object):
+    """
+    Collect the missing files, extra files and verification issues found by the checks
+
+    If a path is given each result is written out as a line of JSON the moment it is added,
+    and the file is flushed after every dataset, so an interrupted run still leaves every
+    result found up to that point. The results are then read back from the file instead of
+    being held in memory, unless digest is on, where only the dataset_ids are kept
+
+    Parameters:
+        path (str): the JSON Lines file to stream results to, or None to keep them in memory
+        digest (bool): only report one line per dataset with missing or extra files
+    """
+
+    def __init__(self, path=None, digest=False):
+        self.path = path
+        self.digest = digest
+        self.counts = {kind: 0 for kind in KINDS}
+        self.items = {kind: list() for kind in KINDS}
+        self.seen = {kind: set() for kind in KINDS}
+        self.datasets = list()
+        self.complete = False
+        self.stream = open(path, 'w') if path else None
+
+    def close(self):
+        if self.stream is not None:
+            self.write({'complete': self.complete, **self.counts})
+            self.stream.close()
+            self.stream = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, record):
+        self.stream.write(json.dumps(record) + '\n')
+
+    @property
+    def in_memory(self):
+        return self.digest or not self.path
+
+    def add(self, kind, items, dataset_id=None):
+        """
+        Record the results for one dataset
+
+        Parameters:
+            kind (str): one of 'missing', 'extra' or 'issues'
+            items (list): the result lines
+            dataset_id (str): if given, the dataset is also recorded as having been checked
+        """
+        for item in items:
+            if self.digest and kind != 'issues':
+                item = digest_key(kind, item)
+                if item in self.seen[kind]:
+                    continue
+                self.seen[kind].add(item)
+            if self.in_memory:
+                self.items[kind].append(item)
+            if self.stream is not None:
+                self.write({kind: item})
+            self.counts[kind] += 1
+        if dataset_id is not None:
+            self.add_dataset(dataset_id)
+        elif self.stream is not None:
+            self.stream.flush()
+
+    def add_dataset(self, dataset_id):
+        self.datasets.append(dataset_id)
+        if self.stream is not None:
+            self.write({'dataset': dataset_id})
+            self.stream.flush()
+
+    def get(self, kind):
+        """
+        Return the results of the given kind, reading them back from
+        the output file if they arent held in memory
+        """
+        if self.in_memory:
+            return self.items[kind]
+        if self.stream is not None:
+            self.stream.flush()
+        return read_results(self.path)[kind]
+
+
+def read_results(path):
+    """
+    Read a results file written by ResultWriter, or the single JSON document
+    written by older versions
+
+    Returns:
+        dict with the lists of 'missing', 'extra', 'issues' and 'datasets', and
+        'complete', which is False if the run that wrote the file didnt finish
+    """
+    results = {kind: list() for kind in KINDS}
+    results['datasets'] = list()
+    results['complete'] = False
+
+    with open(path, 'r') as ip:
+        # the old format is a single indented JSON document
+        if ip.readline().strip() == '{':
+            ip.seek(0)
+            data = json.load(ip)
+            for kind in KINDS:
+                results[kind] = data.get(kind, list())
+            results['complete'] = True
+            return results
+
+        ip.seek(0)
+        for line in ip:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # the last line of an interrupted run may be cut short
+                break
+            if 'complete' in record:
+                results['complete'] = record['complete']
+            elif 'dataset' in record:
+                results['datasets'].append(record['dataset'])
+            else:
+                for kind, item in record.items():
+                    results[kind].append(item)
+    return results
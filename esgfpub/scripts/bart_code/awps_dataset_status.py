@@ -49,10 +49,13 @@ gv_csv = False
 
 # esgf_pr   = '/p/user_pub/e3sm/bartoletti1/Pub_Status/sproket/ESGF_publication_report-20200915.144250'
 
+gv_manifest = None
+
 def assess_args():
     global thePWD
     global esgf_pr
     global gv_csv
+    global gv_manifest
 
     thePWD = os.getcwd()
     # parser = argparse.ArgumentParser(description=helptext, prefix_chars='-')
@@ -63,9 +66,15 @@ def assess_args():
 
     required.add_argument('-s', action='store', dest="esgf_pr", type=str, required=True)
     optional.add_argument('--csv', action='store_true', dest="csv", required=False)
+    optional.add_argument('--use-manifest', action='store_true', dest="use_manifest", required=False)
+    optional.add_argument('--manifest-path', action='store', dest="manifest_path", type=str, required=False)
 
     args = parser.parse_args()
 
+    if args.use_manifest:
+        from esgfpub.manifest import Manifest, MANIFEST
+        gv_manifest = Manifest(args.manifest_path or MANIFEST)
+
     esgf_pr = args.esgf_pr
     if args.csv:
         gv_csv = args.csv
@@ -150,10 +159,15 @@ def isVLeaf(_):
         return True
     return False
 
+def walker():
+    if gv_manifest:
+        return gv_manifest.walk
+    return os.walk
+
 def get_maxv_info(edir):
     ''' given an ensemble directory, return the max "v#" subdirectory and its file count '''
     tuplist = []
-    for root, dirs, files in os.walk(edir):
+    for root, dirs, files in walker()(edir):
         if not dirs:
             tuplist.append(tuple([os.path.split(root)[1],len(files)]))
     tuplist.sort()
@@ -325,7 +339,7 @@ def main():
     ##########
 
     warehouse_leaf_dirs = []
-    for root, dirs, files in os.walk(warehouse):      # aggregate full sourcefile paths in src_selected
+    for root, dirs, files in walker()(warehouse):      # aggregate full sourcefile paths in src_selected
         # if not dirs and (src_selector in root):     # at leaf-directory matching src_selector
         if not dirs:     # at leaf-directory matching src_selector
             warehouse_leaf_dirs.append(root)
@@ -336,7 +350,7 @@ def main():
         ensdir, vleaf = os.path.split(adir)
         if not isVLeaf(vleaf):
             continue
-        for root, dirs, files in os.walk(adir):
+        for root, dirs, files in walker()(adir):
             if files:
                 wh_nonempty.append( tuple([ensdir,vleaf,len(files)]))
 
@@ -369,7 +383,7 @@ def main():
     ##########
 
     publicati_leaf_dirs = []
-    for root, dirs, files in os.walk(publicati):      # aggregate full sourcefile paths in src_selected
+    for root, dirs, files in walker()(publicati):      # aggregate full sourcefile paths in src_selected
         # if not dirs and (src_selector in root):     # at leaf-directory matching src_selector
         if not dirs:     # at leaf-directory matching src_selector
             publicati_leaf_dirs.append(root)
@@ -379,7 +393,7 @@ def main():
         ensdir, vleaf = os.path.split(adir)
         if not isVLeaf(vleaf):
             continue
-        for root, dirs, files in os.walk(adir):
+        for root, dirs, files in walker()(adir):
             if files:
                 pub_nonempty.append( tuple([ensdir,vleaf,len(files)]))
 
@@ -560,6 +574,9 @@ def main():
                 out_line = ','.join(out_list)
                 print(f'{out_line}')
                 
+    if gv_manifest:
+        gv_manifest.close()
+
     sys.exit(0)
 
 if __name__ == "__main__":
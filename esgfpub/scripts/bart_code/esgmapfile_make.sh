@@ -1,10 +1,10 @@
 #!/bin/bash
 
 # FORMAT
-# esgmapfile_make.sh <dataset_fullpath>
+# esgmapfile_make.sh <dataset_fullpath> [hash_workers]
 # Note: output mapfile fullpath will be <dataset_fullpath>.mapfile
 
-proc_num=30
+proc_num=${2:-`nproc`}
 
 workpath=/p/user_pub/e3sm/bartoletti1/Pub_Work/2_Mapwork
 ini_path=/p/user_pub/e3sm/staging/ini_std/
@@ -52,7 +52,7 @@ ds_tm1=`date +%s`
 #conda init bash
 source ~/anaconda3/etc/profile.d/conda.sh
 conda activate pub
-esgmapfile make --debug -i $ini_path --max-processes $proc_num --project e3sm --outdir $out_path $dataset_fullpath
+python -m esgfpub.mapfile --max-processes $proc_num --outdir $out_path $dataset_fullpath
 retcode=$?
 conda deactivate
 
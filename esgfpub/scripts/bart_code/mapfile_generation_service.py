@@ -6,9 +6,12 @@ import shutil
 import subprocess
 import time
 from datetime import datetime
+from esgfpub.mapfile import make_mapfile, parse_line
+from esgfpub.checksums import ChecksumCache
 
 subcommand = ''
 gv_logname = ''
+gv_checksums = None
 
 '''
     Run with "nohup python mapfile_generation_service.py &"
@@ -182,14 +185,49 @@ def mapfile_validate(srcdir):
             logMessage('ERROR',f'{atup[0]} not in {atup[1]}')
             return False
 
+    # compare against the checksum store, files it doesnt have a current checksum for arent read
+    if gv_checksums is not None:
+        for aline in mapfile_lines:
+            entry = parse_line(aline)
+            if entry is None:
+                continue
+            try:
+                known = gv_checksums.get(entry.path)
+            except OSError:
+                continue
+            if known is not None and known != entry.checksum:
+                logMessage('ERROR',f'mapfile checksum does not match file: {entry.path}')
+                return False
+
     return True
 
 
+def mapfile_make(dataset_fullpath):
+    ''' write the mapfile for a dataset version directory to <ensemble_path>/.mapfile,
+        in process instead of through esgmapfile_make.sh. Only the files that changed
+        since an existing .mapfile was written are hashed again.
+        Returns 0 on success, 1 on failure
+    '''
+    dataset_ens_path, _ = os.path.split(os.path.normpath(dataset_fullpath))
+    logMessage('STATUS',f'ESGMM: make_mapfile: processing dataset {dataset_fullpath}')
+    try:
+        mapfile, hashed, reused = make_mapfile(
+            dataset_fullpath,
+            os.path.join(dataset_ens_path,'.mapfile'),
+            num_workers=hash_workers,
+            checksums=gv_checksums)
+    except (OSError, ValueError) as error:
+        logMessage('STATUS',f'ESGMM: FAILURE: dataset {dataset_fullpath}: {repr(error)}')
+        return 1
+    logMessage('STATUS',f'ESGMM: COMPLETED: dataset {dataset_fullpath}: hashed={hashed} reused={reused}')
+    return 0
+
+
 input_dir = '/p/user_pub/e3sm/staging/mapfiles/mapfile_requests'
 exput_dir = '/p/user_pub/e3sm/staging/mapfiles/mapfiles_output'
 ini_path = '/p/user_pub/e3sm/staging/ini_std/'
-# calls esgmapfile make, moves finished mapfile to pub_path/.../ens#/v#/.mapfile
-esgmapfile_make = '/p/user_pub/e3sm/bartoletti1/Pub_Work/2_Mapwork/esgmapfile_make.sh'
+# the number of files hashed at once
+hash_workers = os.cpu_count() or 8
 
 searchpath = os.path.join(input_dir,'mapfile_request.*')
 
@@ -199,8 +237,11 @@ req_done = os.path.join(pwd,'requests_processed')
 
 def main():
 
+    global gv_checksums
+
     # assess_args()
     logMessageInit('runlog_mapfile_gen_loop')
+    gv_checksums = ChecksumCache()
 
     while True:
         req_files = glob.glob(input_dir + '/*')
@@ -229,10 +270,10 @@ def main():
         logMessage('INFO',f'MAPGENLOOP:Launching Request Path:{request_path}')
         tm_start = time.time()
         # CALL the Mapfile Maker
-        # WAIT here until esgmapfile_make returns
+        # WAIT here until mapfile_make returns
         if warehouse_persona:
             setStatus(statfile,'WAREHOUSE',f'MAPFILE_GEN:Engaged')
-        retcode = os.system(f'{esgmapfile_make} {request_path}')
+        retcode = mapfile_make(request_path)
 
         tm_final = time.time()
         ET = tm_final - tm_start
@@ -26,12 +26,14 @@ gv_all = True
 gv_empty = False
 gv_nonempty = False
 gv_csv = False
+gv_manifest = None
 
 def assess_args():
     global gv_all
     global gv_empty
     global gv_nonempty
     global gv_csv
+    global gv_manifest
     global stats_out
 
     parser = argparse.ArgumentParser(description=helptext, prefix_chars='-', formatter_class=RawTextHelpFormatter)
@@ -43,9 +45,15 @@ def assess_args():
     optional.add_argument('--empty', action='store_true', dest="gv_empty", required=False)
     optional.add_argument('--nonempty', action='store_true', dest="gv_nonempty", required=False)
     optional.add_argument('--CSV', action='store_true', dest="gv_csv", required=False)
+    optional.add_argument('--use-manifest', action='store_true', dest="use_manifest", required=False)
+    optional.add_argument('--manifest-path', action='store', dest="manifest_path", type=str, required=False)
 
     args = parser.parse_args()
 
+    if args.use_manifest:
+        from esgfpub.manifest import Manifest, MANIFEST
+        gv_manifest = Manifest(args.manifest_path or MANIFEST)
+
     ac = 0
     if args.gv_all:
         gv_all = args.gv_all
@@ -202,9 +210,14 @@ def get_dsid_type_key( dsid ):
 def get_dsid(ensdir):
     return '.'.join(ensdir.split('/')[5:])
 
+def walker():
+    if gv_manifest:
+        return gv_manifest.walk
+    return os.walk
+
 def get_vdirs(rootpath,mode):     # mode == "any" (default), or "empty" or "nonempty"
     selected = []
-    for root, dirs, files in os.walk(rootpath):
+    for root, dirs, files in walker()(rootpath):
         if not dirs:
             selected.append(root)
     if not (mode == 'empty' or mode == 'nonempty'):  # "any"
@@ -213,7 +226,7 @@ def get_vdirs(rootpath,mode):     # mode == "any" (default), or "empty" or "none
     sel_empty = []
     sel_nonempty = []
     for adir in selected:
-        for root, dirs, files in os.walk(adir):
+        for root, dirs, files in walker()(adir):
             if files:
                 sel_nonempty.append(adir)
             else:
@@ -437,6 +450,9 @@ def main():
 
     printFileList(stats_out,status_list)
 
+    if gv_manifest:
+        gv_manifest.close()
+
     sys.exit(0)
 
 
@@ -0,0 +1,89 @@
+import sys
+import argparse
+from time import perf_counter
+from esgfpub.checker import check_monthly, check_time_series
+from esgfpub.spec import DatasetSpec
+
+DESC = "Time the dataset completeness checks on synthetic file listings"
+
+
+def legacy_check_monthly(files, prefix, suffix, start, end):
+    """
+    The list based check_monthly, kept here as the baseline
+    """
+    missing, files_found = [], []
+    for year in range(start, end + 1):
+        for month in range(1, 13):
+            name = f'{prefix}{year:04d}-{month:02d}{suffix}'
+            if name not in files:
+                missing.append(name)
+            else:
+                files_found.append(name)
+    extra_files = [x for x in files if x not in files_found]
+    return missing, extra_files
+
+
+def monthly_listing(num_files):
+    prefix = '20180215.DECKv1b_H1.ne30_oEC.edison.cam.h0.'
+    suffix = '.nc'
+    years = num_files // 12
+    files = [f'{prefix}{year:04d}-{month:02d}{suffix}'
+             for year in range(1, years + 1) for month in range(1, 13)]
+    # drop one file and add one extra so both code paths are exercised
+    files.pop(len(files) // 2)
+    files.append(f'{prefix}9999-01{suffix}')
+    return files, prefix, suffix, 1, years
+
+
+def time_series_listing(num_files):
+    # one variable per 100 one-year files
+    num_vars = max(num_files // 100, 1)
+    variables = [f'VAR{i:05d}' for i in range(num_vars)]
+    files = [f'{v}_{year:04d}01_{year:04d}12.nc'
+             for v in variables for year in range(1, 101)]
+    spec = {
+        'time-series': {'atmos': variables},
+        'project': {'E3SM': {'1_0': {'piControl': {'start': 1, 'end': 100}}}}
+    }
+    dataset_id = 'E3SM.1_0.piControl.1deg_atm_60-30km_ocean.atmos.180x360.time-series.mon.ens1.v1'
+    return files, DatasetSpec(spec), dataset_id
+
+
+def timeit(func, *args):
+    start = perf_counter()
+    func(*args)
+    return perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=DESC)
+    parser.add_argument(
+        '--sizes',
+        nargs='+',
+        type=int,
+        default=[1000, 10000, 100000],
+        help="number of files in each synthetic listing, default: 1000 10000 100000")
+    parser.add_argument(
+        '--legacy-max',
+        type=int,
+        default=20000,
+        help="largest listing to run the list based baseline on, default: 20000")
+    args = parser.parse_args()
+
+    print(f"{'files':>8} {'check_monthly':>14} {'legacy':>10} {'check_time_series':>18}")
+    for size in args.sizes:
+        files, prefix, suffix, start, end = monthly_listing(size)
+        monthly = timeit(check_monthly, files, start, end)
+        if size <= args.legacy_max:
+            legacy = f'{timeit(legacy_check_monthly, files, prefix, suffix, start, end):10.3f}'
+        else:
+            legacy = f"{'skipped':>10}"
+
+        files, spec, dataset_id = time_series_listing(size)
+        series = timeit(check_time_series, files, dataset_id, spec, 1, 100)
+        print(f'{size:8d} {monthly:14.3f} {legacy} {series:18.3f}')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+import re
+import sys
+import argparse
+import subprocess
+
+DESC = "Time the import of the esgfpub entry points, and fail if any of them has slowed past its budget"
+
+# import time budget in milliseconds for each module, and the modules it must not load.
+# The scientific stack is only needed by the verification and plotting code, which
+# loads it when it's run, so none of the CLI entry points should pull it in
+HEAVY = ['numpy', 'xarray', 'dask', 'matplotlib', 'statsmodels', 'esgfpub.verify']
+BUDGETS = {
+    'esgfpub.__main__': (150, HEAVY),
+    'esgfpub.checker': (350, HEAVY),
+    'esgfpub.stager': (200, HEAVY),
+    'esgfpub.publisher': (350, HEAVY),
+    'esgfpub.custom_facets': (300, HEAVY)
+}
+LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$')
+
+
+def import_time(module, python=sys.executable):
+    """
+    Import the module in a fresh interpreter with -X importtime
+
+    Returns:
+        the cumulative import time of the module in milliseconds, and the set of every module it loaded
+    """
+    proc = subprocess.run(
+        [python, '-X', 'importtime', '-c', f'import {module}'],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f'Unable to import {module}:\n{proc.stderr}')
+    cumulative = None
+    loaded = set()
+    for line in proc.stderr.splitlines():
+        match = LINE.match(line)
+        if not match:
+            continue
+        name = match.group(4)
+        loaded.add(name)
+        if name == module and not match.group(3):
+            cumulative = int(match.group(2)) / 1000
+    return cumulative, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=DESC)
+    parser.add_argument(
+        '--modules',
+        nargs='+',
+        default=list(BUDGETS.keys()),
+        help=f"modules to time, default: {' '.join(BUDGETS.keys())}")
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=5,
+        help="number of fresh interpreters to time each module in, the fastest is kept, default: 5")
+    parser.add_argument(
+        '--scale',
+        type=float,
+        default=1.0,
+        help="multiply every budget by this much, for slower machines, default: 1.0")
+    args = parser.parse_args()
+
+    failures = list()
+    print(f"{'module':>24} {'ms':>8} {'budget':>8}")
+    for module in args.modules:
+        budget, forbidden = BUDGETS.get(module, (None, HEAVY))
+        times = list()
+        for _ in range(args.repeat):
+            elapsed, loaded = import_time(module)
+            times.append(elapsed)
+        elapsed = min(times)
+        budget = budget * args.scale if budget else None
+        print(f"{module:>24} {elapsed:8.1f} {budget if budget else '-':>8}")
+
+        if budget and elapsed > budget:
+            failures.append(f'{module} took {elapsed:.1f}ms to import, over its {budget:.0f}ms budget')
+        heavy = [f for f in forbidden if any(x == f or x.startswith(f + '.') for x in loaded)]
+        if heavy:
+            failures.append(f"{module} loads {', '.join(heavy)}")
+
+    for failure in failures:
+        print(f'FAILURE: {failure}')
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
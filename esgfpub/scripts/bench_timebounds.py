@@ -0,0 +1,139 @@
+import os
+import sys
+import argparse
+import tempfile
+import numpy as np
+import xarray as xr
+import netCDF4
+from time import perf_counter
+from esgfpub.scripts.timerect.timebounds import read_bounds, read_variable, bounds_range, monotonic_failure, step_discontinuities
+
+DESC = "Time reading the time index of a directory of synthetic daily files, with xarray and with the netCDF4 reader"
+
+
+def legacy_monotonic(path):
+    """
+    The xarray based timerectifier.monotonic_check, kept here as the baseline
+    """
+    with xr.open_dataset(path, decode_times=False) as ds:
+        start_bound = ds['time_bnds'][0].values[0]
+        end_bound = ds['time_bnds'][-1].values[-1]
+        l1, l2 = -1.0, -1.0
+        for bounds in ds['time_bnds']:
+            b1, b2 = bounds.values
+            if (l1 == -1.0 and b1 == 0.0) or (b1 == b2):
+                continue
+            if b1 > l1 and b2 > l2:
+                l1 = b1
+                l2 = b2
+            else:
+                return None, None
+        return start_bound, end_bound
+
+
+def legacy_check_file(path, freq):
+    """
+    The xarray based timechecker.check_file, kept here as the baseline
+    """
+    prevtime = None
+    first, last = None, None
+    discontinuities = 0
+    with xr.open_dataset(path, decode_times=False) as ds:
+        for step in ds['time']:
+            time = step.values.item()
+            if not prevtime:
+                prevtime = time
+                first = time
+                continue
+            delta = time - prevtime
+            if delta == 0:
+                return time, time, discontinuities
+            elif delta != freq:
+                discontinuities += 1
+            prevtime = time
+        last = time
+    return first, last, discontinuities
+
+
+def new_monotonic(path):
+    bounds = read_bounds(path)
+    if monotonic_failure(bounds):
+        return None, None
+    return bounds_range(bounds)
+
+
+def new_check_file(path, freq):
+    times, _ = read_variable(path, 'time')
+    first, last, discontinuities = step_discontinuities(times, freq)
+    return first, last, len(discontinuities)
+
+
+def make_files(outdir, num_files, steps, ncol):
+    """
+    Write daily files with a few broken ones, one whose bounds go backwards
+    and one with a skipped day
+    """
+    paths = list()
+    for idx in range(num_files):
+        start = 1 + idx * steps
+        time = np.arange(start, start + steps, dtype=np.float64)
+        bounds = np.stack([time - 1, time], axis=1)
+        if idx == num_files // 3:
+            bounds[steps // 2] = bounds[steps // 2 - 1] - 1
+        if idx == num_files // 2:
+            time[steps // 2:] += 1
+        path = os.path.join(outdir, f'case.eam.h1.{idx:06d}.nc')
+        with netCDF4.Dataset(path, 'w') as nc:
+            nc.createDimension('time', None)
+            nc.createDimension('nbnd', 2)
+            nc.createDimension('ncol', ncol)
+            var = nc.createVariable('time', 'f8', ('time',))
+            var.units = 'days since 0001-01-01 00:00:00'
+            var.calendar = 'noleap'
+            var[:] = time
+            nc.createVariable('time_bnds', 'f8', ('time', 'nbnd'))[:] = bounds
+            for name in ['TS', 'PS', 'PRECT']:
+                nc.createVariable(name, 'f4', ('time', 'ncol'))[:] = np.ones((steps, ncol), dtype=np.float32)
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=DESC)
+    parser.add_argument(
+        '--num-files',
+        type=int,
+        default=500,
+        help="number of files to scan, default: 500")
+    parser.add_argument(
+        '--steps',
+        type=int,
+        default=31,
+        help="time steps in each file, default: 31")
+    parser.add_argument(
+        '--ncol',
+        type=int,
+        default=1000,
+        help="columns in each data variable, default: 1000")
+    args = parser.parse_args()
+
+    retcode = 0
+    with tempfile.TemporaryDirectory() as outdir:
+        paths = make_files(outdir, args.num_files, args.steps, args.ncol)
+        print(f"{'check':>26} {'files':>7} {'seconds':>9}")
+        for name, legacy, new in [('monotonic_check', legacy_monotonic, new_monotonic),
+                                  ('check_file', lambda p: legacy_check_file(p, 1.0), lambda p: new_check_file(p, 1.0))]:
+            found = dict()
+            for check, func in [('xarray', legacy), ('netCDF4', new)]:
+                start = perf_counter()
+                found[check] = [func(path) for path in paths]
+                elapsed = perf_counter() - start
+                print(f"{name + ' ' + check:>26} {len(paths):>7} {elapsed:9.3f}")
+            if found['xarray'] != found['netCDF4']:
+                print(f'FAILURE: xarray and netCDF4 results differ for {name}')
+                retcode = 1
+    return retcode
+
+
+if __name__ == "__main__":
+    sys.exit(main())
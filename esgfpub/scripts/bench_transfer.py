@@ -0,0 +1,111 @@
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+from time import perf_counter
+from esgfpub.transfer import plan_transfers, run_transfers
+
+DESC = "Time the stage file transfer on a synthetic tree of small files"
+
+
+def legacy_transfer(src_dir, dst_dir, mode):
+    """
+    The one file at a time transfer loop from the original transfer_files, kept here as the baseline
+    """
+    transfer = {'copy': shutil.copy, 'move': shutil.move, 'link': os.symlink}[mode]
+    dataset_paths = list()
+    for item in os.listdir(src_dir):
+        src = os.path.join(src_dir, item)
+        dst = os.path.join(dst_dir, item)
+        if os.path.exists(dst):
+            continue
+        tail, _ = os.path.split(dst)
+        if not os.path.exists(tail):
+            os.makedirs(tail)
+        if tail not in dataset_paths:
+            dataset_paths.append(tail)
+        if os.path.exists(dst) or os.path.lexists(dst):
+            continue
+        if not os.path.exists(src):
+            continue
+        transfer(src, dst)
+
+
+def make_tree(root, num_files, num_datasets, size):
+    """
+    Write num_files files of the given size split across num_datasets source directories
+    """
+    payload = os.urandom(size)
+    sources = list()
+    per_dataset = max(num_files // num_datasets, 1)
+    for i in range(num_datasets):
+        src = os.path.join(root, 'src', f'dataset{i}')
+        os.makedirs(src)
+        for year in range(per_dataset):
+            with open(os.path.join(src, f'VAR{i}_{year:06d}01_{year:06d}12.nc'), 'wb') as op:
+                op.write(payload)
+        sources.append(src)
+    return sources
+
+
+def main():
+    parser = argparse.ArgumentParser(description=DESC)
+    parser.add_argument(
+        '--num-files',
+        type=int,
+        default=100000,
+        help="total number of files in the synthetic tree, default: 100000")
+    parser.add_argument(
+        '--datasets',
+        type=int,
+        default=10,
+        help="number of source directories to split the files across, default: 10")
+    parser.add_argument(
+        '--size',
+        type=int,
+        default=4096,
+        help="size of each file in bytes, default: 4096")
+    parser.add_argument(
+        '--workers',
+        type=int,
+        nargs='+',
+        default=[1, 8, 32],
+        help="worker pool sizes to time, default: 1 8 32")
+    parser.add_argument(
+        '--modes',
+        nargs='+',
+        default=['copy', 'link'],
+        help="transfer modes to time, default: copy link")
+    parser.add_argument(
+        '--tmp',
+        help="directory to build the tree in, defaults to the system temp directory")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='esgfpub-bench-', dir=args.tmp)
+    try:
+        sources = make_tree(root, args.num_files, args.datasets, args.size)
+        print(f"{'mode':>6} {'engine':>10} {'seconds':>9} {'files/s':>10}")
+        for mode in args.modes:
+            runs = [('legacy', None)] + [(f'{w} workers', w) for w in args.workers]
+            for name, workers in runs:
+                dst_root = os.path.join(root, 'dst')
+                start = perf_counter()
+                if workers is None:
+                    for src in sources:
+                        legacy_transfer(src, os.path.join(dst_root, os.path.basename(src)), mode)
+                    num_files = sum(len(os.listdir(src)) for src in sources)
+                else:
+                    jobs, _, _ = plan_transfers(
+                        [(src, os.path.join(dst_root, os.path.basename(src)), src) for src in sources])
+                    num_files, _ = run_transfers(jobs, mode, num_workers=workers, quiet=True)
+                elapsed = perf_counter() - start
+                print(f'{mode:>6} {name:>10} {elapsed:9.2f} {num_files / elapsed:10.0f}')
+                shutil.rmtree(dst_root)
+    finally:
+        shutil.rmtree(root)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+import sys
+import argparse
+import numpy as np
+import xarray as xr
+from time import perf_counter
+from esgfpub.verify import variance_issues, WINDOW
+
+DESC = "Time the squared variance check on synthetic monthly and daily global mean series"
+
+
+def legacy_run_chunk(ds, dataset_id, maxrollingvar, maxrollingstd):
+    """
+    The per timestep run_chunk loop from the original check_sq_variance, kept here as the baseline
+    """
+    issues = list()
+    vmax = np.ndarray(shape=(len(ds['time'])))
+    idx = -1
+    for step in ds['time']:
+        idx += 1
+
+        mean = ds.sel(time=step)['means'].values
+        if not isinstance(mean, int) and not isinstance(mean, float) and mean.size > 1:
+            mean = max(mean)
+
+        if mean == 0.0:
+            issues.append(
+                f"\tZero data issue found for {dataset_id} at {str(step['time'].item())[:7]}")
+            vmax[idx] = 0
+            continue
+
+        max_rolling_var = maxrollingvar.sel(time=step)
+        mx_rolling_std = maxrollingstd.sel(time=step)
+        if np.isnan(max_rolling_var) or np.isnan(mx_rolling_std) or np.isnan(mean):
+            vmax[idx] = 0
+            continue
+        if not mx_rolling_std.any():
+            vmax[idx] = 0
+            continue
+
+        max_variance = pow((mean - max_rolling_var)/mx_rolling_std, 2).values.item()
+        vmax[idx] = max_variance
+
+    threshold = 3 * vmax.std() + vmax.mean()
+    for idx, v in enumerate(vmax):
+        if v >= threshold:
+            issues.append(
+                f"\tmax variance issue found for {dataset_id} at {str( ds['time'][idx].item() )[:7]}")
+    return vmax, issues, threshold
+
+
+def legacy_check(ds, dataset_id):
+    maxrollingvar = ds['means'].rolling({'time': WINDOW}, min_periods=1).mean()
+    maxrollingstd = ds['means'].rolling({'time': WINDOW}, min_periods=1).std()
+    return legacy_run_chunk(ds, dataset_id, maxrollingvar, maxrollingstd)
+
+
+def synthetic_series(years, freq):
+    """
+    A seasonal global mean temperature series with noise, a zero timestep and a spike
+    """
+    times = xr.cftime_range('0001-01-01', periods=years * (12 if freq == 'MS' else 365), freq=freq, calendar='noleap')
+    steps_per_year = 12 if freq == 'MS' else 365
+    rng = np.random.default_rng(0)
+    phase = np.arange(times.size) * 2 * np.pi / steps_per_year
+    means = 288 + 5 * np.sin(phase) + rng.normal(0, 0.5, times.size)
+    means[times.size // 3] = 0
+    means[times.size // 2] += 50
+    return xr.Dataset({'means': ('time', means)}, coords={'time': times})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=DESC)
+    parser.add_argument(
+        '--monthly-years',
+        type=int,
+        default=500,
+        help="length of the monthly series in years, default: 500")
+    parser.add_argument(
+        '--daily-years',
+        type=int,
+        default=100,
+        help="length of the daily series in years, default: 100")
+    parser.add_argument(
+        '--chunk-size',
+        type=int,
+        default=1200,
+        help="timesteps per chunk for the chunked evaluation, default: 1200")
+    parser.add_argument(
+        '--skip-legacy',
+        action='store_true',
+        help="only time the vectorized check")
+    args = parser.parse_args()
+
+    retcode = 0
+    print(f"{'series':>8} {'steps':>7} {'check':>10} {'seconds':>9} {'issues':>7}")
+    for name, years, freq in [('monthly', args.monthly_years, 'MS'), ('daily', args.daily_years, 'D')]:
+        ds = synthetic_series(years, freq)
+        runs = [('vector', None), ('chunked', args.chunk_size)]
+        found = dict()
+        for check, chunk_size in runs:
+            start = perf_counter()
+            vmax, issues, _ = variance_issues(ds['means'].values, ds['time'].values, 'synthetic', chunk_size=chunk_size)
+            elapsed = perf_counter() - start
+            found[check] = vmax
+            print(f"{name:>8} {ds['time'].size:>7} {check:>10} {elapsed:9.3f} {len(issues):>7}")
+        if not np.allclose(found['vector'], found['chunked']):
+            print(f'FAILURE: chunked and whole array results differ for the {name} series')
+            retcode = 1
+
+        if not args.skip_legacy:
+            start = perf_counter()
+            vmax, issues, _ = legacy_check(ds, 'synthetic')
+            elapsed = perf_counter() - start
+            print(f"{name:>8} {ds['time'].size:>7} {'legacy':>10} {elapsed:9.3f} {len(issues):>7}")
+            if not np.allclose(vmax, found['vector'], rtol=1e-6, atol=1e-9):
+                print(f'FAILURE: vectorized and legacy results differ for the {name} series')
+                retcode = 1
+    return retcode
+
+
+if __name__ == "__main__":
+    sys.exit(main())
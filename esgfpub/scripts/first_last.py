@@ -1,6 +1,6 @@
 import sys
 import argparse
-import xarray as xr
+from esgfpub.scripts.timerect.timebounds import read_bounds, bounds_range
 
 def main():
     parser = argparse.ArgumentParser()
@@ -8,13 +8,14 @@ def main():
     parser.add_argument('--all', action="store_true")
     args = parser.parse_args()
 
-    with xr.open_dataset(args.path, decode_times=False) as ds:
-        if args.all:
-            for bounds in ds['time_bnds']:
-                print(f"{bounds.values}")
-        else:
-            print(f"{ds['time_bnds'][0].values[0]} - {ds['time_bnds'][-1].values[-1]}")
+    bounds = read_bounds(args.path)
+    if args.all:
+        for row in bounds:
+            print(f"{row}")
+    else:
+        first, last = bounds_range(bounds)
+        print(f"{first} - {last}")
     return 0
 
 if __name__ == "__main__":
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""
+Read the time axis of netCDF files for the time index checks, without building an xarray Dataset.
+Each file is opened with netCDF4, only the time or time_bnds variable is read, straight into a
+numpy array, and the first and last index and any ordering problems are found in one vectorized pass
+"""
+import numpy as np
+import netCDF4
+
+TIME_NAMES = ['time', 'Time']
+BOUNDS_NAME = 'time_bnds'
+
+
+def find_time(nc):
+    """
+    Returns the name of the time dimension of an open netCDF4 Dataset
+    """
+    for name in TIME_NAMES:
+        if name in nc.dimensions:
+            return name
+    raise KeyError(f"No time dimension found in {nc.filepath()}")
+
+
+def read_variable(path, name=None):
+    """
+    Read a single variable from a file without decoding its times
+
+    Parameters:
+        path (str): the netCDF file
+        name (str): the variable to read, defaults to the time variable
+    Returns:
+        numpy array of the values, and a dict of the variable's attributes
+    """
+    with netCDF4.Dataset(path) as nc:
+        var = nc.variables[name or find_time(nc)]
+        # a plain array rather then a masked one, the time axis shouldnt have any fill values
+        var.set_auto_mask(False)
+        return var[:], var.__dict__
+
+
+def read_bounds(path):
+    """
+    Returns the time_bnds of a file as an (n, 2) numpy array
+    """
+    bounds, _ = read_variable(path, BOUNDS_NAME)
+    return bounds
+
+
+def bounds_range(bounds):
+    """
+    Returns the start of the first time bound and the end of the last one
+
+    Raises:
+        IndexError if the bounds arent an (n, 2) array with at least one step
+    """
+    if bounds.ndim != 2 or not bounds.shape[0] or bounds.shape[1] < 2:
+        raise IndexError(f"unexpected time_bnds shape {bounds.shape}")
+    return bounds[0, 0], bounds[-1, -1]
+
+
+def monotonic_failure(bounds):
+    """
+    Check that both the start and end of each time bound are strictly greater then the last one.
+    Zero width bounds are skipped, as are bounds that start at 0 before any other step, the
+    daily files have a 0 width time step at the start
+
+    Returns:
+        None if the bounds are monotonically increasing, otherwise the first bound that isnt
+        and the bound it should have been greater then
+    """
+    start, end = bounds[:, 0], bounds[:, -1]
+    keep = start != end
+    # a step starting at 0 is only skipped if no step has been kept before it
+    keep &= ~((start == 0) & (np.cumsum(keep & (start != 0)) == 0))
+    kept = np.flatnonzero(keep)
+    # the first kept step is compared against (-1, -1)
+    previous = np.concatenate([[[-1.0, -1.0]], bounds[kept[:-1]][:, [0, -1]]]) if kept.size else np.empty((0, 2))
+    failed = np.flatnonzero((bounds[kept, 0] <= previous[:, 0]) | (bounds[kept, -1] <= previous[:, 1]))
+    if not failed.size:
+        return None
+    idx = failed[0]
+    return tuple(bounds[kept[idx], [0, -1]]), tuple(previous[idx])
+
+
+def step_discontinuities(times, freq):
+    """
+    Check that each step of a time axis is exactly freq after the last one
+
+    Returns:
+        the first and last times, and a list of (time, delta) for each step that's the wrong distance
+        from the one before. If two steps have the same time the data is monthly, and that time is
+        returned as both the first and last, along with any discontinuities before it
+    """
+    times = np.asarray(times)
+    if not times.size:
+        return None, None, []
+    deltas = np.diff(times)
+    repeated = np.flatnonzero(deltas == 0)
+    stop = repeated[0] if repeated.size else deltas.size
+    wrong = np.flatnonzero(deltas[:stop] != freq)
+    discontinuities = [(times[i + 1].item(), deltas[i].item()) for i in wrong]
+    if repeated.size:
+        time = times[stop + 1].item()
+        return time, time, discontinuities
+    return times[0].item(), times[-1].item(), discontinuities
@@ -1,13 +1,13 @@
 import os
 import sys
-import re
 import argparse
-import xarray as xr
 import numpy as np
 import netCDF4
 from tqdm import tqdm
 from datetime import datetime
 from concurrent.futures import ProcessPoolExecutor, as_completed
+from esgfpub.filenames import parse_filename
+from esgfpub.scripts.timerect.timebounds import find_time, read_variable, step_discontinuities
 
 calendars = {
     'noleap': {1: 31, 2: 28, 3: 31, 4: 30, 5: 31, 6: 30, 7: 31, 8: 31, 9: 30, 10: 31, 11: 30, 12: 31}
@@ -17,46 +17,29 @@ def put_message(message):
     print(f'{datetime.now().strftime("%Y%m%d_%H%M%S")}:{message}')
 
 def get_time_units(path):
-    time_names = ['Time', 'time']
-    time_name = ''
-    with xr.open_dataset(path, decode_times=False) as ds:
-        for name in time_names:
-            if name in ds.dims:
-                time_name = name
-                break
-        return ds[time_name].attrs['units'], time_name
+    with netCDF4.Dataset(path) as nc:
+        time_name = find_time(nc)
+        return nc.variables[time_name].units, time_name
 
-def get_month(path):
-    pattern = r'\d{4}-\d{2}'
-    s = re.search(pattern, path)
-    if not s:
+def get_date_stamp(path):
+    parsed = parse_filename(path)
+    if parsed is None or parsed.kind != 'time-slice':
         raise ValueError(f"Unable to find month string for {path}")
-    return int(path[s.start() + 5: s.start() + 7])
+    return parsed
+
+def get_month(path):
+    return get_date_stamp(path).start_month
 
 def check_file(file, freq, idx, time_name='time'):
     """
     Step through the file checking that each step in time is exactly how long it should be
     and that the time index is monotonically increasing
     """
-    prevtime = None
-    first, last = None, None
-    with xr.open_dataset(file, decode_times=False) as ds:
-        if len(ds[time_name]) == 0:
-            return None, None, idx
-        for step in ds[time_name]:
-            time = step.values.item()
-            if not prevtime:
-                prevtime = time
-                first = time
-                continue
-            delta = time - prevtime
-            if delta == 0:
-                # monthly data
-                return time, time, idx
-            elif delta != freq:
-                put_message(f"time discontinuity in {file} at {time}, delta was {delta} when it should have been {freq}")    
-            prevtime = time
-        last = time
+    times, _ = read_variable(file, time_name)
+    # a repeated time means monthly data, and is returned as both the first and last
+    first, last, discontinuities = step_discontinuities(times, freq)
+    for time, delta in discontinuities:
+        put_message(f"time discontinuity in {file} at {time}, delta was {delta} when it should have been {freq}")
     return first, last, idx
 
 def main():
@@ -71,35 +54,24 @@ def main():
 
     # collect all the files and sort them by their date stamp
     names = [os.path.join(os.path.abspath(inpath), x) for x in os.listdir(inpath) if x.endswith('.nc')]
-    pattern = r'\d{4}-\d{2}'
-    fileinfo = []
-    for name in names:
-        start = re.search(pattern, name).start()
-        if not start:
-            raise ValueError(f"The year stamp search pattern {pattern} didnt find what it was expecting")
-        fileinfo.append({
-            'prefix': name[:start],
-            'suffix': name[start:],
-            'name': name
-        })
-    files = [x['name'] for x in sorted(fileinfo, key=lambda i: i['suffix'])]
-    del fileinfo
+    files = sorted(names, key=lambda name: get_date_stamp(name).start)
 
     time_units, time_name = get_time_units(files[0])
 
     monthly = False
     freq = None
     # find the time frequency by checking the delta from the 0th to the 1st step
-    with xr.open_dataset(files[0], decode_times=False) as ds:
-        if ds.attrs.get("time_period_freq") == "month_1":
+    with netCDF4.Dataset(files[0]) as nc:
+        time_var = nc.variables[time_name]
+        if getattr(nc, "time_period_freq", None) == "month_1":
             monthly = True
             put_message("Found monthly data")
-            calendar = ds[time_name].attrs['calendar']
+            calendar = time_var.calendar
             if calendar not in calendars:
                 raise ValueError(f"Unsupported calendar type {calendar}")
         else:
             put_message("Found sub-monthly data")
-            freq = ds[time_name][1].values.item() - ds[time_name][0].values.item()
+            freq = (time_var[1] - time_var[0]).item()
             put_message(f"Time frequency detected as {freq} {time_units}")
 
     # iterate over each of the files and get the first and last index from each file
@@ -1,13 +1,14 @@
 import os
 import sys
-import re
 import argparse
 import xarray as xr
 import numpy as np
 import netCDF4
 from tqdm import tqdm
 from datetime import datetime
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor
+from esgfpub.filenames import parse_filename
+from esgfpub.scripts.timerect.timebounds import read_bounds, bounds_range
 
 
 from collections.abc import MutableSet
@@ -104,15 +105,23 @@ def write_netcdf(ds, fileName, fillValues=netCDF4.default_fillvals, unlimited=No
     else:    
         ds.to_netcdf(fileName, encoding=encodingDict)
 
-def check_indices(f1, f2):
+def get_indices(path):
+    """
+    Returns the start of the first time bound and the end of the last one in the file
+    """
+    return bounds_range(read_bounds(path))
 
-    ds1 = xr.open_dataset(f1, decode_times=False)
-    ds2 = xr.open_dataset(f2, decode_times=False)
+def check_indices(f1, f2, indices=None):
+    """
+    Check that the time bounds of f2 start where the ones in f1 end. The bounds are read
+    from the files, unless indices already maps each file to its (start, end)
+    """
+    indices = indices or {f1: get_indices(f1), f2: get_indices(f2)}
 
-    # the ending bound of the first file       
-    last_first_bound = ds1['time_bnds'][-1].values[-1]
+    # the ending bound of the first file
+    last_first_bound = indices[f1][1]
     # the first bound of the second file
-    first_last_bound = ds2['time_bnds'][0].values[0]
+    first_last_bound = indices[f2][0]
 
     if last_first_bound != first_last_bound:
         _, n1 = os.path.split(f1)
@@ -148,8 +157,7 @@ def deoverlap(segments, streams, inpath, outpath):
 
     for segment in segments:
 
-        with xr.open_dataset(os.path.join(os.path.abspath(inpath), segment[1]), decode_times=False) as ds:
-            end_index = ds['time_bnds'][0].values[0]
+        end_index = read_bounds(os.path.join(os.path.abspath(inpath), segment[1]))[0, 0]
         
         new_ds = xr.Dataset()
         with xr.open_dataset(os.path.join(os.path.abspath(inpath), segment[0]), decode_times=False) as ds:
@@ -184,50 +192,40 @@ def main():
 
     # collect all the files and sort them by their date stamp
     names = [os.path.join(inpath, x) for x in os.listdir(inpath) if x.endswith('.nc')]
-    pattern = r'\d{4}-\d{2}-\d{2}'
     files = []
     for name in names:
-        start = re.search(pattern, name).start()
-        files.append({
-            'prefix': name[:start],
-            'suffix': name[start:]
-        })
-    files = sorted(files, key=lambda i: i['suffix'])
+        parsed = parse_filename(name)
+        if parsed is None or parsed.kind != 'time-slice':
+            raise ValueError(f"Unable to find the date stamp for {name}")
+        files.append((parsed, name))
+    files = sorted(files, key=lambda i: i[0].start)
 
     # push the case names into an ordered set
-    streams = [x for x in OrderedSet([i['prefix'][len(inpath) + 1:] for i in files])]
+    streams = [x for x in OrderedSet([parsed.prefix for parsed, _ in files])]
 
-    # reassemble the file names in their sorted order
-    files = [x['prefix'] + x['suffix'] for x in files]
+    # the file names in their sorted order
+    files = [name for _, name in files]
 
 
-    # check all the ordered pairs of files (n, n+1), (n+1, n+2), etc in parallel
-    pairs = zip(files[:-1], files[1:])
-    futures = []
-    overlap = []
+    # read the time bounds of every file once in parallel, then check all the
+    # ordered pairs of files (n, n+1), (n+1, n+2), etc
     print(f'Starting overlap check with {num_jobs} workers')
     with ProcessPoolExecutor(max_workers=num_jobs) as pool:
-        futures = [pool.submit(check_indices, pair[0], pair[1]) for pair in pairs]
-    
-        for future in tqdm(as_completed(futures), total=len(futures)):
-            result = future.result()
-            if result:
-                overlap.append(result)
+        indices = dict(zip(files, tqdm(pool.map(get_indices, files, chunksize=64), total=len(files))))
+
+    overlap = []
+    for f1, f2 in zip(files[:-1], files[1:]):
+        result = check_indices(f1, f2, indices)
+        if result:
+            overlap.append(result)
 
     if not overlap:
         print("No overlapping segments found")
         return 0
 
     # since the results dont come back in the order they were pushed in, sort them again    
-    segments = []
-    for item in overlap:
-        start = re.search(pattern, item.split(', ')[0]).start()
-        segments.append({
-            'prefix': item[:start],
-            'suffix': item[start:],
-            'contents': item
-        })
-    segments = [x['contents'].split(', ') for x in sorted(segments, key=lambda i: i['suffix'])]
+    segments = [item.split(', ') for item in overlap]
+    segments = sorted(segments, key=lambda i: parse_filename(i[0]).start)
 
     for s in segments:
         print(s)
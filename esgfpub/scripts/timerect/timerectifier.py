@@ -11,11 +11,11 @@ from shutil import copyfile
 from datetime import datetime
 from concurrent.futures import ProcessPoolExecutor, as_completed
 from itertools import combinations
+from esgfpub.scripts.timerect.timebounds import read_bounds, read_variable, bounds_range, monotonic_failure
 
 
 def get_indices(path):
-    with xr.open_dataset(path, decode_times=False) as ds:
-        return path, ds['time_bnds'][0].values[0], ds['time_bnds'][-1].values[-1]
+    return (path, *bounds_range(read_bounds(path)))
 
 def filter_files(file_info):
     to_remove = []
@@ -44,28 +44,18 @@ def filter_files(file_info):
 
 def monotonic_check(path, idx):
     _, name = os.path.split(path)
-    with xr.open_dataset(path, decode_times=False) as ds:
-        # start at -1 so that the 0th time step doesnt trigger
-        try:
-            start_bound = ds['time_bnds'][0].values[0]
-            end_bound = ds['time_bnds'][-1].values[-1]
-        except IndexError as e:
-            print(f"{name} doesnt have expect time_bnds variable shape")
-            return None, None, idx
-        l1, l2 = -1.0, -1.0
-        for bounds in ds['time_bnds']:
-            b1, b2 = bounds.values
-            if (l1 == -1.0 and b1 == 0.0) or (b1 == b2):
-                # the daily files have a 0 width time step at the start
-                continue
-            if b1 > l1 and b2 > l2: 
-                l1 = b1
-                l2 = b2
-            else:
-                print(f"{name} has failed the monotonically-increaseing time bounds check, {(b1, b2)} isn't greater than {(l1, l2)}")
-                return None, None, idx
-
-        return start_bound, end_bound, idx
+    bounds = read_bounds(path)
+    try:
+        start_bound, end_bound = bounds_range(bounds)
+    except IndexError as e:
+        print(f"{name} doesnt have expect time_bnds variable shape")
+        return None, None, idx
+    failure = monotonic_failure(bounds)
+    if failure:
+        print(f"{name} has failed the monotonically-increaseing time bounds check, {failure[0]} isn't greater than {failure[1]}")
+        return None, None, idx
+
+    return start_bound, end_bound, idx
 
 def collect_segments(inpath, num_jobs):
     
@@ -193,8 +183,8 @@ def write_netcdf(ds, fileName, fillValues=netCDF4.default_fillvals, unlimited=No
         ds.to_netcdf(fileName, encoding=encodingDict)
 
 def get_time_units(path):
-    with xr.open_dataset(path, decode_times=False) as ds:
-        return ds['time'].attrs['units']
+    _, attrs = read_variable(path, 'time')
+    return attrs['units']
     
 
 def main():
@@ -280,12 +270,11 @@ def main():
         to_truncate = None # the file that needs to be truncated
         truncate_index = len(s1['files']) # the index in the file list of segment 1
         for file in s1['files'][::-1]:
-            with xr.open_dataset(file, decode_times=False) as ds:
-                if ds['time_bnds'][-1].values[1] > s2['start']:
-                    truncate_index -= 1
-                    continue
-                else:
-                    break
+            if read_bounds(file)[-1, 1] > s2['start']:
+                truncate_index -= 1
+                continue
+            else:
+                break
         
         print(f"removing {len(s1['files']) - truncate_index} files from ({s1['start']}, {s1['end']})")
 
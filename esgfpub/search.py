@@ -0,0 +1,252 @@
+"""
+Native client for the ESGF search API
+"""
+import os
+import re
+import json
+import requests
+from time import time
+from fnmatch import fnmatch, translate
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from esgfpub.store import SqliteStore, ESGFPUB_DIR
+
+SEARCH_API = "https://esgf-node.llnl.gov/esg-search/search/"
+DATA_NODE_PRIORITY = ["esgf-data2.llnl.gov", "aims3.llnl.gov", "esgf-data1.llnl.gov"]
+SEARCH_CACHE = os.path.join(ESGFPUB_DIR, 'search_cache.sqlite')
+DAY = 24 * 60 * 60
+
+# characters with special meaning in the solr query syntax, the
+# wildcard characters * and ? are intentionally left out
+SOLR_SPECIAL = re.compile(r'([+\-&|!(){}\[\]^"~:\\/ ])')
+
+
+def solr_escape(pattern):
+    """
+    Escape a dataset_id pattern so it can be used as a solr wildcard term
+    """
+    return SOLR_SPECIAL.sub(r'\\\1', pattern)
+
+
+class SearchClient(object):
+    """
+    Query the ESGF search API over a pooled HTTP session, grouping many
+    dataset_id patterns into a small number of paged solr requests
+
+    Parameters:
+        search_api (str): url of the esg-search/search endpoint
+        batch_size (int): the number of dataset_id patterns to send per query
+        page_size (int): the number of file records to request per page
+        max_connections (int): size of the HTTP connection pool
+        data_node_priority (list): data nodes in order of preference for replicated files
+        timeout (int): seconds to wait on each request
+    """
+
+    def __init__(self, search_api=SEARCH_API, batch_size=50, page_size=10000, max_connections=4, data_node_priority=None, timeout=120):
+        self.search_api = search_api
+        self.batch_size = batch_size
+        self.page_size = page_size
+        self.timeout = timeout
+        self.data_node_priority = data_node_priority if data_node_priority else DATA_NODE_PRIORITY
+
+        retry = Retry(
+            total=3,
+            backoff_factor=1,
+            status_forcelist=[500, 502, 503, 504])
+        adapter = HTTPAdapter(
+            pool_connections=max_connections,
+            pool_maxsize=max_connections,
+            max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def query(self, params):
+        """
+        Yield every solr document matching the given search parameters,
+        following the offset until all pages have been read. The results are
+        sorted by id, so the pages stay in the same order between requests
+        """
+        params = dict(params)
+        params['format'] = 'application/solr+json'
+        params['limit'] = self.page_size
+        params['sort'] = 'id asc'
+        offset = 0
+        while True:
+            params['offset'] = offset
+            res = self.session.get(
+                self.search_api, params=params, timeout=self.timeout)
+            res.raise_for_status()
+            response = res.json()['response']
+            docs = response['docs']
+            yield from docs
+            offset += len(docs)
+            if not docs or offset >= response['numFound']:
+                break
+
+    def find_files(self, dataset_ids, latest=True, pbar=None):
+        """
+        Find the file urls for each of the given dataset_ids. Each id is treated
+        as a prefix, and may contain * wildcards for any facet
+
+        Parameters:
+            dataset_ids (list): dataset_id patterns to search for
+            latest (bool): only return files from the latest dataset versions
+            pbar (tqdm): optional progress bar, updated once per dataset_id
+        Returns:
+            dict mapping each of the given dataset_ids to a sorted list of file urls
+        """
+        dataset_ids = list(dict.fromkeys(dataset_ids))
+        found = {d: dict() for d in dataset_ids}
+
+        for i in range(0, len(dataset_ids), self.batch_size):
+            batch = dataset_ids[i: i + self.batch_size]
+            matchers = [(d, re.compile(translate(d + '*'))) for d in batch]
+            terms = ' OR '.join(solr_escape(d) + '*' for d in batch)
+            params = {
+                'type': 'File',
+                'query': f'dataset_id:({terms})',
+                'fields': 'instance_id,dataset_id,data_node,url'
+            }
+            if latest:
+                params['latest'] = 'true'
+
+            for doc in self.query(params):
+                ds = doc['dataset_id'].split('|')[0]
+                for dataset_id, matcher in matchers:
+                    if matcher.match(ds):
+                        self._add_file(found[dataset_id], doc)
+            if pbar is not None:
+                pbar.update(len(batch))
+
+        return {
+            d: sorted(self.file_url(doc) for doc in found[d].values())
+            for d in dataset_ids
+        }
+
+    def _add_file(self, files, doc):
+        """
+        Add a file document to the files dict, keyed by its instance_id so that
+        replicas are only reported once from the highest priority data node
+        """
+        key = doc['instance_id'].split('|')[0]
+        current = files.get(key)
+        if current is None or self._node_rank(doc) < self._node_rank(current):
+            files[key] = doc
+
+    def _node_rank(self, doc):
+        node = doc.get('data_node')
+        if node in self.data_node_priority:
+            return self.data_node_priority.index(node)
+        return len(self.data_node_priority)
+
+    @staticmethod
+    def file_url(doc):
+        """
+        Return the HTTPServer url for a file document
+        """
+        urls = doc['url']
+        for url in urls:
+            url, _, service = url.split('|')
+            if service == 'HTTPServer':
+                return url
+        return urls[0].split('|')[0]
+
+
+class SearchCache(SqliteStore):
+    """
+    On-disk cache of ESGF search results, stored in a sqlite database keyed
+    by the dataset_id that was searched for, along with the dataset version found
+
+    Each entry has its own time-to-live, datasets that were found are kept for
+    ttl days, while searches that came back empty are kept for missing_ttl days
+    since those are the ones expected to change. The cache can be shared between threads
+
+    Parameters:
+        path (str): path to the sqlite database, created if it doesnt exist
+        ttl (float): days to keep the results for datasets that were found
+        missing_ttl (float): days to keep the results for datasets that were not found
+    """
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS results (
+            dataset_id TEXT PRIMARY KEY,
+            version TEXT,
+            files TEXT NOT NULL,
+            fetched REAL NOT NULL,
+            ttl REAL NOT NULL)"""]
+
+    def __init__(self, path=SEARCH_CACHE, ttl=30, missing_ttl=1):
+        super().__init__(path)
+        self.ttl = ttl * DAY
+        self.missing_ttl = missing_ttl * DAY
+
+    def get(self, dataset_ids, stale=False):
+        """
+        Return the cached file lists for the given dataset_ids
+
+        Parameters:
+            dataset_ids (list): the dataset_ids to look up
+            stale (bool): if True, also return entries whose ttl has expired
+        Returns:
+            dict mapping each cached dataset_id to its list of file urls,
+            dataset_ids with no usable entry are left out
+        """
+        now = time()
+        cached = dict()
+        for dataset_id in dataset_ids:
+            with self.lock:
+                row = self.conn.execute(
+                    "SELECT files, fetched, ttl FROM results WHERE dataset_id = ?",
+                    (dataset_id,)).fetchone()
+            if row is None:
+                continue
+            files, fetched, ttl = row
+            if stale or fetched + ttl > now:
+                cached[dataset_id] = json.loads(files)
+        return cached
+
+    def put(self, results):
+        """
+        Store search results
+
+        Parameters:
+            results (dict): mapping of dataset_id to the list of file urls found for it
+        """
+        now = time()
+        rows = list()
+        for dataset_id, files in results.items():
+            if files:
+                version = os.path.basename(os.path.dirname(files[-1]))
+                ttl = self.ttl
+            else:
+                version = None
+                ttl = self.missing_ttl
+            rows.append((dataset_id, version, json.dumps(files), now, ttl))
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)", rows)
+            self.conn.commit()
+
+    def invalidate(self, dataset_id):
+        """
+        Remove every cached entry whose search would match the given dataset_id,
+        used after a dataset has been published so the next search sees it
+        """
+        with self.lock:
+            keys = [
+                key for key, in self.conn.execute("SELECT dataset_id FROM results")
+                if key == dataset_id or fnmatch(dataset_id, key + '*')]
+            self.conn.executemany(
+                "DELETE FROM results WHERE dataset_id = ?", [(k,) for k in keys])
+            self.conn.commit()
+        return len(keys)
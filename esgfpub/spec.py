@@ -0,0 +1,172 @@
+"""
+Cached, indexed access to the dataset specification
+"""
+import os
+import yaml
+import pickle
+import hashlib
+from esgfpub import resources
+
+DEFAULT_SPEC = os.path.join(os.path.dirname(resources.__file__), 'dataset_spec.yaml')
+SPEC_CACHE = os.path.join(os.path.expanduser('~'), '.esgfpub', 'spec_cache')
+
+# specs already loaded by this process, keyed by (path, mtime, size) and by content hash
+_loaded = dict()
+
+
+class DatasetSpec(object):
+    """
+    The dataset specification, indexed for constant time lookups of the case
+    for any (project, model_version, experiment). For CMIP6 the model_version
+    is the source_id, e.g. ('CMIP6', 'E3SM-1-0', 'piControl')
+
+    Item access is passed through to the parsed YAML, so code that reads the
+    spec as a dict keeps working
+
+    Parameters:
+        raw (dict): the parsed dataset_spec.yaml
+        path (str): the file the spec was loaded from, if any
+    """
+
+    def __init__(self, raw, path=None):
+        self.raw = raw
+        self.path = path
+        self.cases = dict()
+        self.activities = dict()
+        self.expected = dict()
+
+        for activity, sources in raw['project'].get('CMIP6', {}).items():
+            for source, experiments in sources.items():
+                for experiment, case in experiments.items():
+                    self.cases[('CMIP6', source, experiment)] = case
+                    self.activities[(source, experiment)] = activity
+        for model_version, experiments in raw['project'].get('E3SM', {}).items():
+            for experiment, case in experiments.items():
+                self.cases[('E3SM', model_version, experiment)] = case
+
+        # the variables expected for each case, the time-series realms for the
+        # E3SM project and the tables for CMIP6, minus the ones in its except list
+        groups = {
+            'CMIP6': raw.get('tables', {}),
+            'E3SM': raw.get('time-series', {})
+        }
+        for key, case in self.cases.items():
+            exclude = frozenset(case.get('except') or [])
+            for group, variables in groups[key[0]].items():
+                self.expected[key + (group,)] = tuple(v for v in variables if v not in exclude)
+
+    def __getitem__(self, key):
+        return self.raw[key]
+
+    def __contains__(self, key):
+        return key in self.raw
+
+    def __reduce__(self):
+        # send only the path to worker processes, which load it from their own cache
+        if self.path:
+            return (load_spec, (self.path,))
+        return (DatasetSpec, (self.raw,))
+
+    def get(self, project, model_version, experiment):
+        """
+        Returns the case spec, or None if the case isnt in the spec
+        """
+        return self.cases.get((project, model_version, experiment))
+
+    def iter_cases(self, project):
+        """
+        Yield (model_version, experiment, case) for every case in the given project
+        """
+        for key, case in self.cases.items():
+            if key[0] == project:
+                yield key[1], key[2], case
+
+    def case_key(self, dataset_id):
+        """
+        Return the (project, model_version, experiment) for a dataset_id
+        """
+        parts = dataset_id.split('.')
+        if parts[0] == 'CMIP6':
+            return 'CMIP6', parts[3], parts[4]
+        return parts[0], parts[1], parts[2]
+
+    def case_for_dataset(self, dataset_id):
+        """
+        Returns the case spec for the given dataset_id, or None if it isnt in the spec
+        """
+        return self.cases.get(self.case_key(dataset_id))
+
+    def expected_variables(self, project, model_version, experiment, group):
+        """
+        Return the variables expected for a case, in the order they appear in the spec
+
+        Parameters:
+            group (str): the time-series realm for E3SM datasets, or the table for CMIP6
+        Returns:
+            tuple of variable names, or None if the case or group isnt in the spec
+        """
+        return self.expected.get((project, model_version, experiment, group))
+
+
+def spec_hash(path):
+    with open(path, 'rb') as ip:
+        return hashlib.sha256(ip.read()).hexdigest()
+
+
+def load_spec(path=DEFAULT_SPEC, cache_dir=SPEC_CACHE):
+    """
+    Load a dataset spec, parsing the YAML only if this version of the file hasnt been
+    seen before. Parsed specs are pickled into the cache_dir keyed by the hash of the file
+
+    Returns:
+        DatasetSpec
+    """
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    stamp = (path, st.st_mtime_ns, st.st_size)
+    spec = _loaded.get(stamp)
+    if spec is not None:
+        return spec
+
+    digest = spec_hash(path)
+    spec = _loaded.get(digest)
+    cache_path = os.path.join(cache_dir, f'{digest}.pickle') if cache_dir else None
+    if spec is None and cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as ip:
+                state = pickle.load(ip)
+            spec = DatasetSpec.__new__(DatasetSpec)
+            spec.__dict__.update(state)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError):
+            spec = None
+
+    if spec is None:
+        with open(path, 'r') as ip:
+            spec = DatasetSpec(yaml.load(ip, Loader=yaml.SafeLoader))
+        if cache_path:
+            state = dict(spec.__dict__)
+            state['path'] = None
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+                with open(tmp_path, 'wb') as op:
+                    pickle.dump(state, op, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, cache_path)
+            except OSError:
+                pass
+
+    spec.path = path
+    _loaded[stamp] = spec
+    _loaded[digest] = spec
+    return spec
+
+
+def as_spec(spec):
+    """
+    Return a DatasetSpec for either a DatasetSpec, a path to a spec file, or an already parsed spec dict
+    """
+    if isinstance(spec, DatasetSpec):
+        return spec
+    if isinstance(spec, str):
+        return load_spec(spec)
+    return DatasetSpec(spec)
@@ -1,9 +1,11 @@
 import os
 import yaml
 from threading import Event
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 from esgfpub.util import print_message
 from esgfpub.util import transfer_files, mapfile_gen, validate_raw, makedir
+from esgfpub.checksums import ChecksumCache, CHECKSUMS
 
 
 def stage(ARGS):
@@ -48,65 +50,135 @@ def stage(ARGS):
     resdirname = "{}_atm_{}_ocean".format(ATMRES, OCNRES)
     makedir(os.path.join(base_path, EXPERIMENT_NAME, resdirname))
 
-    transfer_mode = ARGS.transfer_mode
-    if transfer_mode == 'move':
-        print_message('Moving files', 'ok')
-    elif transfer_mode == 'copy':
-        print_message('Copying files', 'ok')
-    elif transfer_mode == 'link':
-        print_message('Linking files', 'ok')
-    num_moved, paths = transfer_files(
-        outpath=base_path,
-        experiment=EXPERIMENT_NAME,
-        grid=GRID,
-        mode=transfer_mode,
-        data_paths=DATA_PATHS,
-        ensemble=ENSEMBLE,
-        overwrite=overwrite)
-    if num_moved == -1:
-        return 1
-
     RUNMAPS = CONFIG.get('mapfiles', False)
-    if not RUNMAPS or RUNMAPS not in [True, 'true', 'True', 1, '1']:
-        print_message('Not running mapfile generation', 'ok')
-        print_message('Publication prep complete', 'ok')
-        return 0
-    else:
-        print_message('Starting mapfile generation', 'ok')
-
-    try:
-        INIPATH = CONFIG['ini_path']
-        MAPOUT = ARGS.mapout
-    except:
-        raise ValueError(
-            "Mapfiles generation is turned on, but the config is missing the ini_path option")
+    RUNMAPS = bool(RUNMAPS) and RUNMAPS in [True, 'true', 'True', 1, '1']
+    INIPATH = CONFIG.get('ini_path')
+    MAPOUT = ARGS.mapout
     NUMWORKERS = CONFIG.get('num_workers', 4)
+
+    with ChecksumCache(ARGS.checksum_db or CHECKSUMS) as checksums:
+        transfer_mode = ARGS.transfer_mode
+        if transfer_mode == 'move':
+            print_message('Moving files', 'ok')
+        elif transfer_mode == 'copy':
+            print_message('Copying files', 'ok')
+        elif transfer_mode == 'link':
+            print_message('Linking files', 'ok')
+
+        if RUNMAPS and ARGS.pipeline:
+            return pipelined_stage(
+                ARGS, base_path, EXPERIMENT_NAME, GRID, DATA_PATHS, ENSEMBLE, overwrite,
+                INIPATH, MAPOUT, NUMWORKERS, checksums)
+
+        num_moved, paths = transfer_files(
+            outpath=base_path,
+            experiment=EXPERIMENT_NAME,
+            grid=GRID,
+            mode=transfer_mode,
+            data_paths=DATA_PATHS,
+            ensemble=ENSEMBLE,
+            overwrite=overwrite,
+            num_workers=ARGS.transfer_workers,
+            checksums=checksums)
+        if num_moved == -1:
+            return 1
+
+        if not RUNMAPS:
+            print_message('Not running mapfile generation', 'ok')
+            print_message('Publication prep complete', 'ok')
+            return 0
+        else:
+            print_message('Starting mapfile generation', 'ok')
+
+        event = Event()
+
+        pbar = tqdm(
+            desc="Generating mapfiles",
+            total=num_moved)
+        res = -1
+        try:
+            for path in paths:
+                res = mapfile_gen(
+                    basepath=path,
+                    inipath=INIPATH,
+                    outpath=MAPOUT,
+                    maxprocesses=NUMWORKERS,
+                    env_name=ARGS.mapfile_env,
+                    debug=debug,
+                    event=event,
+                    pbar=pbar,
+                    checksums=checksums)
+            pbar.close()
+        except KeyboardInterrupt as error:
+            print_message('Keyboard interrupt caught, exiting')
+            event.set()
+            return 1
+        else:
+            if res == 0:
+                print_message('Publication prep complete', 'ok')
+            else:
+                print_message(
+                    'mapfile generation exited with status: {}'.format(res), 'error')
+            return res
+
+
+def pipelined_stage(ARGS, base_path, experiment, grid, data_paths, ensemble, overwrite,
+                    inipath, mapout, numworkers, checksums):
+    """
+    Transfer the files and generate the mapfiles at the same time. Each dataset is handed
+    to the mapfile pool as soon as all of its files are in place, and at most
+    ARGS.max_inflight datasets are hashed at once, so the total time is close to
+    the longer of the two steps instead of their sum
+
+    Returns:
+        0 if every file was transfered and every mapfile written, 1 otherwise
+    """
+    print_message('Transfering files and generating mapfiles', 'ok')
     event = Event()
+    futures = dict()
+    pbar = tqdm(desc="Staging", unit='file')
+
+    hashers = ThreadPoolExecutor(max_workers=ARGS.max_inflight)
+
+    def on_dataset(path):
+        futures[hashers.submit(
+            mapfile_gen,
+            basepath=path,
+            inipath=inipath,
+            outpath=mapout,
+            maxprocesses=numworkers,
+            env_name=ARGS.mapfile_env,
+            debug=ARGS.debug,
+            event=event,
+            pbar=pbar,
+            checksums=checksums)] = path
 
-    pbar = tqdm(
-        desc="Generating mapfiles",
-        total=num_moved)
-    res = -1
     try:
-        for path in paths:
-            res = mapfile_gen(
-                basepath=path,
-                inipath=INIPATH,
-                outpath=MAPOUT,
-                maxprocesses=NUMWORKERS,
-                env_name=ARGS.mapfile_env,
-                debug=debug,
-                event=event,
-                pbar=pbar)
-        pbar.close()
-    except KeyboardInterrupt as error:
+        num_moved, _ = transfer_files(
+            outpath=base_path,
+            experiment=experiment,
+            grid=grid,
+            mode=ARGS.transfer_mode,
+            data_paths=data_paths,
+            ensemble=ensemble,
+            overwrite=overwrite,
+            num_workers=ARGS.transfer_workers,
+            checksums=checksums,
+            on_dataset=on_dataset,
+            pbar=pbar)
+
+        failed = [futures[f] for f in as_completed(list(futures)) if f.result() != 0]
+    except KeyboardInterrupt:
         print_message('Keyboard interrupt caught, exiting')
         event.set()
+        hashers.shutdown(wait=False, cancel_futures=True)
         return 1
-    else:
-        if res == 0:
-            print_message('Publication prep complete', 'ok')
-        else:
-            print_message(
-                'mapfile generation exited with status: {}'.format(res), 'error')
-        return res
+    hashers.shutdown()
+    pbar.close()
+
+    for path in failed:
+        print_message('mapfile generation failed for {}'.format(path), 'error')
+    if num_moved == -1 or failed:
+        return 1
+    print_message('Publication prep complete', 'ok')
+    return 0
@@ -0,0 +1,48 @@
+"""
+Base for the sqlite stores esgfpub keeps between runs
+"""
+import os
+import sqlite3
+from threading import Lock
+
+# where the stores, and the other caches, are kept by default
+ESGFPUB_DIR = os.path.join(os.path.expanduser('~'), '.esgfpub')
+
+
+class SqliteStore(object):
+    """
+    A sqlite database that can be shared between threads, created along with its tables the
+    first time it's opened. Subclasses list the statements that create their tables and indexes
+    in SCHEMA, and hold the lock around every use of the connection
+
+    Parameters:
+        path (str): path to the sqlite database, created if it doesnt exist
+    """
+
+    SCHEMA = []
+
+    def __init__(self, path):
+        self.path = path
+        head, _ = os.path.split(path)
+        if head:
+            os.makedirs(head, exist_ok=True)
+        self.lock = Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        for statement in self.SCHEMA:
+            self.conn.execute(statement)
+        self.conn.commit()
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
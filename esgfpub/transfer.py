@@ -0,0 +1,283 @@
+"""
+Parallel engine for moving, copying or linking files into the publication structure
+"""
+import os
+import errno
+import shutil
+from time import monotonic
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tqdm import tqdm
+from esgfpub.util import print_message
+
+# 64MB per copy_file_range/sendfile call
+BLOCKSIZE = 64 * 1024 * 1024
+
+# a single file to transfer, dataset is the destination directory
+TransferJob = namedtuple('TransferJob', ['src', 'dst', 'size', 'dataset'])
+
+
+def _copy_range(src_fd, dst_fd, size, blocksize):
+    copied = 0
+    while copied < size:
+        sent = os.copy_file_range(src_fd, dst_fd, min(blocksize, size - copied))
+        if sent == 0:
+            break
+        copied += sent
+    return copied
+
+
+def _sendfile(src_fd, dst_fd, size, blocksize):
+    copied = 0
+    while copied < size:
+        sent = os.sendfile(dst_fd, src_fd, copied, min(blocksize, size - copied))
+        if sent == 0:
+            break
+        copied += sent
+    return copied
+
+
+def copy_file(src, dst, blocksize=BLOCKSIZE):
+    """
+    Copy a file using copy_file_range so the data never leaves the kernel, and where
+    the filesystem supports it is copied server side. Falls back to sendfile and then to
+    a regular userspace copy. The permission bits are copied along with the data
+
+    Returns:
+        the number of bytes copied
+    """
+    size = os.stat(src).st_size
+    copied = None
+    with open(src, 'rb') as ip, open(dst, 'wb') as op:
+        for kernel_copy in [getattr(os, 'copy_file_range', None) and _copy_range,
+                            getattr(os, 'sendfile', None) and _sendfile]:
+            if not kernel_copy:
+                continue
+            try:
+                copied = kernel_copy(ip.fileno(), op.fileno(), size, blocksize)
+                break
+            except OSError as error:
+                if error.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF):
+                    raise
+                # nothing has been written when the call isnt supported, so start over
+                ip.seek(0)
+                op.seek(0)
+                op.truncate()
+        if copied is None:
+            shutil.copyfileobj(ip, op, blocksize)
+            copied = size
+    shutil.copymode(src, dst)
+    return copied
+
+
+def move_file(src, dst):
+    """
+    Rename a file, falling back to a copy and delete when moving across filesystems
+    """
+    size = os.stat(src).st_size
+    try:
+        os.rename(src, dst)
+    except OSError as error:
+        if error.errno != errno.EXDEV:
+            raise
+        copy_file(src, dst)
+        os.remove(src)
+    return size
+
+
+def link_file(src, dst):
+    os.symlink(src, dst)
+    return 0
+
+
+TRANSFER_MODES = {
+    'copy': copy_file,
+    'move': move_file,
+    'link': link_file
+}
+
+
+def make_dirs(paths):
+    """
+    Create every destination directory once, and list the files already in each
+
+    Returns:
+        dict mapping each directory to the set of names already in it
+    """
+    existing = dict()
+    for path in paths:
+        os.makedirs(path, exist_ok=True)
+        with os.scandir(path) as it:
+            existing[path] = {entry.name for entry in it}
+    return existing
+
+
+def plan_transfers(sources, overwrite=False):
+    """
+    Build the list of transfer jobs
+
+    Parameters:
+        sources (list): tuples of (source directory, destination directory, label)
+        overwrite (bool): if False files already at the destination are skipped
+    Returns:
+        jobs (list of TransferJob), skipped (int), dataset_paths (list of destination directories)
+    """
+    dataset_paths = list(OrderedDict.fromkeys(dst for _, dst, _ in sources))
+    existing = make_dirs(dataset_paths)
+
+    jobs, skipped = list(), 0
+    for src_dir, dst_dir, _ in sources:
+        with os.scandir(src_dir) as it:
+            entries = sorted(
+                (entry.name, entry.stat().st_size) for entry in it if entry.is_file())
+        for name, size in entries:
+            if name in existing[dst_dir] and not overwrite:
+                skipped += 1
+                continue
+            jobs.append(TransferJob(
+                os.path.join(src_dir, name),
+                os.path.join(dst_dir, name),
+                size,
+                dst_dir))
+    return jobs, skipped, dataset_paths
+
+
+def transfer_one(job, mode, overwrite=False, checksums=None):
+    """
+    Transfer a single file, removing whatever is at the destination first if overwrite is set.
+    If a checksum store is given, the checksum of a copied or moved file is carried over to its new path
+
+    Returns:
+        the number of bytes transfered
+    """
+    if overwrite:
+        try:
+            os.remove(job.dst)
+        except FileNotFoundError:
+            pass
+    src_st = os.stat(job.src) if checksums is not None and mode != 'link' else None
+    nbytes = TRANSFER_MODES[mode](job.src, job.dst)
+    if src_st is not None:
+        checksums.transfered(job.src, job.dst, src_st)
+    return nbytes
+
+
+def transfer_batch(jobs, mode, overwrite=False, checksums=None):
+    """
+    Transfer a batch of files, so the pool is handed one task per batch instead of one per file
+
+    Returns:
+        list of (TransferJob, bytes transfered, OSError or None)
+    """
+    results = list()
+    for job in jobs:
+        try:
+            results.append((job, transfer_one(job, mode, overwrite, checksums), None))
+        except OSError as error:
+            results.append((job, 0, error))
+    return results
+
+
+def batches(jobs, batch_size):
+    """
+    Split the jobs into batches, each holding files from a single dataset
+    """
+    batch = list()
+    for job in jobs:
+        if batch and (len(batch) == batch_size or batch[0].dataset != job.dataset):
+            yield batch
+            batch = list()
+        batch.append(job)
+    if batch:
+        yield batch
+
+
+def run_transfers(jobs, mode, overwrite=False, num_workers=8, batch_size=64, quiet=False, checksums=None,
+                  on_dataset=None, pbar=None):
+    """
+    Run the transfer jobs on a pool of worker threads, reporting when each
+    dataset is complete and the overall throughput at the end. Checksums in the
+    given ChecksumCache follow the files to their destination
+
+    Parameters:
+        on_dataset (callable): called with the dataset path as soon as every file in the
+            dataset has been transfered without error, so the next step can start on it
+        pbar (tqdm): a progress bar owned by the caller, the number of files transfered is
+            shown in its postfix instead of drawing a separate transfer progress bar
+    Returns:
+        num_transfered (int), errors (list of (TransferJob, OSError))
+    """
+    if mode not in TRANSFER_MODES:
+        raise ValueError('{} is not a supported mode'.format(mode))
+
+    remaining = dict()
+    dataset_stats = dict()
+    for job in jobs:
+        remaining[job.dataset] = remaining.get(job.dataset, 0) + 1
+        # files, bytes, start time, errors
+        dataset_stats.setdefault(job.dataset, [0, 0, None, 0])
+
+    start = monotonic()
+    num_transfered, total_bytes, errors = 0, 0, list()
+    own_pbar = pbar is None
+    if own_pbar:
+        pbar = tqdm(
+            total=sum(job.size for job in jobs),
+            unit='B',
+            unit_scale=True,
+            desc=f'Transfering files ({mode})',
+            disable=quiet or not jobs)
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        futures = list()
+        for batch in batches(jobs, batch_size):
+            futures.append(pool.submit(transfer_batch, batch, mode, overwrite, checksums))
+            stats = dataset_stats[batch[0].dataset]
+            if stats[2] is None:
+                stats[2] = monotonic()
+
+        for future in as_completed(futures):
+            for job, nbytes, error in future.result():
+                if own_pbar:
+                    pbar.update(job.size)
+                stats = dataset_stats[job.dataset]
+                if error is not None:
+                    errors.append((job, error))
+                    stats[3] += 1
+                    print_message(f'Error transfering {job.src} to {job.dst}: {repr(error)}', 'error')
+                else:
+                    num_transfered += 1
+                    total_bytes += nbytes
+                    stats[0] += 1
+                    stats[1] += nbytes
+
+                remaining[job.dataset] -= 1
+                if remaining[job.dataset] == 0:
+                    files, nbytes, dataset_start, num_errors = stats
+                    if not quiet:
+                        elapsed = monotonic() - dataset_start
+                        pbar.write(
+                            f'{job.dataset}: {files} files, {format_bytes(nbytes)} in {elapsed:.1f}s')
+                    if on_dataset is not None and not num_errors:
+                        on_dataset(job.dataset)
+            if not own_pbar:
+                pbar.set_postfix_str(f'transfered {num_transfered}/{len(jobs)}')
+    if own_pbar:
+        pbar.close()
+
+    elapsed = monotonic() - start
+    if not quiet and jobs:
+        rate = total_bytes / elapsed if elapsed else 0
+        message = (f'Transfered {num_transfered} files, {format_bytes(total_bytes)} in {elapsed:.1f}s '
+                   f'({num_transfered / elapsed if elapsed else 0:.0f} files/s, {format_bytes(rate)}/s)')
+        if own_pbar:
+            print_message(message, 'ok')
+        else:
+            pbar.write(message)
+    return num_transfered, errors
+
+
+def format_bytes(num):
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if abs(num) < 1024 or unit == 'TB':
+            return f'{num:.1f}{unit}'
+        num /= 1024
@@ -4,21 +4,40 @@ Utility functions for esgfpub
 
 import os
 import sys
-import stat
 import argparse
 import json
 from subprocess import call, Popen, PIPE
-from datetime import datetime
-from shutil import move, copy
 from time import sleep
-from tqdm import tqdm
 from esgfpub import resources
+from esgfpub.filenames import RAW_MONTHLY, parse_filename
+from esgfpub.log import log_message, get_logger, ROOT
 from esgfpub.version import __version__
 from tempfile import NamedTemporaryFile
 
+log = get_logger(__name__)
+
 
 def parse_args():
     parser = argparse.ArgumentParser(prog='esgfpub')
+    parser.add_argument(
+        '--log-format',
+        choices=['console', 'json'],
+        default='console',
+        help="console for colored status lines, or json for one JSON object per line, default is console")
+    parser.add_argument(
+        '--log-file',
+        help="write log messages to this file instead of stdout")
+    parser.add_argument(
+        '--log-level',
+        default='INFO',
+        help="the level for every subsystem, default is INFO, or DEBUG when the subcommand is given --debug")
+    parser.add_argument(
+        '--log-levels',
+        help="per subsystem levels, e.g. checker=DEBUG,publisher=WARNING")
+    parser.add_argument(
+        '--async-log',
+        action='store_true',
+        help="format and write log messages on a background thread")
     subparsers = parser.add_subparsers(
         title='subcommands',
         description='valid subcommands',
@@ -31,13 +50,17 @@ def parse_args():
         help="Path to configuration file")
     parser_publish.add_argument(
         "--mapfile-env",
-        required=True,
-        help="The name of the conda env with the esgmapfile utility installed")
+        help="No longer used, mapfiles are generated without the esgmapfile utility")
     parser_publish.add_argument(
         "-t",
         "--transfer-mode",
         default='link',
         help="the file transfer mode, allowed values are link, move, or copy")
+    parser_publish.add_argument(
+        '--transfer-workers',
+        type=int,
+        default=8,
+        help="the number of files to transfer at once, default is 8")
     parser_publish.add_argument(
         '--over-write',
         help="Over write any existing files",
@@ -48,6 +71,18 @@ def parse_args():
         dest='mapout',
         help='The output location for mapfiles, defaults to ./mapfiles/',
         default='./mapfiles')
+    parser_publish.add_argument(
+        '--pipeline',
+        action='store_true',
+        help="Generate the mapfile for each dataset as soon as its files are in place, while the rest are still being transfered")
+    parser_publish.add_argument(
+        '--max-inflight',
+        type=int,
+        default=2,
+        help="With --pipeline, the most datasets to generate mapfiles for at once, default is 2")
+    parser_publish.add_argument(
+        '--checksum-db',
+        help="Path to the checksum store, default is ~/.esgfpub/checksums.sqlite")
     parser_publish.add_argument(
         '--debug',
         action="store_true")
@@ -100,9 +135,30 @@ def parse_args():
         default=4,
         help="The number of dask workers used in the localCluster, default: 4")
     parser_esgf_check.add_argument(
-        '--sproket',
-        default='sproket',
-        help='Path to custom sproket binary, only needed if --published is turned on.')
+        '--search-api',
+        default='https://esgf-node.llnl.gov/esg-search/search/',
+        help='URL of the ESGF search API, only needed if --published is turned on.')
+    parser_esgf_check.add_argument(
+        '--search-batch-size',
+        type=int,
+        default=50,
+        help='The number of datasets to look up in each ESGF search request, default: 50')
+    parser_esgf_check.add_argument(
+        '--search-cache',
+        help='Path to the ESGF search result cache, default: ~/.esgfpub/search_cache.sqlite')
+    parser_esgf_check.add_argument(
+        '--no-search-cache',
+        action="store_true",
+        help='Dont read or write the ESGF search result cache')
+    parser_esgf_check.add_argument(
+        '--cache-ttl',
+        type=float,
+        default=30,
+        help='Number of days a cached search result for a published dataset stays valid, default: 30')
+    parser_esgf_check.add_argument(
+        '--refresh-stale-only',
+        action="store_true",
+        help='Use unexpired cached search results, and only search ESGF for datasets that are new or stale')
     parser_esgf_check.add_argument(
         '--file-system',
         action="store_true",
@@ -110,6 +166,13 @@ def parse_args():
     parser_esgf_check.add_argument(
         '--data-path',
         help="path to the root directory containing the local data")
+    parser_esgf_check.add_argument(
+        '--use-manifest',
+        action="store_true",
+        help="Read the --data-path directory listings through the filesystem manifest, only directories that changed since the last run are re-read")
+    parser_esgf_check.add_argument(
+        '--manifest-path',
+        help="Path to the filesystem manifest, default: ~/.esgfpub/manifest.sqlite")
     parser_esgf_check.add_argument(
         '--model-versions',
         dest='model_versions',
@@ -139,13 +202,38 @@ def parse_args():
     parser_esgf_check.add_argument(
         '--plot-path',
         help="Where to store verification plots")
+    parser_esgf_check.add_argument(
+        '--force-verify',
+        action="store_true",
+        help="Verify every dataset, even the ones whose files havent changed since they were last verified")
+    parser_esgf_check.add_argument(
+        '--ledger-path',
+        help="Path to the verification ledger, default is ~/.esgfpub/verify_ledger.sqlite")
+    parser_esgf_check.add_argument(
+        '--means-cache',
+        help="Directory to keep the global means of each verified dataset in, default is ~/.esgfpub/means")
+    parser_esgf_check.add_argument(
+        '--mean-chunks',
+        help="The number of points along each dimension to read at once when computing global means, e.g. time=120,lev=10")
+    parser_esgf_check.add_argument(
+        '--verify-memory',
+        type=int,
+        default=256,
+        help="Memory budget in MB for the block of data read at once when computing global means, used when --mean-chunks doesnt set a time size, default: 256")
     parser_esgf_check.add_argument(
         '--spec-path',
         default=os.path.join(resource_path, 'dataset_spec.yaml'),
         help="Path to custom dataset specification file")
     parser_esgf_check.add_argument(
         '--to-json',
-        help='The output will be stored in the given file, json format')
+        help='The results will be written to the given file in JSON Lines format as each dataset is checked')
+    parser_esgf_check.add_argument(
+        '--resume',
+        action="store_true",
+        help="Skip the datasets that were already checked by the last run with the same options, as recorded in the checkpoint journal")
+    parser_esgf_check.add_argument(
+        '--journal-path',
+        help="Path to the checkpoint journal, default is ~/.esgfpub/check_journal.sqlite")
     parser_esgf_check.add_argument(
         '--report-plot',
         help="path to where the plot report should be saved, requires json output and digest")
@@ -160,7 +248,18 @@ def parse_args():
         help='Should this be run in serial, default is parallel.')
     parser_esgf_check.add_argument(
         '--local-cluster',
-        help='The port number for the local cluster to connect to, if not given a new cluster is created')
+        nargs='?',
+        const='',
+        help='Verify datasets on a dask cluster instead of the process pool. Give the port number or address of the cluster to connect to, if not given a new local cluster is created')
+    parser_esgf_check.add_argument(
+        '--plot-workers',
+        type=int,
+        default=2,
+        help="The number of processes rendering verification plots, default: 2")
+    parser_esgf_check.add_argument(
+        '--skip-plots',
+        action="store_true",
+        help="Dont draw the verification and report plots, write the numeric series they're drawn from instead")
     parser_esgf_check.add_argument(
         '--debug',
         action="store_true")
@@ -188,6 +287,28 @@ def parse_args():
         '--sproket',
         default='sproket',
         help="path to sproket binary if its not in your PATH")
+    parser_publish.add_argument(
+        '--search-cache',
+        help='Path to the ESGF search result cache, default: ~/.esgfpub/search_cache.sqlite')
+    parser_publish.add_argument(
+        '--no-search-cache',
+        action="store_true",
+        help='Dont write the existence checks to the ESGF search result cache')
+    parser_publish.add_argument(
+        '--max-publish',
+        type=int,
+        default=4,
+        help="Number of esgpublish processes to run at once, default: 4")
+    parser_publish.add_argument(
+        '--max-checks',
+        type=int,
+        default=8,
+        help="Number of dataset existence checks to run at once, default: 8")
+    parser_publish.add_argument(
+        '--poll-interval',
+        type=float,
+        default=30,
+        help="Seconds between checks of the input directory when running with --loop on a system without inotify, default: 30")
     parser_publish.add_argument(
         '--debug',
         action="store_true")
@@ -209,6 +330,35 @@ def parse_args():
         nargs='+',
         required=True,
         help="sequence of var=value pairs")
+    parser_custom.add_argument(
+        '--index-node',
+        default="https://esgf-node.llnl.gov/esg-search",
+        help="URL of the esg-search application to send the updates to, default: https://esgf-node.llnl.gov/esg-search")
+    parser_custom.add_argument(
+        '--data-node',
+        default="esgf-data2.llnl.gov",
+        help="The data node the datasets were published from, default: esgf-data2.llnl.gov")
+    parser_custom.add_argument(
+        '--cert',
+        help="Path to the certificate to authenticate with, default is ~/.globus/certificate-file")
+    parser_custom.add_argument(
+        '--max-requests',
+        type=int,
+        default=8,
+        help="The number of update requests to have in flight at once, default: 8")
+    parser_custom.add_argument(
+        '--no-batch',
+        action="store_true",
+        help="Send one updateById request per facet instead of one update request per dataset")
+    parser_custom.add_argument(
+        '--walk-workers',
+        type=int,
+        default=8,
+        help="The number of directories to list at once while finding the datasets under --data-dir, default: 8")
+    parser_custom.add_argument(
+        '--stop-at-version',
+        action="store_true",
+        help="Stop descending at the version directories instead of listing them, datasets with an empty latest version are included")
     parser_custom.add_argument(
         '--debug',
         action="store_true",
@@ -221,46 +371,15 @@ def parse_args():
     return parser.parse_args(sys.argv[1:])
 
 
-class colors:
-    HEADER = '\033[95m'
-    OKBLUE = '\033[94m'
-    OKGREEN = '\033[92m'
-    WARNING = '\033[93m'
-    FAIL = '\033[91m'
-    ENDC = '\033[0m'
-    BOLD = '\033[1m'
-    UNDERLINE = '\033[4m'
-
-
 def print_message(message, status='error'):
     """
-    Prints a message with either a green + or a red -
+    Logs a message with either a green + or a red -, to the logger for the module it was called from
 
     Parameters:
         message (str): the message to print
         status (str): the status class of the message, should be "error", "ok", or "info"
     """
-    now = datetime.now()
-
-    hour = now.strftime('%H')
-    minutes = now.strftime('%M')
-    sec = now.strftime('%S')
-
-    if status == 'error':
-        start_icon = '[-]'
-        start_color = colors.FAIL
-
-    elif status == 'info':
-        start_icon = '[=]'
-        start_color = colors.OKBLUE
-
-    else:
-        start_icon = '[+]'
-        start_color = colors.OKGREEN
-
-    timestr = f'{start_color}{start_icon}{colors.ENDC} {now.year}/{now.month}/{now.day} - {hour}:{minutes}:{sec}'
-    msg = f"{timestr}:  {message}"
-    print(msg, flush=True)
+    log_message(sys._getframe(1).f_globals.get('__name__', ROOT), message, status)
 
 
 def makedir(directory):
@@ -285,71 +404,81 @@ def get_lnd_casename(filename):
     return filename[:i]
 
 
+def month_ranges(months):
+    """
+    Collapse a sorted list of month indices (year * 12 + month - 1) into compact
+    ranges, e.g. ['0010-01 to 0012-12', '0450-06']
+    """
+    def stamp(month):
+        year, month = divmod(month, 12)
+        return '{:04d}-{:02d}'.format(year, month + 1)
+
+    ranges = list()
+    run_start = prev = None
+    for month in months + [None]:
+        if prev is not None and month == prev + 1:
+            prev = month
+            continue
+        if run_start is not None:
+            if run_start == prev:
+                ranges.append(stamp(run_start))
+            else:
+                ranges.append('{} to {}'.format(stamp(run_start), stamp(prev)))
+        run_start = prev = month
+    return ranges
+
+
+def check_raw_component(datatype, path, start, end):
+    """
+    Check that the monthly history files for one raw data type cover every month from start to end
+
+    Parameters:
+        datatype (str): one of the data types in filenames.RAW_MONTHLY
+        path (str): the directory holding the files
+    Returns:
+        None if the directory is empty, otherwise a sorted list of the missing month indices
+    """
+    components, stream = RAW_MONTHLY[datatype]
+    found = dict()
+    for name in os.listdir(path):
+        parsed = parse_filename(name)
+        if parsed is None or parsed.kind != 'time-slice' \
+                or parsed.component not in components or parsed.stream != stream:
+            continue
+        found.setdefault(parsed.case, set()).add(
+            parsed.start_year * 12 + parsed.start_month - 1)
+    if not found:
+        return None
+    # as before, only the files from the first case in the directory are counted
+    case = min(found, key=lambda x: x or '')
+    expected = set(range(start * 12, (end + 1) * 12))
+    return sorted(expected - found[case])
+
+
 def validate_raw(data_paths, start, end):
     """
-    Checks that the atmos, land, sea-ice, and ocean raw files are present
+    Checks that the monthly atmos, land, river, sea-ice, and ocean raw files are present,
+    checking each data type in parallel and printing any gaps as compact ranges of months
+
     returns True if all files are found, False otherwise
     """
+    from concurrent.futures import ThreadPoolExecutor
+
+    datatypes = [x for x in RAW_MONTHLY if x in data_paths]
+    with ThreadPoolExecutor(max_workers=max(len(datatypes), 1)) as pool:
+        futures = {
+            datatype: pool.submit(check_raw_component, datatype, data_paths[datatype], start, end)
+            for datatype in datatypes}
+
     missing = False
-    if 'atmos' in data_paths:
-        files = sorted(os.listdir(data_paths['atmos']))
-        if not files:
-            print("no atm files found")
-        else:
-            casename = get_atm_casename(files[0])
-            if casename == -1:
-                raise ValueError(
-                    "Unable to find casename from {}".format(files[0]))
-            for year in range(start, end + 1):
-                for month in range(1, 13):
-                    name = "{}.cam.h0.{:04d}-{:02d}.nc".format(
-                        casename, year, month)
-                    if name not in files:
-                        print("{} is missing".format(name))
-                        missing = True
-
-    if "land" in data_paths:
-        files = sorted(os.listdir(data_paths['land']))
-        if not files:
-            print("no land files found")
-        else:
-            casename = get_lnd_casename(files[0])
-            if casename == -1:
-                raise ValueError(
-                    "Unable to find casename from {}".format(files[0]))
-            for year in range(start, end + 1):
-                for month in range(1, 13):
-                    name = "{}.clm2.h0.{:04d}-{:02d}.nc".format(
-                        casename, year, month)
-                    if name not in files:
-                        print("{} is missing".format(name))
-                        missing = True
-
-    if "sea-ice" in data_paths:
-        files = sorted(os.listdir(data_paths['sea-ice']))
-        if not files:
-            print("no ice files found")
-        else:
-            for year in range(start, end + 1):
-                for month in range(1, 13):
-                    name = "mpascice.hist.am.timeSeriesStatsMonthly.{:04d}-{:02d}-01.nc".format(
-                        year, month)
-                    if name not in files:
-                        print("{} is missing".format(name))
-                        missing = True
-
-    if "ocean" in data_paths:
-        files = sorted(os.listdir(data_paths['ocean']))
-        if not files:
-            print("no ocn files found")
-        else:
-            for year in range(start, end + 1):
-                for month in range(1, 13):
-                    name = "mpaso.hist.am.timeSeriesStatsMonthly.{:04d}-{:02d}-01.nc".format(
-                        year, month)
-                    if name not in files:
-                        print("{} is missing".format(name))
-                        missing = True
+    for datatype, future in futures.items():
+        months = future.result()
+        if months is None:
+            print_message("no {} files found".format(datatype))
+        elif months:
+            missing = True
+            print_message("{}: {} of {} monthly files are missing: {}".format(
+                datatype, len(months), (end - start + 1) * 12, ', '.join(month_ranges(months))))
 
     if missing:
         return False
@@ -357,142 +486,125 @@ def validate_raw(data_paths, start, end):
         return True
 
 
-def transfer_files(outpath, experiment, mode, grid, data_paths, ensemble, overwrite):
+def transfer_files(outpath, experiment, mode, grid, data_paths, ensemble, overwrite, num_workers=8, checksums=None,
+                   on_dataset=None, pbar=None):
     """
-    Move or copy data into the ESGF publication structure
+    Move or copy data into the ESGF publication structure. Every destination directory
+    is created and listed once up front, then the files are transfered by a pool of workers
 
     Parameters
     ----------
         outpath (str): the base of the ESGF publication structure
-        mode (str): either 'move' or 'copy'
+        mode (str): either 'move', 'copy' or 'link'
         experiment (str): the name of the experiment being published
         grid (str): the non-native grid name
         data_paths (dict): a dictionary with keys with the file type name, and values of the
             path to where those files are stored
+        num_workers (int): the number of files to transfer at once
+        checksums (ChecksumCache): carry any stored checksums over to the transfered files
+        on_dataset (callable): called with each dataset path once all of its files are in place,
+            straight away for datasets that had nothing left to transfer
+        pbar (tqdm): a progress bar owned by the caller, its total is set to the number of files
+            in the datasets and the transfer count is shown in its postfix
     Returns
     -------
-        number of files transfer if everything completed successfully
-        -1 on error
+        number of files transfered and the list of dataset paths if everything completed successfully
+        -1 and an empty list on error
     """
-    if mode not in ['copy', 'move', 'link']:
+    from esgfpub.transfer import TRANSFER_MODES, plan_transfers, run_transfers
+
+    if mode not in TRANSFER_MODES:
         raise ValueError('{} is not a supported mode'.format(mode))
-    if mode == 'move':
-        transfer = move
-    elif mode == 'link':
-        transfer = os.symlink
-    else:
-        transfer = copy
 
     resolution_dir = os.listdir(os.path.join(outpath, experiment))[0]
-    num_transfered = 0
-    dataset_paths = list()
 
+    sources = list()
     for dtype, path in list(data_paths.items()):
-        contents = os.listdir(path)
-
-        for _, item in enumerate(tqdm(contents, desc="{}: ".format(dtype))):
-
-            src = os.path.join(path, item)
-            dst = setup_dst(
-                experiment=experiment,
-                basepath=outpath,
-                res_dir=resolution_dir,
-                grid=grid,
-                datatype=dtype,
-                filename=item,
-                ensemble=ensemble)
-            if os.path.exists(dst) and not overwrite:
-                continue
-            num_transfered += 1
-            tail, _ = os.path.split(dst)
-            if not os.path.exists(tail):
-                os.makedirs(tail)
-            if tail not in dataset_paths:
-                dataset_paths.append(tail)
-
-            if os.path.exists(dst) or os.path.lexists(dst):
-                if overwrite:
-                    os.remove(dst)
-                else:
-                    print("Skipping {}".format(dst))
-                    continue
-
-            if not os.path.exists(src):
-                print_message('{} does not exist'.format(src))
-                continue
-            try:
-                transfer(src, dst)
-            except OSError as error:
-                print(src, dst)
-                print(repr(error))
-                return -1
+        if not os.path.exists(path):
+            print_message('{} does not exist'.format(path))
+            continue
+        dst = setup_dst(
+            experiment=experiment,
+            basepath=outpath,
+            res_dir=resolution_dir,
+            grid=grid,
+            datatype=dtype,
+            filename='',
+            ensemble=ensemble)
+        sources.append((path, os.path.dirname(dst), dtype))
+
+    try:
+        jobs, skipped, dataset_paths = plan_transfers(sources, overwrite)
+    except OSError as error:
+        print(repr(error))
+        return -1, []
+    if skipped:
+        print_message('Skipping {} files already in the publication structure'.format(skipped), 'info')
+    if pbar is not None:
+        pbar.total = len(jobs) + skipped
+        pbar.refresh()
+    if on_dataset is not None:
+        pending = {job.dataset for job in jobs}
+        for path in dataset_paths:
+            if path not in pending:
+                on_dataset(path)
+
+    num_transfered, errors = run_transfers(
+        jobs, mode, overwrite=overwrite, num_workers=num_workers, checksums=checksums,
+        on_dataset=on_dataset, pbar=pbar)
+    if errors:
+        return -1, []
 
     return num_transfered, dataset_paths
 
 
-def mapfile_gen(basepath, inipath, outpath, maxprocesses, pbar, env_name, event=None, debug=False):
+def mapfile_gen(basepath, inipath, outpath, maxprocesses, pbar, env_name=None, event=None, debug=False, checksums=None):
     """
     Generate mapfiles for ESGF
 
     Parameters
     ----------
-        basepath (str): the base of the data, the case directory should be below this
-        inipath (str): path to directory with ini files
-        experiment (str): the name of the experiment to generate mapfiles for
+        basepath (str): the dataset version directory to generate the mapfile for
+        inipath (str): path to directory with ini files, no longer used since the mapfiles are written in process
         outpath (str): the path to were the mapfiles should be stored after generation
-        maxprocesses (str): the number of processes to use for hashing
-        event (threading.Event): an event to terminate the process early
+        maxprocesses (str): the number of files to hash at once
         pbar (tqdm): a tqdm progressbar
+        env_name (str): no longer used, the esgmapfile conda environment isnt needed
+        event (threading.Event): an event to terminate the process early
+        checksums (ChecksumCache): a persistent checksum store, files that havent changed since
+            they were last hashed arent read again
+    Returns
+    -------
+        0 if the mapfile was written, 1 otherwise
     """
-    pbar.set_description("Hashing files for {}".format(
-        path_to_dataset_id(basepath)))
-    run_mapfile_string = """#!/bin/bash
-source ~/anaconda3/etc/profile.d/conda.sh
-conda activate {env} 
-esgmapfile make --debug --outdir {out} -i {ini} --project e3sm --max-processes {procs} {data}
-""".format(
-        out=outpath,
-        env=env_name,
-        procs=maxprocesses,
-        ini=inipath,
-        data=basepath)
-    if debug:
-        print_message(run_mapfile_string, 'info')
-    script = 'run_mapfiles.sh'
-    if os.path.exists(script):
-        os.remove(script)
-    with open(script, 'w') as op:
-        op.write(run_mapfile_string)
-    st = os.stat(script)
-    os.chmod(script, st.st_mode | stat.S_IEXEC)
-
-    proc = Popen(['./' + script], stdout=PIPE, stderr=PIPE)
-
-    # cmd = ['esgmapfile', 'make',
-    #        '--outdir', outpath,
-    #        '-i', inipath,
-    #        '--project', 'e3sm',
-    #        '--max-processes', str(maxprocesses),
-    #        '--debug',
-    #        datapath]
-    # proc = Popen(cmd, stdout=PIPE, stderr=PIPE)
-    while proc.poll() is None:
-        if event is not None and event.is_set():
-            proc.terminate()
-        for line in proc.stdout:
-            if "SUCCESS" in line.decode('utf-8'):
-                pbar.update(1)
-            if debug:
-                print_message(line, 'info')
-        for line in proc.stderr:
-            print(line.decode('utf-8'))
-    err = proc.stderr.readlines()
-    if err:
-        for line in err:
-            print(line)
+    from esgfpub.mapfile import make_mapfile, dataset_id_from_path
+
+    try:
+        dataset_id, version = dataset_id_from_path(basepath)
+    except ValueError as error:
+        print_message(str(error), 'error')
         return 1
-    else:
-        return 0
+    pbar.set_description("Hashing files for {}".format(dataset_id))
+
+    try:
+        mapfile, hashed, reused = make_mapfile(
+            basepath,
+            outpath,
+            dataset_id=dataset_id,
+            version=version,
+            num_workers=int(maxprocesses),
+            pbar=pbar,
+            event=event,
+            checksums=checksums)
+    except OSError as error:
+        print_message('Unable to generate mapfile for {}: {}'.format(dataset_id, repr(error)), 'error')
+        return 1
+    if mapfile is None:
+        return 1
+    if debug:
+        print_message('Wrote {}, {} files hashed and {} checksums reused'.format(
+            mapfile, hashed, reused), 'info')
+    return 0
 
 
 def setup_dst(experiment, basepath, res_dir, grid, datatype, filename, ensemble):
@@ -527,6 +639,9 @@ def setup_dst(experiment, basepath, res_dir, grid, datatype, filename, ensemble)
         type_dir = 'sea-ice'
         output_type = 'model-output'
         grid = 'native'
+    elif datatype == 'river':
+        type_dir = 'river'
+        output_type = 'model-output'
     elif datatype == 'climo':
         type_dir = 'atmos'
         output_type = 'climo'
@@ -570,10 +685,12 @@ def path_to_dataset_id(path):
         return dataset_id
 
 
-def check_ds_exists(dataset_id, debug=False, sproket='sproket', **kwargs):
+def check_ds_exists(dataset_id, debug=False, sproket='sproket', cache=None, **kwargs):
     """
     Use sproket to lookup a dataset by its ID, if the dataset exists
-    return True, else returns False
+    return True, else returns False. The search always goes to ESGF, a cached
+    hit may be for a dataset that's since been retracted. If a SearchCache is
+    given, the result is written to it for the checker to use
     """
     # create the path to the config, write it out
     tempfile = NamedTemporaryFile(suffix='.json')
@@ -600,8 +717,9 @@ def check_ds_exists(dataset_id, debug=False, sproket='sproket', **kwargs):
         print(err.decode('utf-8'))
         return False
     else:
-        if debug:
-            print_message(out, 'info')
+        log.debug('%s', out)
+        if cache is not None:
+            cache.put({dataset_id: [i.decode('utf-8') for i in out.split()]})
         if out:
             return True
         else:
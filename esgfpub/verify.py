@@ -2,17 +2,15 @@ import warnings
 warnings.simplefilter('ignore')
 
 from esgfpub.util import path_to_dataset_id, print_message
-from dask.distributed import get_client, worker_client, as_completed
+from esgfpub.means import MeanCache
+from esgfpub import plots
 from dask.diagnostics import ProgressBar
 
-import statsmodels.api as sm
 import xarray as xr
 import numpy as np
 from datetime import datetime
 import os
 from tqdm import tqdm
-from mpl_toolkits.basemap import Basemap
-from matplotlib import pyplot as plt
 
 import logging
 logger = logging.getLogger("distributed.worker")
@@ -20,232 +18,225 @@ logger.setLevel(logging.ERROR)
 
 
 def plot_minmaxmean(outpath, ds, vmax, dataset_id, debug=False):
-
-    fig, ax1 = plt.subplots()
-    fig.set_size_inches(18.5, 10.5)
-    plt.title(dataset_id)
-    
-    xtick_positions = [i for i, t in enumerate(ds['time']) if i % (120) == 0]
-    xtick_values = [t.values.item().strftime('%Y') for i, t in enumerate(ds['time']) if i % (120) == 0]
-    plt.xticks(xtick_positions, xtick_values)
-
-
-    ax1.set_xlabel('year')
-    var = next(filter(lambda x: 'bnds' not in x, ds.data_vars))
-    if hasattr(ds[var], 'units'):
-        ax1.set_ylabel(ds[var].units)
-
-    ax1.plot(ds['means'], color='tab:blue')
-
-    ax2 = ax1.twinx()
-    ax2.plot(vmax, color='tab:red')
-
-    plt.savefig(outpath, dpi=100)
-    return
-
-
-def run_chunk(ds, dataset_id, maxrollingvar, maxrollingstd, segment, index):
-    issues = list()
-    vmax = np.ndarray(shape=(len(ds['time'])))
-    idx = -1
-    for step in ds['time']:
-        idx += 1
-
-        mean = ds.sel(time=step)['means'].values
-        if not isinstance(mean, int) and not isinstance(mean, float) and mean.size > 1:
-            mean = max(mean)
-
-        if mean == 0.0:
-            issues.append(
-                f"\tZero data issue found for {dataset_id} at {str(step['time'].item())[:7]}")
-            vmax[idx] = 0
-            continue
-
-        max_rolling_var = maxrollingvar.sel(time=step)
-        mx_rolling_std = maxrollingstd.sel(time=step)
-        # if there's a NAN in the array skip it
-        if np.isnan(max_rolling_var) or np.isnan(mx_rolling_std) or np.isnan(mean):
-            vmax[idx] = 0
-            continue
-        if not mx_rolling_std.any():
-            vmax[idx] = 0
-            continue
-
-        # import ipdb; ipdb.set_trace()
-        max_variance = pow((mean - max_rolling_var)/mx_rolling_std, 2).values.item()
-        vmax[idx] = max_variance
-        
-
-    # if the variance is greater then 3x the variance std mark it as an issue
+    """
+    Draw the global means of a dataset along with their squared variance, see plots.render_minmaxmean
+    """
+    means = ds['means']
+    var = next(filter(lambda x: 'bnds' not in x and x != 'means', ds.data_vars), None)
+    if var is not None and hasattr(ds[var], 'units'):
+        means = means.assign_attrs(units=ds[var].units)
+    series = {'means': means, 'vmax': xr.DataArray(vmax, dims=['time'], coords={'time': ds['time']})}
+    return plots.render_minmaxmean(outpath, series, title=dataset_id)
+
+
+# the number of timesteps in the rolling window, ten years of monthly data
+WINDOW = 120
+# the number of timesteps the variance check evaluates at once
+TIME_CHUNK = 1200
+
+
+def rolling_stats(values, window=WINDOW):
+    """
+    Trailing rolling mean and standard deviation over the last window values, ignoring NaNs
+    and using as many values as are available at the start of the series. The same as
+    xarray's rolling(min_periods=1).mean() and .std(), computed from cumulative sums in a
+    single pass instead of once per window
+
+    Returns:
+        mean, std (numpy arrays the same length as values), NaN where the window has no valid values
+    """
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    # shifting by the mean keeps the sums of squares small, so the variance doesnt lose precision
+    shift = values[valid].mean() if valid.any() else 0.0
+    x = np.where(valid, values - shift, 0.0)
+
+    zero = np.zeros(1)
+    count = np.concatenate([zero, np.cumsum(valid)])
+    sums = np.concatenate([zero, np.cumsum(x)])
+    squares = np.concatenate([zero, np.cumsum(x * x)])
+
+    stop = np.arange(1, values.size + 1)
+    start = np.maximum(stop - window, 0)
+    n = count[stop] - count[start]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (sums[stop] - sums[start]) / n
+        var = (squares[stop] - squares[start]) / n - mean * mean
+    std = np.sqrt(np.maximum(var, 0.0))
+    std[n == 0] = np.nan
+    return mean + shift, std
+
+
+def sq_variance(means, window=WINDOW, chunk_size=None):
+    """
+    The squared distance of each global mean from its trailing rolling mean, in units of the rolling
+    standard deviation. Timesteps where the mean is zero or NaN, or the rolling standard deviation is
+    zero, are given a variance of zero
+
+    Parameters:
+        means (array like): the global mean at each timestep, anything that can be sliced along its first
+            axis. If there are any other axes the maximum across them is used
+        window (int): the number of timesteps in the rolling window
+        chunk_size (int): if given only this many timesteps, plus the window before them, are read at once
+    Returns:
+        numpy array of the variance at each timestep
+    """
+    size = len(means)
+    chunk_size = chunk_size or size
+    vmax = np.zeros(size)
+    for begin in range(0, size, chunk_size):
+        end = min(begin + chunk_size, size)
+        # the window before the chunk is read along with it so the rolling stats carry across the boundary
+        halo = max(begin - window + 1, 0)
+        values = np.asarray(means[halo: end], dtype=np.float64)
+        if values.ndim > 1:
+            values = values.reshape(values.shape[0], -1).max(axis=1)
+        mean, std = rolling_stats(values, window)
+        values, mean, std = values[begin - halo:], mean[begin - halo:], std[begin - halo:]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            variance = ((values - mean) / std) ** 2
+        skip = (values == 0) | ~np.isfinite(variance) | ~(std > 0)
+        vmax[begin: end] = np.where(skip, 0.0, variance)
+    return vmax
+
+
+def variance_issues(means, times, dataset_id, window=WINDOW, chunk_size=None):
+    """
+    Find the timesteps with a zero global mean, or whose squared variance is more then 3 standard deviations
+    above the average
+
+    Parameters:
+        means (array like): the global mean at each timestep
+        times (array like): the time coordinate, used to label the issues
+        dataset_id (str): the dataset the means are from
+        window (int): the number of timesteps in the rolling window
+        chunk_size (int): the number of timesteps to evaluate at once
+    Returns:
+        vmax (numpy array) the variance at each timestep, issues (list), threshold (float)
+    """
+    vmax = sq_variance(means, window, chunk_size)
     threshold = 3 * vmax.std() + vmax.mean()
-    for idx, v in enumerate(vmax):
-        if v >= threshold:
-            issues.append(
-                f"\tmax variance issue found for {dataset_id} at {str( ds['time'][idx].item() )[:7]}")
-    return vmax, issues, segment, threshold
-
-def check_sq_variance(dataset_path, dataset_id, variable, pngpath, pbar, debug=False):
-    issues = []
-    client = get_client()
-    num_segments = 10
-    pbar.total = num_segments + 2
-    if pbar.n != 0:
-        pbar.n = 0
-        pbar.last_print_n = 0
-        pbar.update()
-
-    contents = os.listdir(dataset_path)
-    if not contents:
-        raise ValueError(f"Empty dataset directory {dataset_path}")
-    with xr.open_mfdataset(dataset_path + '/*.nc') as ds:
-
-        segments = list(
-            range(0, ds['time'].size, ds['time'].size//num_segments))
-        vmax = np.zeros(ds['time'].size)
-        futures = []
-        
-        if 'time' not in ds.coords:
-            return [], dataset_id
-        
-        dims = list()
-        possible_dims = ['depth', 'lat', 'lon', 'plev', 'tau', 'lev', 'sector']
-        for i in possible_dims:
-            if i in ds.dims:
-                if i == 'sector':
-                    dims.append('basin')
-                else:
-                    dims.append(i)
-        
-        dims = tuple(dims)
-        if 'lat' not in dims and 'lon' not in dims:
-            ds['means'] = ds[variable]
-            # maxrollingstd = client.compute( ds['means'].std ).result()
-            # maxrollingvar = client.compute( ds['means'].mean ).result()
-        else:
-            ds['means'] = client.compute( ds[variable].mean(dim=dims) ).result()
-            # maxrollingstd = ds['means'].std().compute()
-            # maxrollingvar = ds['means'].mean().compute()
-            # maxrollingstd = client.compute( ds['means'].std ).result()
-            # maxrollingvar = client.compute( ds['means'].mean ).result()
-        # import ipdb; ipdb.set_trace()
-        ds['means'] = ds['means'][~np.isnan(ds['means'])]
-        pbar.update(1)
-           
-        maxrollingvar = client.compute( ds['means'].rolling({'time':120}, min_periods=1).mean() )
-        maxrollingstd = client.compute( ds['means'].rolling({'time':120}, min_periods=1).std() )
-        for idx, seg in enumerate(segments):
-            if idx == num_segments - 1:
-                seg_end = ds['time'].size
-            else:
-                seg_end = segments[idx + 1]
-
-            temp_ds = ds['time'][seg: seg_end]
-            chunk = ds.sel(time=temp_ds)
-            futures.append(
-                client.submit(
-                    run_chunk, 
-                        chunk, 
-                        dataset_id, 
-                        maxrollingvar, 
-                        maxrollingstd, 
-                        (seg, seg_end), 
-                        idx))
-
-        for f in as_completed(futures):
-            pbar.update(1)
-            vx, issues, seg, threshold = f.result()
-            vmax[seg[0]: seg[1]] = vx
-        plot_minmaxmean(pngpath, ds, vmax, dataset_id, debug=debug)
 
+    chunk_size = chunk_size or len(means) or 1
+    zeros = list()
+    for begin in range(0, len(means), chunk_size):
+        values = np.asarray(means[begin: begin + chunk_size])
+        if values.ndim > 1:
+            values = values.reshape(values.shape[0], -1).max(axis=1)
+        zeros.extend(np.flatnonzero(values == 0) + begin)
+    outliers = np.flatnonzero((vmax >= threshold) & (vmax > 0))
+
+    issues = [f"\tZero data issue found for {dataset_id} at {str(times[idx])[:7]}"
+              for idx in zeros]
+    issues.extend(f"\tmax variance issue found for {dataset_id} at {str(times[idx])[:7]}"
+                  for idx in outliers)
+    return vmax, issues, threshold
+
+
+def check_sq_variance(dataset_path, dataset_id, variable, pngpath, pbar=None, debug=False, chunk_size=TIME_CHUNK, cache=None, plots_queue=None):
+    """
+    Flag the timesteps of a dataset whose global mean is zero, or is far from its ten year rolling
+    mean, and plot the global means along with their variance
+
+    Parameters:
+        dataset_path (str): path to the directory holding the dataset's netCDF files
+        dataset_id (str): the dataset_id, used in the issues and plot title
+        variable (str): the variable to check
+        pngpath (str): where to save the plot
+        pbar (tqdm): optional progress bar, updated once per block of timesteps read
+        chunk_size (int): the number of timesteps to evaluate at once
+        cache (MeanCache): where to find the global means, defaults to the one in ~/.esgfpub/means
+        plots_queue (PlotQueue): queue the plot to be drawn in the background, by default it's drawn before returning
+    Returns:
+        list of issues
+    """
+    cache = cache if cache is not None else MeanCache()
+    means = cache.global_mean(dataset_path, variable, pbar=pbar)
+    if means is None:
+        return []
+
+    vmax, issues, _ = variance_issues(means.values, means['time'].values, dataset_id, chunk_size=chunk_size)
+    values = means.values
+    if values.ndim > 1:
+        values = values.reshape(values.shape[0], -1).max(axis=1)
+    series = {
+        'means': xr.DataArray(values, dims=['time'], coords={'time': means['time']}, attrs=means.attrs),
+        'vmax': xr.DataArray(vmax, dims=['time'], coords={'time': means['time']})}
+    if plots_queue is not None:
+        plots_queue.submit(plots.render_minmaxmean, pngpath, series, title=dataset_id)
+    else:
+        plots.render_minmaxmean(pngpath, series, title=dataset_id)
     return issues
 
 
 def plot_global(dataset, variable, pngpath, dataset_id, debug=False):
-    
-    m = Basemap(projection="eck4",lon_0=0,resolution='c')
-    m.drawcoastlines()
-    m.fillcontinents(color='coral',lake_color='aqua')
-    m.drawparallels(np.arange(-90.,120.,30.))
-    m.drawmeridians(np.arange(0.,360.,60.))
-    m.drawmapboundary(fill_color='aqua')
-    ny = dataset[variable].shape[0]
-    nx = dataset[variable].shape[1]
-    lons, lats = m.makegrid(nx, ny)
-    x, y = m(lons, lats)
-    m.contourf(x, y, dataset[variable])
-    plt.title(variable)
-    plt.plot(variable)
-    plt.savefig(pngpath, dpi=100)
-
-
-def plot_seasonal_decomp(dataset_path, dataset_id, variable, pngpath, debug=False):
-
-    contents = os.listdir(dataset_path)
-    if not contents:
-        raise ValueError(f"Empty dataset directory {dataset_path}")
-    
-    # open the multi-file dataset, combining the files by their coords
-    ds = xr.open_mfdataset(f'{dataset_path}/*.nc', combine='by_coords')
-
-    # if the variable doesn't have a time axis, just plot whatever's there
-    if 'time' not in ds[variable].coords and 'time' not in ds[variable].dims:
-        plot_global(ds, variable, pngpath, debug)
-        return []
-
-    # find the dimensions to average over
-    possible_dims = ['depth', 'lat', 'lon', 'plev', 'tau', 'lev', 'sector']    
-    dims = tuple(x if x != 'sector' else 'basin' for x in ds.dims if x in possible_dims)
+    """
+    Draw a variable without a time axis on a map, see plots.render_global
+    """
+    return plots.render_global(pngpath, {'field': dataset[variable]}, title=variable)
+
+
+def seasonal_decomp(dataset_path, variable, cache=None):
+    """
+    Decompose the global means of a dataset into its trend and residual, and flag
+    the timesteps whose residual is more then 5 standard deviations from the mean
+
+    Returns:
+        issues (list), and the series to plot. For a variable without a time axis there are no
+        issues, and the series is the variable itself so it can be drawn on a map
+    """
+    # the global means are only computed from the source files the first time, after
+    # that they're read back from the dataset's sidecar in the cache
+    cache = cache if cache is not None else MeanCache()
+    meanvalues = cache.global_mean(dataset_path, variable)
+
+    if meanvalues is None:
+        with xr.open_mfdataset(f'{dataset_path}/*.nc', combine='by_coords') as ds:
+            return [], {'field': ds[variable].load()}
 
-    meanvalues = ds[variable].mean(dims).compute()
     mpd = meanvalues.to_pandas()
 
     # compute the seasonal decomposition
+    import statsmodels.api as sm
     decomposition = sm.tsa.seasonal_decompose(mpd, model='additive', period=12)
-
-    # produce the plot
-    fig, axes = plt.subplots(3)
-    plt.suptitle(dataset_id)
-
-    fig.set_size_inches(15, 10)
-    fig.tight_layout(pad=5.0)
-
-    xtick_positions = [i for i, t in enumerate(ds['time']) if i % (120) == 0]
-    xtick_values = [t.values.item().strftime('%Y') for i, t in enumerate(ds['time']) if i % (120) == 0]
-    # plt.xticks(xtick_positions, xtick_values)
-    plt.setp(axes, xticks=xtick_positions, xticklabels=xtick_values)
-    plt.xlabel('year')
-
-    # top plot is global mean
-    axes[0].set_title(f'global {variable} mean')
-    axes[0].plot(meanvalues)
-
-    # second plot is seasonality - mean
     trend = decomposition.trend[:].to_xarray()
-    axes[1].set_title('trend')
-    axes[1].plot(trend)
-
-    # thrid plot is the residual
     resid = decomposition.resid[:].to_xarray()
-    axes[2].set_title('residual')
-    axes[2].plot(resid, 'o')
-
-    plt.savefig(pngpath, dpi=100)
 
     rstd = np.std(resid)
     rmean = np.mean(resid)
     diff = rstd * 5
     # flag anything thats outside 5x away from the std as a potential issue
     issues = [f"{variable} - {r.time.values.item().strftime('%Y-%m')}" for r in resid if r > rmean + diff or r < rmean - diff]
-    return issues
+    return issues, {'means': meanvalues, 'trend': trend, 'resid': resid}
 
 
+def plot_seasonal_decomp(dataset_path, dataset_id, variable, pngpath, debug=False, cache=None):
+
+    issues, series = seasonal_decomp(dataset_path, variable, cache)
+    plots.render_seasonal_decomp(pngpath, series, title=dataset_id, variable=variable)
+    return issues
 
-def verify_dataset(dataset_path, dataset_id, variable, output, debug=False):
+
+def verify_dataset(dataset_path, dataset_id, variable, output, debug=False, cache=None):
 
     issues = list()
     if not os.path.exists(output):
         os.makedirs(output)
 
     pngpath = os.path.join(output, f"{dataset_id}.png")
-    return plot_seasonal_decomp(dataset_path, dataset_id, variable, pngpath, debug)
-    # return check_sq_variance(dataset_path, dataset_id, variable, pngpath, pbar, debug)
+    return plot_seasonal_decomp(dataset_path, dataset_id, variable, pngpath, debug, cache=cache)
+
+
+def verify_task(dataset_path, dataset_id, variable, cache_settings):
+    """
+    Verify one dataset on a worker process without drawing its plot, so the plot
+    can be rendered somewhere else from the small series that are returned
+
+    Parameters:
+        cache_settings (dict): the keyword arguments to make the worker's MeanCache with
+    Returns:
+        dataset_id (str), issues (list), series (dict) to pass to plots.render_seasonal_decomp
+    """
+    issues, series = seasonal_decomp(dataset_path, variable, MeanCache(**cache_settings))
+    return dataset_id, issues, series
+
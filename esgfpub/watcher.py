@@ -0,0 +1,111 @@
+"""
+Wait for new files to show up in a directory, using inotify where it's
+available and falling back to polling the directory mtime everywhere else
+"""
+import os
+import sys
+import ctypes
+import ctypes.util
+import select
+from time import sleep, monotonic
+
+# from sys/inotify.h
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+
+
+def load_inotify():
+    """
+    Returns the libc handle if the inotify calls can be used on this system, otherwise None
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class DirectoryWatcher(object):
+    """
+    Block until a file has been written or moved into a directory
+
+    Parameters:
+        path (str): the directory to watch
+        interval (float): seconds between checks when falling back to polling
+        use_inotify (bool): set to False to always poll
+    """
+
+    def __init__(self, path, interval=30, use_inotify=True):
+        self.path = path
+        self.interval = interval
+        self.fd = None
+        self.mtime = self._mtime()
+
+        libc = load_inotify() if use_inotify else None
+        if libc is not None:
+            fd = libc.inotify_init()
+            if fd >= 0:
+                wd = libc.inotify_add_watch(
+                    fd, os.fsencode(path), IN_CLOSE_WRITE | IN_MOVED_TO)
+                if wd >= 0:
+                    self.fd = fd
+                else:
+                    os.close(fd)
+
+    @property
+    def mode(self):
+        return 'inotify' if self.fd is not None else 'polling'
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def wait(self, timeout=None):
+        """
+        Wait for the directory to change
+
+        Parameters:
+            timeout (float): the longest to wait in seconds, None waits until something changes
+        Returns:
+            True if the directory changed, False if the timeout ran out first
+        """
+        if self.fd is not None:
+            readable, _, _ = select.select([self.fd], [], [], timeout)
+            if not readable:
+                return False
+            # drain the queued events, the caller re-lists the directory anyway
+            while readable:
+                os.read(self.fd, 64 * 1024)
+                readable, _, _ = select.select([self.fd], [], [], 0)
+            return True
+
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            mtime = self._mtime()
+            if mtime != self.mtime:
+                self.mtime = mtime
+                return True
+            if deadline is not None:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    return False
+                sleep(min(self.interval, remaining))
+            else:
+                sleep(self.interval)
@@ -0,0 +1,62 @@
+"""
+A local HTTP server standing in for the ESGF web services in the tests
+"""
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+
+class StandIn(object):
+    """
+    Serve requests on a free local port from a handler function, recording every request made
+
+    Parameters:
+        handler (callable): called with (method, path, params, body) for every request, and returns
+            (status, body), where the body is a str, or anything else to be sent as json
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.requests = list()
+        self.lock = threading.Lock()
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def respond(self, method):
+                parts = urlsplit(self.path)
+                params = {k: v[0] for k, v in parse_qs(parts.query).items()}
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length).decode() if length else ''
+                with standin.lock:
+                    standin.requests.append((method, parts.path, params, body))
+                status, content = standin.handler(method, parts.path, params, body)
+                if not isinstance(content, str):
+                    content = json.dumps(content)
+                content = content.encode()
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def do_GET(self):
+                self.respond('GET')
+
+            def do_POST(self):
+                self.respond('POST')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
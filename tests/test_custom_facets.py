@@ -0,0 +1,100 @@
+import unittest
+from urllib.parse import parse_qs
+from xml.etree import ElementTree
+from standin import StandIn
+from esgfpub.custom_facets import FacetUpdater
+
+DATA_NODE = 'esgf-data2.llnl.gov'
+DATASETS = [f'E3SM.1_0.historical.1deg_atm_60-30km_ocean.atmos.180x360.climo.ens{idx}.v1' for idx in range(1, 5)]
+FACETS = {'campaign': 'DECK-v1', 'science_driver': 'Water Cycle'}
+
+
+def parse_update(body):
+    """
+    Returns the dataset id and the facets set by a ws/update document
+    """
+    update = ElementTree.fromstring(body).find('update')
+    dataset_id = update.find('query').text.split('=', 1)[1]
+    facets = {field.get('name'): field.find('value').text for field in update.findall('field')}
+    return dataset_id, facets
+
+
+def updater(standin, **kwargs):
+    return FacetUpdater(f'{standin.url}/esg-search', data_node=DATA_NODE, timeout=5, **kwargs)
+
+
+class TestFacetUpdater(unittest.TestCase):
+
+    def test_batched_updates(self):
+        with StandIn(lambda *args: (200, 'ok')) as standin:
+            with updater(standin) as facet_updater:
+                count, errors = facet_updater.update_all(DATASETS, FACETS)
+        self.assertEqual((count, errors), (len(DATASETS), []))
+        self.assertEqual(len(standin.requests), len(DATASETS))
+        updated = dict()
+        for method, path, _, body in standin.requests:
+            self.assertEqual((method, path), ('POST', '/esg-search/ws/update'))
+            dataset_id, facets = parse_update(body)
+            updated[dataset_id] = facets
+        self.assertEqual(updated, {f'{d}|{DATA_NODE}': FACETS for d in DATASETS})
+
+    def test_falls_back_to_update_by_id(self):
+        for status in [404, 405, 501]:
+            with self.subTest(status=status):
+                def handler(method, path, params, body):
+                    if path.endswith('/ws/update'):
+                        return status, 'unsupported'
+                    return 200, 'ok'
+
+                with StandIn(handler) as standin:
+                    with updater(standin, max_requests=1) as facet_updater:
+                        count, errors = facet_updater.update_all(DATASETS, FACETS)
+                self.assertEqual((count, errors), (len(DATASETS), []))
+                self.assertFalse(facet_updater.batch)
+                # only the first dataset tries the batch endpoint
+                self.assertEqual([r[1] for r in standin.requests].count('/esg-search/ws/update'), 1)
+                by_id = [parse_qs(r[3]) for r in standin.requests if r[1] == '/esg-search/ws/updateById']
+                self.assertEqual(len(by_id), len(DATASETS) * len(FACETS))
+                for fields in by_id:
+                    self.assertEqual(fields['action'], ['set'])
+                    self.assertEqual(fields['value'], [FACETS[fields['field'][0]]])
+
+    def test_retries_server_errors(self):
+        for status in [429, 500, 503]:
+            with self.subTest(status=status):
+                failed = set()
+
+                def handler(method, path, params, body):
+                    # every dataset fails once before it's updated
+                    dataset_id, _ = parse_update(body)
+                    if dataset_id not in failed:
+                        failed.add(dataset_id)
+                        return status, 'try again'
+                    return 200, 'ok'
+
+                with StandIn(handler) as standin:
+                    with updater(standin) as facet_updater:
+                        count, errors = facet_updater.update_all(DATASETS, FACETS)
+                self.assertEqual((count, errors), (len(DATASETS), []))
+                self.assertEqual(len(standin.requests), 2 * len(DATASETS))
+
+    def test_collects_errors(self):
+        failing = {f'{DATASETS[0]}|{DATA_NODE}': 403, f'{DATASETS[1]}|{DATA_NODE}': 503}
+
+        def handler(method, path, params, body):
+            dataset_id, _ = parse_update(body)
+            return failing.get(dataset_id, 200), 'denied'
+
+        with StandIn(handler) as standin:
+            with updater(standin, retries=1) as facet_updater:
+                count, errors = facet_updater.update_all(DATASETS, FACETS)
+        self.assertEqual(count, len(DATASETS))
+        self.assertEqual(len(errors), 2)
+        self.assertTrue(any(DATASETS[0] in e and '403' in e for e in errors))
+        # the server error is retried once, then reported
+        self.assertTrue(any(DATASETS[1] in e for e in errors))
+        self.assertEqual(len(standin.requests), len(DATASETS) + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+from esgfpub.filenames import parse_filename
+from esgfpub.checker import check_monthly
+
+
+class TestParseFilename(unittest.TestCase):
+
+    def test_time_slice_with_underscores_in_case(self):
+        # a case name with five underscores, from scripts/bart_cfgs/Archive_Map
+        name = '20190509.A_WCYCL1950S_CMIP6_LRtunedHR.ne30_oECv3_ICG.cori-knl.cam.h0.0001-01.nc'
+        parsed = parse_filename(name)
+        self.assertEqual(parsed.kind, 'time-slice')
+        self.assertEqual(parsed.case, '20190509.A_WCYCL1950S_CMIP6_LRtunedHR.ne30_oECv3_ICG.cori-knl')
+        self.assertEqual(parsed.component, 'cam')
+        self.assertEqual(parsed.stream, 'h0')
+        self.assertEqual(parsed.start, '0001-01')
+        self.assertEqual(parsed.prefix, '20190509.A_WCYCL1950S_CMIP6_LRtunedHR.ne30_oECv3_ICG.cori-knl.cam.h0.')
+
+    def test_check_monthly_with_underscores_in_case(self):
+        prefix = '/data/20190509.A_WCYCL1950S_CMIP6_LRtunedHR.ne30_oECv3_ICG.cori-knl.cam.h0.'
+        files = [f'{prefix}{year:04d}-{month:02d}.nc' for year in range(1, 3) for month in range(1, 13)]
+        missing, extra = check_monthly(files[1:], 1, 2)
+        self.assertEqual(missing, [files[0]])
+        self.assertEqual(extra, [])
+
+    def test_cmip(self):
+        parsed = parse_filename('pbo_Omon_E3SM-1-1-ECA_hist-bgc_r1i1p1f1_gr_185001-185412.nc')
+        self.assertEqual(parsed.kind, 'cmip')
+        self.assertEqual(parsed.variable, 'pbo')
+        self.assertEqual(parsed.stream, 'Omon')
+        self.assertEqual(parsed.grid, 'gr')
+        self.assertEqual((parsed.start_year, parsed.end_year), (1850, 1854))
+
+    def test_cmip_fixed(self):
+        parsed = parse_filename('areacella_fx_E3SM-1-0_historical_r1i1p1f1_gr.nc')
+        self.assertEqual(parsed.kind, 'cmip')
+        self.assertIsNone(parsed.start)
+
+
+if __name__ == '__main__':
+    unittest.main()
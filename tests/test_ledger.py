@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+from esgfpub.ledger import Ledger
+from esgfpub.plots import PlotQueue
+
+DATASET_ID = 'CMIP6.CMIP.E3SM-Project.E3SM-1-0.historical.r1i1p1f1.Amon.tas.gr#v20190101'
+
+
+class TestLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.ledger = Ledger(os.path.join(self.tmp.name, 'ledger.sqlite'))
+        self.pngpath = os.path.join(self.tmp.name, f'{DATASET_ID}.png')
+        self.plots = PlotQueue(num_workers=0).output_paths(self.pngpath)
+        self.series = PlotQueue(num_workers=0, skip_render=True).output_paths(self.pngpath)
+
+    def tearDown(self):
+        self.ledger.close()
+        self.tmp.cleanup()
+
+    def touch(self, path):
+        with open(path, 'w'):
+            pass
+
+    def test_changed_fingerprint(self):
+        self.ledger.record(DATASET_ID, 'abc', ['issue'])
+        self.assertEqual(self.ledger.unchanged(DATASET_ID, 'abc'), ['issue'])
+        self.assertIsNone(self.ledger.unchanged(DATASET_ID, 'def'))
+
+    def test_plot_wanted_after_run_without_plots(self):
+        self.ledger.record(DATASET_ID, 'abc', [])
+        self.assertIsNone(self.ledger.unchanged(DATASET_ID, 'abc', self.plots))
+
+    def test_plot_wanted_after_skipped_plots(self):
+        series = os.path.join(self.tmp.name, f'{DATASET_ID}.nc')
+        self.touch(series)
+        self.ledger.record(DATASET_ID, 'abc', [], series)
+        self.assertEqual(self.ledger.unchanged(DATASET_ID, 'abc', self.series), [])
+        self.assertIsNone(self.ledger.unchanged(DATASET_ID, 'abc', self.plots))
+
+    def test_plot_removed(self):
+        self.touch(self.pngpath)
+        self.ledger.record(DATASET_ID, 'abc', [], self.pngpath)
+        self.assertEqual(self.ledger.unchanged(DATASET_ID, 'abc', self.plots), [])
+        os.remove(self.pngpath)
+        self.assertIsNone(self.ledger.unchanged(DATASET_ID, 'abc', self.plots))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import xarray as xr
+from esgfpub.means import MeanCache
+
+DATASET = os.path.join('CMIP6', 'CMIP', 'E3SM-Project', 'E3SM-1-0', 'historical', 'r1i1p1f1', 'Amon', 'tas', 'gr', 'v20190101')
+
+
+def write_dataset(root):
+    """
+    Write a small two file CMIP6 dataset, returning the path to its version directory
+    """
+    dataset_path = os.path.join(root, DATASET)
+    os.makedirs(dataset_path)
+    lat = np.linspace(-60, 60, 4)
+    lon = np.linspace(0, 270, 4)
+    for year in range(2):
+        time = np.arange(year * 12, (year + 1) * 12, dtype=np.float64) + 0.5
+        ds = xr.Dataset(
+            {'tas': (('time', 'lat', 'lon'), np.full((12, 4, 4), 280.0 + year))},
+            coords={'time': ('time', time, {'units': 'days since 1850-01-01', 'calendar': 'noleap'}),
+                    'lat': lat, 'lon': lon})
+        name = f'tas_Amon_E3SM-1-0_historical_r1i1p1f1_gr_{1850 + year}01-{1850 + year}12.nc'
+        ds.to_netcdf(os.path.join(dataset_path, name))
+    return dataset_path
+
+
+class TestMeanCache(unittest.TestCase):
+
+    def test_reads_sidecar_without_variable(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            dataset_path = write_dataset(os.path.join(tmp, 'data'))
+            cache = MeanCache(root=os.path.join(tmp, 'means'))
+            means = cache.global_mean(dataset_path, 'tas')
+            self.assertEqual((cache.hits, cache.misses), (0, 1))
+            cached = cache.global_mean(dataset_path)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+            np.testing.assert_allclose(cached.values, means.values)
+
+    def test_recomputes_changed_dataset(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            dataset_path = write_dataset(os.path.join(tmp, 'data'))
+            cache = MeanCache(root=os.path.join(tmp, 'means'))
+            cache.global_mean(dataset_path)
+            os.remove(os.path.join(dataset_path, sorted(os.listdir(dataset_path))[-1]))
+            means = cache.global_mean(dataset_path)
+            self.assertEqual((cache.hits, cache.misses), (0, 2))
+            self.assertEqual(means.sizes['time'], 12)
+
+
+if __name__ == '__main__':
+    unittest.main()
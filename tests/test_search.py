@@ -0,0 +1,84 @@
+import re
+import unittest
+from fnmatch import fnmatch
+from standin import StandIn
+from esgfpub.search import SearchClient
+
+DATASET = 'CMIP6.CMIP.E3SM-Project.E3SM-1-0.historical.r1i1p1f1.Amon.{}.gr.v20190101'
+
+
+def file_doc(variable, idx, data_node='esgf-data2.llnl.gov'):
+    dataset_id = DATASET.format(variable)
+    name = f'{variable}_Amon_E3SM-1-0_historical_r1i1p1f1_gr_{idx:04d}01-{idx:04d}12.nc'
+    url = f'http://{data_node}/thredds/fileServer/{dataset_id.replace(".", "/")}/{name}'
+    return {
+        'id': f'{dataset_id}.{name}|{data_node}',
+        'instance_id': f'{dataset_id}.{name}',
+        'dataset_id': f'{dataset_id}|{data_node}',
+        'data_node': data_node,
+        'url': [f'{url}|application/netcdf|HTTPServer']
+    }
+
+
+def search_endpoint(docs):
+    """
+    A search endpoint serving the documents whose dataset_id matches one of the query terms, one page at a time
+    """
+    def handler(method, path, params, body):
+        terms = re.match(r'dataset_id:\((.*)\)$', params['query']).group(1).split(' OR ')
+        terms = [re.sub(r'\\(.)', r'\1', t) for t in terms]
+        matched = [d for d in docs if any(fnmatch(d['dataset_id'].split('|')[0], t) for t in terms)]
+        if params.get('sort') == 'id asc':
+            matched.sort(key=lambda d: d['id'])
+        offset, limit = int(params['offset']), int(params['limit'])
+        return 200, {'response': {'numFound': len(matched), 'docs': matched[offset: offset + limit]}}
+    return handler
+
+
+class TestSearchClient(unittest.TestCase):
+
+    def test_batches_dataset_ids(self):
+        docs = [file_doc(v, 1) for v in ['tas', 'ts', 'pr', 'psl', 'hfls']]
+        dataset_ids = [DATASET.format(v) for v in ['tas', 'ts', 'pr', 'psl', 'hfls']]
+        with StandIn(search_endpoint(docs)) as standin:
+            with SearchClient(search_api=standin.url, batch_size=2) as client:
+                found = client.find_files(dataset_ids)
+        self.assertEqual(len(standin.requests), 3)
+        self.assertEqual(standin.requests[0][2]['query'].count(' OR '), 1)
+        for dataset_id in dataset_ids:
+            self.assertEqual(len(found[dataset_id]), 1)
+
+    def test_pages_in_sorted_order(self):
+        docs = [file_doc('tas', idx) for idx in range(1, 8)]
+        with StandIn(search_endpoint(list(reversed(docs)))) as standin:
+            with SearchClient(search_api=standin.url, page_size=3) as client:
+                found = client.find_files([DATASET.format('tas')])
+        self.assertEqual([r[2]['offset'] for r in standin.requests], ['0', '3', '6'])
+        self.assertTrue(all(r[2]['sort'] == 'id asc' for r in standin.requests))
+        self.assertEqual(len(found[DATASET.format('tas')]), 7)
+
+    def test_wildcard_patterns(self):
+        docs = [file_doc(v, 1) for v in ['tas', 'ts', 'pr']]
+        pattern = 'CMIP6.CMIP.E3SM-Project.E3SM-1-0.*.r1i1p1f1.Amon.t'
+        with StandIn(search_endpoint(docs)) as standin:
+            with SearchClient(search_api=standin.url) as client:
+                found = client.find_files([pattern])
+        self.assertEqual(len(found[pattern]), 2)
+
+    def test_replicas_reported_once(self):
+        docs = [file_doc('tas', 1, 'aims3.llnl.gov'),
+                file_doc('tas', 1, 'esgf-data2.llnl.gov'),
+                file_doc('tas', 1, 'esgf.nci.org.au'),
+                file_doc('tas', 2, 'esgf.nci.org.au')]
+        with StandIn(search_endpoint(docs)) as standin:
+            with SearchClient(search_api=standin.url) as client:
+                found = client.find_files([DATASET.format('tas')])
+        urls = found[DATASET.format('tas')]
+        self.assertEqual(len(urls), 2)
+        # the replica from the highest priority data node is kept
+        self.assertTrue(any(url.startswith('http://esgf-data2.llnl.gov/') for url in urls))
+        self.assertFalse(any(url.startswith('http://aims3.llnl.gov/') for url in urls))
+
+
+if __name__ == '__main__':
+    unittest.main()
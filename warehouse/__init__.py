@@ -76,20 +76,23 @@ def path_to_id(path):
     return '.'.join(path.split(os.sep)[5:])
 
 
-def get_version_dirs(rootpath, mode):
+def get_version_dirs(rootpath, mode, manifest=None):
     """
     Find the version directory paths relative to the root. Allowed mode values are:
         all - find all versions
         empty - find version directories with no files
         nonempty - find version directories that have files
+    If a Manifest is given the tree is walked through it, so only directories that
+    changed since the last walk are read from disk
     """
     allowed_modes = ['all', 'empty', 'nonempty']
     if mode not in allowed_modes:
         raise ValueError(
             f'mode {mode} not in set of allowed modes {allowed_modes}')
 
+    walk = manifest.walk if manifest is not None else os.walk
     selected = []
-    for root, dirs, files in os.walk(rootpath):
+    for root, dirs, files in walk(rootpath):
         # if its a leaf directory, then it should be the version directory
         if not dirs:
             selected.append(root)
@@ -99,14 +102,14 @@ def get_version_dirs(rootpath, mode):
     elif mode == 'empty':
         empty = []
         for item in selected:
-            for root, dirs, files in os.walk(item):
+            for root, dirs, files in walk(item):
                 if not files:
                     empty.append(item)
         return empty
     elif mode == 'nonempty':
         nonempty = []
         for item in selected:
-            for root, dirs, files in os.walk(item):
+            for root, dirs, files in walk(item):
                 if files:
                     nonempty.append(item)
         return nonempty
@@ -115,11 +118,11 @@ def get_version_dirs(rootpath, mode):
             f'Not recognized mode: {mode}, shouldnt ever get here')
 
 
-def get_ensemble_dirs(warehouse_root, print_paths=False, paths_out=None):
+def get_ensemble_dirs(warehouse_root, print_paths=False, paths_out=None, manifest=None):
     """
     get ALL warehouse ensemble directories
     """
-    version_dirs = get_version_dirs(warehouse_root, "all")
+    version_dirs = get_version_dirs(warehouse_root, "all", manifest=manifest)
     if print_paths:
         print_file_list(paths_out, version_dirs)
 
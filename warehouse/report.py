@@ -1,4 +1,5 @@
 from datetime import datetime
+from esgfpub.manifest import Manifest, MANIFEST
 from warehouse.util import print_file_list
 from warehouse import (
     parse_args,
@@ -15,10 +16,18 @@ def report(args):
     paths_out = f'warehouse_paths-{ts}'
     stats_out = f'warehouse_status-{ts}'
 
-    ensembles = get_ensemble_dirs(
-        warehouse_root=args.root,
-        print_paths=args.paths,
-        paths_out=paths_out)
+    manifest = None
+    if args.use_manifest:
+        manifest = Manifest(args.manifest_path or MANIFEST)
+    try:
+        ensembles = get_ensemble_dirs(
+            warehouse_root=args.root,
+            print_paths=args.paths,
+            paths_out=paths_out,
+            manifest=manifest)
+    finally:
+        if manifest is not None:
+            manifest.close()
 
     wh_datasets = load_ds_status_list(ensembles)
     status_list = produce_status_listing_vcounts(wh_datasets)
@@ -48,6 +57,14 @@ def add_report_args(parser):
         action="store_true",
         help="Write out a file containing all the dataset paths",
         default=False)
+    report_parser.add_argument(
+        '--use-manifest',
+        action="store_true",
+        help="Walk the warehouse through the filesystem manifest, only directories that changed since the last run are re-read",
+        default=False)
+    report_parser.add_argument(
+        '--manifest-path',
+        help="Path to the filesystem manifest, default is ~/.esgfpub/manifest.sqlite")
     return 'report', report_parser
 
 def check_report_args(args):